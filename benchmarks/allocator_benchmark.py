@@ -0,0 +1,28 @@
+import argparse
+import os
+import subprocess
+import tempfile
+import timeit
+
+from benchmarks.programs import build_executable, build_string_program
+
+
+def time_string_declarations(string_counts, repeat):
+    print(f"{'strings':>10} {'time':>10} {'per string':>12}")
+    for string_count in string_counts:
+        with tempfile.TemporaryDirectory() as build_dir:
+            executable = build_executable(build_string_program(string_count), os.path.join(build_dir, "out"))
+            run_time = min(timeit.repeat(lambda: subprocess.run([executable], stdout=subprocess.DEVNULL),
+                                         number=1, repeat=repeat))
+        print(f"{string_count:>10} {run_time:>9.4f}s {run_time / string_count * 1e9:>10.1f}ns")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--string-counts", type=int, nargs="+", default=[1000, 5000, 20000],
+                            help="Numbers of mutable strings the generated programs declare.")
+    arg_parser.add_argument("--repeat", type=int, default=5,
+                            help="Number of times to repeat each run. The best time is reported.")
+    args = arg_parser.parse_args()
+
+    time_string_declarations(args.string_counts, args.repeat)
@@ -0,0 +1,39 @@
+import argparse
+import os
+import tempfile
+import timeit
+
+from benchmarks.programs import build_executable, build_string_program
+
+
+SAMPLE_PROGRAM_DIR = os.path.join(os.path.dirname(__file__), "..", "sample_programs")
+BUILD_SAMPLE_PROGRAMS = ["hello_world", "rule_110", "loop_with_vars"]
+BACKENDS = ["nasm", "elf"]
+
+
+def time_build(lines, backend, repeat):
+    with tempfile.TemporaryDirectory() as build_dir:
+        return min(timeit.repeat(lambda: build_executable(lines, os.path.join(build_dir, "out"), backend), number=1, repeat=repeat))
+
+
+def compare_backends(programs, repeat):
+    print(f"{'program':>24} {'nasm':>10} {'elf':>10} {'speedup':>8}")
+    for name, lines in programs:
+        times = {backend: time_build(lines, backend, repeat) for backend in BACKENDS}
+        print(f"{name:>24} {times['nasm']:>9.4f}s {times['elf']:>9.4f}s {times['nasm'] / times['elf']:>7.2f}x")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--strings", type=int, default=5000,
+                            help="Number of strings declared in the large generated program.")
+    arg_parser.add_argument("--repeat", type=int, default=5,
+                            help="Number of times to repeat each build. The best time is reported.")
+    args = arg_parser.parse_args()
+
+    programs = []
+    for name in BUILD_SAMPLE_PROGRAMS:
+        with open(os.path.join(SAMPLE_PROGRAM_DIR, f"{name}.ktna")) as program_file:
+            programs.append((name, program_file.readlines()))
+    programs.append((f"{args.strings}_strings", build_string_program(args.strings)))
+    compare_backends(programs, args.repeat)
@@ -0,0 +1,50 @@
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import timeit
+
+
+KATANA_PATH = os.path.join(os.path.dirname(__file__), "..", "katana", "katana.py")
+SAMPLE_PROGRAM_DIR = os.path.join(os.path.dirname(__file__), "..", "sample_programs")
+CACHE_SAMPLE_PROGRAMS = ["hello_world", "rule_110", "loop_with_vars"]
+
+
+def time_runs(program_path, backend, repeat):
+    """
+    Time `--run` on a program without the cache and then with the build
+    already cached, which only has to copy the build out and run it.
+    """
+    with tempfile.TemporaryDirectory() as work_dir:
+        # Keep the cache for the benchmark away from the real one.
+        env = dict(os.environ, XDG_CACHE_HOME=work_dir)
+        command = [sys.executable, os.path.abspath(KATANA_PATH), "--program", os.path.abspath(program_path),
+                   "--run", f"--backend={backend}"]
+
+        def run(*extra_args):
+            subprocess.run(command + list(extra_args), cwd=work_dir, env=env, stdout=subprocess.DEVNULL, check=True)
+
+        uncached_time = min(timeit.repeat(lambda: run("--no-cache"), number=1, repeat=repeat))
+        run()
+        cached_time = min(timeit.repeat(run, number=1, repeat=repeat))
+    return uncached_time, cached_time
+
+
+def compare_cached_runs(programs, backend, repeat):
+    print(f"{'program':>24} {'uncached':>10} {'cached':>10} {'speedup':>8}")
+    for name, program_path in programs:
+        uncached_time, cached_time = time_runs(program_path, backend, repeat)
+        print(f"{name:>24} {uncached_time:>9.4f}s {cached_time:>9.4f}s {uncached_time / cached_time:>7.2f}x")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--backend", choices=["nasm", "elf"], default="nasm",
+                            help="Backend the programs are built with.")
+    arg_parser.add_argument("--repeat", type=int, default=5,
+                            help="Number of times to repeat each run. The best time is reported.")
+    args = arg_parser.parse_args()
+
+    programs = [(name, os.path.join(SAMPLE_PROGRAM_DIR, f"{name}.ktna")) for name in CACHE_SAMPLE_PROGRAMS]
+    compare_cached_runs(programs, args.backend, args.repeat)
@@ -0,0 +1,32 @@
+import argparse
+import os
+import subprocess
+import tempfile
+import timeit
+
+from benchmarks.programs import build_executable, build_copy_str_program
+
+
+def time_copies(string_lens, bytes_copied, repeat):
+    print(f"{'length':>10} {'copies':>8} {'time':>10} {'per copy':>12} {'GB/s':>8}")
+    for string_len in string_lens:
+        copy_count = max(bytes_copied // string_len, 1)
+        with tempfile.TemporaryDirectory() as build_dir:
+            executable = build_executable(build_copy_str_program(string_len, copy_count), os.path.join(build_dir, "out"))
+            run_time = min(timeit.repeat(lambda: subprocess.run([executable], stdout=subprocess.DEVNULL),
+                                         number=1, repeat=repeat))
+        print(f"{string_len:>10} {copy_count:>8} {run_time:>9.4f}s {run_time / copy_count * 1e6:>10.2f}us "
+              f"{string_len * copy_count / run_time / 1e9:>8.2f}")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--string-lens", type=int, nargs="+", default=[1024, 16384, 262144, 1048576],
+                            help="Lengths of the strings that are copied.")
+    arg_parser.add_argument("--bytes-copied", type=int, default=256 * 1024 * 1024,
+                            help="Roughly how many bytes each program copies in total.")
+    arg_parser.add_argument("--repeat", type=int, default=5,
+                            help="Number of times to repeat each run. The best time is reported.")
+    args = arg_parser.parse_args()
+
+    time_copies(args.string_lens, args.bytes_copied, args.repeat)
@@ -0,0 +1,41 @@
+import argparse
+import timeit
+
+from benchmarks.programs import build_flat_expression_program, build_nested_expression_program
+from katana.katana import Lexer, Parser, Program
+
+
+def time_parse(lines, repeat):
+    # Lexing is done up front so only the parser is timed.
+    def parse():
+        parser = Parser(token_list)
+        parser.parse()
+
+    token_list = Lexer(Program(lines)).lex()
+    return len(token_list), min(timeit.repeat(parse, number=1, repeat=repeat))
+
+
+def print_timing(label, size, lines, repeat):
+    token_count, total = time_parse(lines, repeat)
+    print(f"{label:>8} {size:>6} {total:>9.4f}s {total / token_count * 1e6:>10.2f}us")
+
+
+def check_expression_scaling(sizes, line_count, repeat):
+    print(f"{'shape':>8} {'size':>6} {'total':>10} {'per token':>11}")
+    for size in sizes:
+        print_timing("flat", size, build_flat_expression_program(size, line_count), repeat)
+    for size in sizes:
+        print_timing("nested", size, build_nested_expression_program(size, line_count), repeat)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 500],
+                            help="Number of terms for flat lines and depth of parens for nested lines.")
+    arg_parser.add_argument("--line-count", type=int, default=100,
+                            help="Number of expression lines in each generated program.")
+    arg_parser.add_argument("--repeat", type=int, default=3,
+                            help="Number of times to repeat each timing. The best time is reported.")
+    args = arg_parser.parse_args()
+
+    check_expression_scaling(args.sizes, args.line_count, args.repeat)
@@ -0,0 +1,29 @@
+import argparse
+import timeit
+
+from benchmarks.programs import build_var_program
+from katana.katana import Lexer, Program
+
+
+def check_variable_count_scaling(variable_counts, repeat):
+    """
+    Lex programs that declare and then reference more and more variables. If
+    looking up an identifier doesn't depend on how many variables exist the
+    time per variable should stay roughly constant.
+    """
+    print(f"{'variables':>10} {'total':>10} {'per variable':>14}")
+    for variable_count in variable_counts:
+        lines = build_var_program(variable_count * 2)
+        total = min(timeit.repeat(lambda: Lexer(Program(lines)).lex(), number=1, repeat=repeat))
+        print(f"{variable_count:>10} {total:>9.4f}s {total / variable_count * 1e6:>12.1f}us")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--variables", type=int, nargs="+", default=[1000, 5000, 20000],
+                            help="Number of variables declared in each generated program.")
+    arg_parser.add_argument("--repeat", type=int, default=3,
+                            help="Number of times to repeat each timing. The best time is reported.")
+    args = arg_parser.parse_args()
+
+    check_variable_count_scaling(args.variables, args.repeat)
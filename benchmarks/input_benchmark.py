@@ -0,0 +1,55 @@
+import argparse
+import tempfile
+import timeit
+import tracemalloc
+
+from benchmarks.programs import build_var_program
+from katana.katana import MappedProgram, Program
+
+
+def read_lines(path):
+    with open(path) as code:
+        return Program(code.readlines())
+
+
+def map_lines(path):
+    with open(path) as code:
+        return MappedProgram(code)
+
+
+PROGRAM_LOADERS = {
+    "readlines": read_lines,
+    "mmap": map_lines,
+}
+
+
+def measure_loader(loader, path, repeat):
+    load_time = min(timeit.repeat(lambda: loader(path), number=1, repeat=repeat))
+    tracemalloc.start()
+    program = loader(path)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del program
+    return load_time, size
+
+
+def compare_loaders(line_counts, repeat):
+    print(f"{'lines':>10} {'loader':>10} {'load time':>10} {'memory':>10}")
+    for line_count in line_counts:
+        with tempfile.NamedTemporaryFile("w", suffix=".ktna") as program_file:
+            program_file.writelines(build_var_program(line_count))
+            program_file.flush()
+            for name, loader in PROGRAM_LOADERS.items():
+                load_time, size = measure_loader(loader, program_file.name, repeat)
+                print(f"{line_count:>10} {name:>10} {load_time:>9.4f}s {size / 1024:>8.0f}KB")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--lines", type=int, nargs="+", default=[10000, 100000, 500000],
+                            help="Sizes of the generated programs to load.")
+    arg_parser.add_argument("--repeat", type=int, default=3,
+                            help="Number of times to repeat each timing. The best time is reported.")
+    args = arg_parser.parse_args()
+
+    compare_loaders(args.lines, args.repeat)
@@ -0,0 +1,49 @@
+import argparse
+import timeit
+
+from benchmarks.programs import build_long_line_program, build_var_program
+from katana.katana import FastLexer, Lexer, Program
+
+
+LEXERS = {
+    "default": Lexer,
+    "fast": FastLexer,
+}
+
+
+def time_lexer(lexer_class, lines, repeat):
+    return min(timeit.repeat(lambda: lexer_class(Program(lines)).lex(), number=1, repeat=repeat))
+
+
+def compare_lexers(line_count, repeat):
+    lines = build_var_program(line_count)
+    print(f"Lexing {len(lines)} lines")
+    for name, lexer_class in LEXERS.items():
+        print(f"{name:>10}: {time_lexer(lexer_class, lines, repeat):.4f}s")
+
+
+def check_line_length_scaling(line_lengths, repeat):
+    """
+    Lex a single line of increasing length. If the lexer is linear in the
+    length of the line the time per character should stay roughly constant.
+    """
+    print(f"{'length':>10} {'lexer':>10} {'total':>10} {'per char':>12}")
+    for line_length in line_lengths:
+        lines = build_long_line_program(line_length)
+        for name, lexer_class in LEXERS.items():
+            total = time_lexer(lexer_class, lines, repeat)
+            print(f"{line_length:>10} {name:>10} {total:>9.4f}s {total / line_length * 1e9:>10.1f}ns")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--lines", type=int, default=20000,
+                            help="Number of lines in the generated program.")
+    arg_parser.add_argument("--line-lengths", type=int, nargs="+", default=[1000, 10000, 100000],
+                            help="Lengths of the single long line used to check scaling.")
+    arg_parser.add_argument("--repeat", type=int, default=3,
+                            help="Number of times to repeat each timing. The best time is reported.")
+    args = arg_parser.parse_args()
+
+    compare_lexers(args.lines, args.repeat)
+    check_line_length_scaling(args.line_lengths, args.repeat)
@@ -0,0 +1,41 @@
+import argparse
+import os
+import subprocess
+import tempfile
+import timeit
+
+from benchmarks.programs import build_executable, build_nested_loop_program
+
+
+SAMPLE_PROGRAM_DIR = os.path.join(os.path.dirname(__file__), "..", "sample_programs")
+LOOP_SAMPLE_PROGRAMS = ["rule_110", "loop_index_access", "loop_with_vars"]
+
+
+def time_run(lines, register_loops, repeat):
+    with tempfile.TemporaryDirectory() as build_dir:
+        executable = build_executable(lines, os.path.join(build_dir, "out"), register_loops=register_loops)
+        return min(timeit.repeat(lambda: subprocess.run([executable], stdout=subprocess.DEVNULL), number=1, repeat=repeat))
+
+
+def compare_loop_indices(programs, repeat):
+    print(f"{'program':>24} {'memory':>10} {'registers':>10} {'speedup':>8}")
+    for name, lines in programs:
+        memory_time = time_run(lines, False, repeat)
+        register_time = time_run(lines, True, repeat)
+        print(f"{name:>24} {memory_time:>9.4f}s {register_time:>9.4f}s {memory_time / register_time:>7.2f}x")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--loop-counts", type=int, nargs=2, default=[1000, 10000],
+                            help="Outer and inner counts of the generated nested loop program.")
+    arg_parser.add_argument("--repeat", type=int, default=5,
+                            help="Number of times to repeat each run. The best time is reported.")
+    args = arg_parser.parse_args()
+
+    programs = []
+    for name in LOOP_SAMPLE_PROGRAMS:
+        with open(os.path.join(SAMPLE_PROGRAM_DIR, f"{name}.ktna")) as program_file:
+            programs.append((name, program_file.readlines()))
+    programs.append(("nested_loops", build_nested_loop_program(*args.loop_counts)))
+    compare_loop_indices(programs, args.repeat)
@@ -0,0 +1,46 @@
+import argparse
+import copy
+import timeit
+
+from benchmarks.programs import build_macro_program
+from katana.katana import Lexer, Parser, Program
+
+
+def time_parse(lines, repeat):
+    # Lexing is done up front so only the parser is timed.
+    def parse():
+        parser = Parser(token_list)
+        parser.parse()
+
+    token_list = Lexer(Program(lines)).lex()
+    return min(timeit.repeat(parse, number=1, repeat=repeat))
+
+
+def time_expansion(lines, reference_count, repeat):
+    """
+    Compare stamping out the macro body against deep copying it.
+    """
+    parser = Parser(Lexer(Program(lines)).lex())
+    parser.parse()
+    macro_node = parser.get_nodes()[0]
+    template = parser.macros[macro_node.name_node.value]
+
+    deepcopy_time = min(timeit.repeat(lambda: copy.deepcopy(macro_node.children_nodes), number=reference_count, repeat=repeat))
+    expand_time = min(timeit.repeat(template.expand, number=reference_count, repeat=repeat))
+    return deepcopy_time, expand_time
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--references", type=int, default=10000,
+                            help="Number of times main references the macro.")
+    arg_parser.add_argument("--repeat", type=int, default=3,
+                            help="Number of times to repeat each timing. The best time is reported.")
+    args = arg_parser.parse_args()
+
+    lines = build_macro_program(args.references)
+    print(f"{args.references} macro references")
+    print(f"parse    {time_parse(lines, args.repeat):.4f}s")
+    deepcopy_time, expand_time = time_expansion(lines, args.references, args.repeat)
+    print(f"deepcopy {deepcopy_time:.4f}s {deepcopy_time / args.references * 1e6:.2f}us per reference")
+    print(f"expand   {expand_time:.4f}s {expand_time / args.references * 1e6:.2f}us per reference")
@@ -0,0 +1,39 @@
+import argparse
+import os
+import subprocess
+import tempfile
+import timeit
+
+from benchmarks.programs import build_executable, build_nested_loop_program
+
+
+OVERFLOW_CHECKS = ["call", "inline"]
+
+
+def time_run(lines, overflow_checks, repeat):
+    with tempfile.TemporaryDirectory() as build_dir:
+        # Loop indices are kept in registers so the run time is mostly the additions.
+        executable = build_executable(lines, os.path.join(build_dir, "out"), register_loops=True,
+                                      overflow_checks=overflow_checks)
+        return min(timeit.repeat(lambda: subprocess.run([executable], stdout=subprocess.DEVNULL), number=1, repeat=repeat))
+
+
+def compare_overflow_checks(addition_count, repeat):
+    # Two loops of a thousand each do a million additions without the loop
+    # counts going past what fits in a number literal.
+    outer_count = max(addition_count // 1000, 1)
+    lines = build_nested_loop_program(outer_count, addition_count // outer_count)
+    times = {overflow_checks: time_run(lines, overflow_checks, repeat) for overflow_checks in OVERFLOW_CHECKS}
+    print(f"{'additions':>10} {'call':>10} {'inline':>10} {'speedup':>8}")
+    print(f"{addition_count:>10} {times['call']:>9.4f}s {times['inline']:>9.4f}s {times['call'] / times['inline']:>7.2f}x")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--additions", type=int, default=1000000,
+                            help="Number of additions the generated loop does.")
+    arg_parser.add_argument("--repeat", type=int, default=5,
+                            help="Number of times to repeat each run. The best time is reported.")
+    args = arg_parser.parse_args()
+
+    compare_overflow_checks(args.additions, args.repeat)
@@ -0,0 +1,36 @@
+import argparse
+import os
+import timeit
+
+from benchmarks.programs import build_scaled_program
+from katana.katana import Lexer, Parser, Program
+
+
+DEFAULT_PROGRAM = os.path.join(os.path.dirname(__file__), "..", "sample_programs", "rule_110.ktna")
+
+
+def time_parse(lines, repeat):
+    # Lexing is done up front so only the parser is timed.
+    def parse():
+        parser = Parser(token_list)
+        parser.parse()
+
+    token_list = Lexer(Program(lines)).lex()
+    return len(token_list), min(timeit.repeat(parse, number=1, repeat=repeat))
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--program", default=DEFAULT_PROGRAM,
+                            help="Program whose main method is scaled up. Defaults to rule_110.")
+    arg_parser.add_argument("--scale", type=int, default=100,
+                            help="Number of times to repeat the body of the main method.")
+    arg_parser.add_argument("--repeat", type=int, default=5,
+                            help="Number of times to repeat each timing. The best time is reported.")
+    args = arg_parser.parse_args()
+
+    with open(args.program) as program_file:
+        lines = build_scaled_program(program_file.readlines(), args.scale)
+    token_count, total = time_parse(lines, args.repeat)
+    print(f"{len(lines)} lines, {token_count} tokens")
+    print(f"parse {total:.4f}s, {total / token_count * 1e6:.2f}us per token")
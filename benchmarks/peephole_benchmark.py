@@ -0,0 +1,49 @@
+import argparse
+import contextlib
+import io
+import os
+
+from katana.katana import Compiler, Lexer, Parser, Program, optimize_assembly, parse_asm_line
+
+
+DEFAULT_PROGRAM_DIR = os.path.join(os.path.dirname(__file__), "..", "sample_programs")
+
+
+def count_instructions(asm):
+    # Comments, labels and data are left out since they don't run.
+    return sum(1 for line in asm if (parsed := parse_asm_line(line)) and parsed[0])
+
+
+def compile_program(lines):
+    parser = Parser(Lexer(Program(lines)).lex())
+    parser.parse()
+    return Compiler(parser.get_nodes()).get_compiled_program().splitlines(keepends=True)
+
+
+def compare_instruction_counts(program_dir):
+    print(f"{'program':>40} {'before':>8} {'after':>8} {'removed':>8}")
+    total_before = total_after = 0
+    for program in sorted(os.listdir(program_dir)):
+        with open(os.path.join(program_dir, program)) as program_file:
+            lines = program_file.readlines()
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                asm = compile_program(lines)
+        except (Exception, SystemExit):
+            # Programs that are meant to fail compiling have nothing to count.
+            continue
+        before = count_instructions(asm)
+        after = count_instructions(optimize_assembly(asm))
+        total_before += before
+        total_after += after
+        print(f"{program.split('.')[0]:>40} {before:>8} {after:>8} {(before - after) / before:>8.1%}")
+    print(f"{'total':>40} {total_before:>8} {total_after:>8} {(total_before - total_after) / total_before:>8.1%}")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--program-dir", default=DEFAULT_PROGRAM_DIR,
+                            help="Directory of programs to compile. Defaults to the sample programs.")
+    args = arg_parser.parse_args()
+
+    compare_instruction_counts(args.program_dir)
@@ -0,0 +1,29 @@
+import argparse
+import os
+import subprocess
+import tempfile
+import timeit
+
+from benchmarks.programs import build_executable, build_print_loop_program
+
+
+def time_printing(number_count, repeat):
+    outer_count = max(number_count // 1000, 1)
+    lines = build_print_loop_program(outer_count, number_count // outer_count)
+    with tempfile.TemporaryDirectory() as build_dir:
+        executable = build_executable(lines, os.path.join(build_dir, "out"))
+        run_time = min(timeit.repeat(lambda: subprocess.run([executable], stdout=subprocess.DEVNULL),
+                                     number=1, repeat=repeat))
+    print(f"{'numbers':>10} {'time':>10} {'per number':>12}")
+    print(f"{number_count:>10} {run_time:>9.4f}s {run_time / number_count * 1e9:>10.1f}ns")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--numbers", type=int, default=1000000,
+                            help="How many numbers the generated program prints.")
+    arg_parser.add_argument("--repeat", type=int, default=5,
+                            help="Number of times to repeat each run. The best time is reported.")
+    args = arg_parser.parse_args()
+
+    time_printing(args.numbers, args.repeat)
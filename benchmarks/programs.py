@@ -0,0 +1,182 @@
+"""
+Helpers for building large synthetic Katana programs to benchmark against
+and for building executables from them.
+"""
+import subprocess
+
+from katana.katana import ConstantFolder, Compiler, Lexer, Parser, Program, write_elf_executable
+
+
+def build_executable(lines, output, backend="nasm", **compiler_options):
+    """
+    Build the lines of a program into an executable at `output` the same way
+    `--run` does, with the assembly written next to it. `compiler_options`
+    are the options the Compiler takes like `register_loops`.
+    """
+    parser = Parser(Lexer(Program(lines)).lex())
+    parser.parse()
+    compiler = Compiler(ConstantFolder(parser.get_nodes()).fold(), **compiler_options)
+    compiler.output_path = f"{output}.asm"
+    compiled_program = compiler.get_compiled_program()
+    compiler.write_compiled_program(compiled_program)
+    if backend == "elf":
+        write_elf_executable(compiled_program, output)
+    else:
+        subprocess.run(["nasm", "-f", "elf64", "-o", f"{output}.o", f"{output}.asm"], check=True)
+        subprocess.run(["ld", "-o", output, f"{output}.o"], check=True)
+    return output
+
+
+def build_var_program(line_count):
+    """
+    Build a `main` method that declares a variable and then prints some
+    arithmetic on it, repeated until there are `line_count` lines of code.
+    """
+    lines = ["main() {\n"]
+    for i in range(line_count // 2):
+        lines.append(f"    int64 var{i} = {i}; // Declare var {i}\n")
+        lines.append(f"    printl(var{i} + {i} * 2);\n")
+    lines.append("}\n")
+    return lines
+
+
+def build_long_line_program(line_length):
+    """
+    Build a `main` method with a single expression that is roughly
+    `line_length` characters long followed by a comment.
+    """
+    terms = " + ".join(["1"] * max(line_length // 4, 1))
+    return [
+        "main() {\n",
+        f"    printl({terms}); // Long row\n",
+        "}\n",
+    ]
+
+
+def build_nested_expression_program(depth, line_count):
+    """
+    Build a `main` method with `line_count` lines that each hold an
+    arithmetic expression nested `depth` parens deep.
+    """
+    expression = "1"
+    for i in range(depth):
+        op = "+" if i % 2 == 0 else "*"
+        expression = f"({expression} {op} 2)"
+    return ["main() {\n"] + [f"    2 * {expression};\n"] * line_count + ["}\n"]
+
+
+def build_flat_expression_program(term_count, line_count):
+    """
+    Build a `main` method with `line_count` lines that each hold an
+    arithmetic expression of `term_count` terms with no parens.
+    """
+    ops = ["+", "*", "-", "/"]
+    expression = "1" + "".join(f" {ops[i % len(ops)]} 2" for i in range(term_count - 1))
+    return ["main() {\n"] + [f"    {expression};\n"] * line_count + ["}\n"]
+
+
+def build_scaled_program(lines, scale):
+    """
+    Build a program from the lines of an existing `main` method with the body
+    of `main` repeated `scale` times.
+    """
+    start = next(i for i, line in enumerate(lines) if line.startswith("main("))
+    end = max(i for i, line in enumerate(lines) if line.startswith("}"))
+    return lines[:start + 1] + lines[start + 1:end] * scale + lines[end:]
+
+
+def build_macro_program(reference_count):
+    """
+    Build a program with a small macro that `main` references
+    `reference_count` times.
+    """
+    lines = [
+        "MACRO printSum {\n",
+        "    print(3 + 4 * 2);\n",
+        "    printl(\" is the sum\");\n",
+        "}\n",
+        "main() {\n",
+    ]
+    lines.extend(["    printSum;\n"] * reference_count)
+    lines.append("}\n")
+    return lines
+
+
+def build_nested_loop_program(outer_count, inner_count):
+    """
+    Build a `main` method that counts up through two nested loops so nearly
+    all of its run time is spent in the loops.
+    """
+    return [
+        "main() {\n",
+        "    int64 total = 0;\n",
+        f"    loopUp({outer_count}) {{\n",
+        f"        loopUp({inner_count}) {{\n",
+        "            total = total + 1;\n",
+        "        }\n",
+        "    }\n",
+        "    printl(total);\n",
+        "}\n",
+    ]
+
+
+def build_print_loop_program(outer_count, inner_count):
+    """
+    Build a `main` method that counts up through two nested loops and prints
+    the running total on every pass so most of its run time is printing.
+    """
+    return [
+        "main() {\n",
+        "    int64 total = 0;\n",
+        f"    loopUp({outer_count}) {{\n",
+        f"        loopUp({inner_count}) {{\n",
+        "            total = total + 1;\n",
+        "            printl(total);\n",
+        "        }\n",
+        "    }\n",
+        "}\n",
+    ]
+
+
+def build_string_program(string_count):
+    """
+    Build a `main` method that declares `string_count` mutable strings and
+    prints the last one.
+    """
+    lines = ["main() {\n"]
+    for i in range(string_count):
+        lines.append(f"    string text{i} = \"String number {i}\";\n")
+    lines.append(f"    printl(text{string_count - 1});\n")
+    lines.append("}\n")
+    return lines
+
+
+def build_copy_str_program(string_len, copy_count):
+    """
+    Build a `main` method that copies one mutable string of `string_len`
+    characters into another `copy_count` times.
+    """
+    return [
+        "main() {\n",
+        f"    string source = \"{'a' * string_len}\";\n",
+        f"    string dest = \"{'b' * string_len}\";\n",
+        f"    loopUp({copy_count}) {{\n",
+        "        copyStr(source, dest);\n",
+        "    }\n",
+        "}\n",
+    ]
+
+
+def build_print_string_program(string_len, print_count, is_const):
+    """
+    Build a `main` method that prints a string of `string_len` characters
+    `print_count` times.
+    """
+    return [
+        "main() {\n",
+        f"    {'const ' if is_const else ''}string text = \"{'a' * string_len}\";\n",
+        f"    loopUp({print_count}) {{\n",
+        "        print(text);\n",
+        "    }\n",
+        "}\n",
+    ]
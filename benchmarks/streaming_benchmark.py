@@ -0,0 +1,46 @@
+import argparse
+import collections
+import tempfile
+import tracemalloc
+
+from benchmarks.programs import build_var_program
+from katana.katana import Lexer, Program, StreamingProgram
+
+
+def peak_memory(fn):
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def lex_all(path):
+    with open(path) as code:
+        Lexer(Program(code.readlines())).lex()
+
+
+def lex_streaming(path):
+    with open(path) as code:
+        # Drain the tokens without holding on to them.
+        collections.deque(Lexer(StreamingProgram(code)).iter_tokens(), maxlen=0)
+
+
+def compare_peak_memory(line_counts):
+    print(f"{'lines':>10} {'lex':>12} {'iter_tokens':>12}")
+    for line_count in line_counts:
+        with tempfile.NamedTemporaryFile("w", suffix=".ktna") as program_file:
+            program_file.writelines(build_var_program(line_count))
+            program_file.flush()
+            lex_peak = peak_memory(lambda: lex_all(program_file.name))
+            stream_peak = peak_memory(lambda: lex_streaming(program_file.name))
+        print(f"{line_count:>10} {lex_peak / 1024:>10.0f}KB {stream_peak / 1024:>10.0f}KB")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--lines", type=int, nargs="+", default=[1000, 10000, 50000],
+                            help="Sizes of the generated programs to lex.")
+    args = arg_parser.parse_args()
+
+    compare_peak_memory(args.lines)
@@ -0,0 +1,33 @@
+import argparse
+import os
+import subprocess
+import tempfile
+import timeit
+
+from benchmarks.programs import build_executable, build_print_string_program
+
+
+def time_string_prints(string_lens, print_count, repeat):
+    print(f"{'length':>10} {'const':>10} {'mutable':>10}")
+    for string_len in string_lens:
+        times = []
+        for is_const in (True, False):
+            with tempfile.TemporaryDirectory() as build_dir:
+                executable = build_executable(build_print_string_program(string_len, print_count, is_const),
+                                              os.path.join(build_dir, "out"))
+                times.append(min(timeit.repeat(lambda: subprocess.run([executable], stdout=subprocess.DEVNULL),
+                                               number=1, repeat=repeat)))
+        print(f"{string_len:>10} {times[0]:>9.4f}s {times[1]:>9.4f}s")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--string-lens", type=int, nargs="+", default=[100, 1000, 10000],
+                            help="Lengths of the strings that are printed.")
+    arg_parser.add_argument("--prints", type=int, default=10000,
+                            help="How many times each program prints its string.")
+    arg_parser.add_argument("--repeat", type=int, default=5,
+                            help="Number of times to repeat each run. The best time is reported.")
+    args = arg_parser.parse_args()
+
+    time_string_prints(args.string_lens, args.prints, args.repeat)
@@ -0,0 +1,41 @@
+import argparse
+import timeit
+import tracemalloc
+
+from benchmarks.programs import build_var_program
+from katana.katana import Lexer, Parser, Program
+
+
+def measure_token_memory(lines):
+    tracemalloc.start()
+    token_list = Lexer(Program(lines)).lex()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return len(token_list), size
+
+
+def lex_and_parse(lines):
+    parser = Parser(Lexer(Program(lines)).lex())
+    parser.parse()
+
+
+def measure_tokens(line_count, repeat):
+    lines = build_var_program(line_count)
+    token_count, size = measure_token_memory(lines)
+    lex_time = min(timeit.repeat(lambda: Lexer(Program(lines)).lex(), number=1, repeat=repeat))
+    lex_parse_time = min(timeit.repeat(lambda: lex_and_parse(lines), number=1, repeat=repeat))
+    print(f"Tokens:           {token_count}")
+    print(f"Token memory:     {size / 1024:.0f}KB ({size / token_count:.0f} bytes per token)")
+    print(f"Lex time:         {lex_time:.4f}s")
+    print(f"Lex + parse time: {lex_parse_time:.4f}s")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--lines", type=int, default=20000,
+                            help="Number of lines in the generated program.")
+    arg_parser.add_argument("--repeat", type=int, default=3,
+                            help="Number of times to repeat each timing. The best time is reported.")
+    args = arg_parser.parse_args()
+
+    measure_tokens(args.lines, args.repeat)
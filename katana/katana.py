@@ -1,7 +1,21 @@
 import argparse
-import copy
+import array
+import collections
+import contextlib
+import hashlib
+import io
+import itertools
+import json
+import mmap
 import os
+import re
+import shlex
+import shutil
+import struct
 import sys
+import tempfile
+import time
+import tracemalloc
 
 # TODO(map) Move all the classes and enums outs so imports are nice
 #########
@@ -146,6 +160,17 @@ CONTINUATION_TOKENS = (
     NEW_LINE_TOKEN_TYPE
 )
 IGNORE_TOKENS = (SPACE_TOKEN_TYPE, COLON_TOKEN_TYPE)
+EXPRESSION_PAREN_PREFIX_TOKENS = (
+    ASSIGNMENT_TOKEN_TYPE,
+    DIVIDE_TOKEN_TYPE,
+    EQUAL_TOKEN_TYPE,
+    GREATER_THAN_TOKEN_TYPE,
+    LEFT_PAREN_TOKEN_TYPE,
+    LESS_THAN_TOKEN_TYPE,
+    MINUS_TOKEN_TYPE,
+    MULTIPLY_TOKEN_TYPE,
+    PLUS_TOKEN_TYPE,
+)
 IGNORE_OPS = (
     SPACE_TOKEN_TYPE,
     FUNCTION_ARG_SEPARATOR_TYPE_TOKEN_TYPE,
@@ -157,6 +182,41 @@ FUNCTION_KEYWORDS = (PRINT, PRINTL, MAIN, CHAR_AT, UPDATE_CHAR, COPY_STR)
 LOGIC_KEYWORDS = (IF, ELSE, I_LOOP_UP, I_LOOP_DOWN, I_LOOP_FROM, LOOP_UP, LOOP_DOWN, LOOP_FROM)
 VARIABLE_KEYWORDS = (CONST, INT_8, INT_16, INT_32, INT_64, STRING, BOOL, CHAR)
 INT_KEYWORDS = (INT_8, INT_16, INT_32, INT_64)
+# Largest value a variable of each int type can be declared with.
+INT_MAX_VALUES = {
+    INT_8: 255,
+    INT_16: 65536,
+    INT_32: 4294967296,
+    INT_64: 14294967296, # TODO(map) Get the right number
+}
+# Number of bits the overflow check for each int type adds with.
+INT_BIT_WIDTHS = {INT_8: 8, INT_16: 16, INT_32: 32, INT_64: 64}
+# Built once so checking if an identifier is a keyword is a single lookup.
+LANGUAGE_KEYWORDS = frozenset(FUNCTION_KEYWORDS + VARIABLE_KEYWORDS + LOGIC_KEYWORDS)
+BOOLEAN_VALUES = frozenset(("true", "false"))
+
+###################
+# Fast Lexer Tables
+###################
+# Characters that always become the same token no matter where they show up,
+# mapped to the token type and priority the lexer would give them.
+SINGLE_CHAR_TOKENS = {
+    "+": (PLUS_TOKEN_TYPE, MEDIUM),
+    "-": (MINUS_TOKEN_TYPE, MEDIUM),
+    "*": (MULTIPLY_TOKEN_TYPE, HIGH),
+    "/": (DIVIDE_TOKEN_TYPE, HIGH),
+    ">": (GREATER_THAN_TOKEN_TYPE, HIGH),
+    "<": (LESS_THAN_TOKEN_TYPE, HIGH),
+    "}": (RIGHT_CURL_BRACE_TOKEN_TYPE, VERY_HIGH),
+    ";": (EOL_TOKEN_TYPE, LOW),
+}
+# Runs of characters that can be consumed in one step. New lines are left out
+# of the whitespace run because they need to be checked for termination.
+SPACE_RUN = "space"
+WORD_RUN = "word"
+NUM_RUN = "num"
+RUN_PATTERN = re.compile(
+    rf"(?P<{SPACE_RUN}>[ \t\r\x0b\x0c]+)|(?P<{WORD_RUN}>[A-Za-z][A-Za-z0-9]*)|(?P<{NUM_RUN}>[0-9]+)")
 
 ##################
 # Assignment Types
@@ -537,10 +597,25 @@ class EmptyMacroException(Exception):
         return self.line_num == other.line_num and self.col_num == other.col_num
 
 
+class UnsupportedAssemblyError(Exception):
+    def __init__(self, line_num, line, reason):
+        super().__init__("Unsupported assembly")
+        self.line_num = line_num + 1
+        self.line = line
+        self.reason = reason
+
+    def __str__(self):
+        return f"Cannot encode '{self.line}' on line {self.line_num} of the assembly: {self.reason}."
+
+
 ########
 # TOKENS
 ########
 class Token:
+    # There are a lot of tokens in any decent sized program so skip the per
+    # instance `__dict__`.
+    __slots__ = ("ttype", "col", "row", "value", "priority")
+
     def __init__(self, ttype, col, row, value, priority):
         self.ttype = ttype
         self.col = col
@@ -594,6 +669,27 @@ class Node:
             return False
 
 
+def iter_child_fields(node):
+    """
+    Yield the name and value of each attribute of `node` that holds a child
+    node or a list that can hold them, like the body of a loop.
+    """
+    for attr, value in node.__dict__.items():
+        if attr != "parent_node" and isinstance(value, (Node, list)):
+            yield attr, value
+
+
+def iter_child_nodes(node):
+    """
+    Yield every node directly under `node`, in the order of its attributes.
+    """
+    for _, value in iter_child_fields(node):
+        if isinstance(value, Node):
+            yield value
+        else:
+            yield from (item for item in value if isinstance(item, Node))
+
+
 class NoOpNode(Node):
     """
     Node that functionally does nothing. This is in case I want to preserve
@@ -1707,6 +1803,153 @@ class Program:
         return self.curr_line + 1 < self.line_count + 1
 
 
+class LineWindow:
+    """
+    Holds the most recent lines read from a program while still letting them
+    be looked up by their line number in the whole program. Slicing returns
+    whatever part of the requested range is still in the window, which is all
+    that is needed to show the lines leading up to an error.
+    """
+
+    def __init__(self, size):
+        self.lines = collections.deque(maxlen=size)
+        self.start = 0
+
+    def append(self, line):
+        if len(self.lines) == self.lines.maxlen:
+            self.start += 1
+        self.lines.append(line)
+
+    def __len__(self):
+        return self.start + len(self.lines)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            start = max((idx.start or 0) - self.start, 0)
+            stop = max((len(self) if idx.stop is None else idx.stop) - self.start, 0)
+            return list(self.lines)[start:stop]
+        if idx < self.start:
+            raise IndexError(f"Line {idx} is no longer in the window")
+        return self.lines[idx - self.start]
+
+
+class StreamingProgram(Program):
+    """
+    Program that reads its lines from a file object one at a time as the
+    lexer asks for them instead of reading the whole file up front. Only the
+    last `window_size` lines are kept for error messages.
+    """
+
+    def __init__(self, code, window_size=16):
+        self.code = code
+        self.lines = LineWindow(window_size)
+        self.curr_col = -1
+        self.curr_line = 0
+        self.curr_line_text = ""
+        self.curr_line_len = 0
+        self.line_count = 0
+        self.read_line()
+
+    def read_line(self):
+        line = self.code.readline()
+        if line:
+            self.lines.append(line)
+            self.line_count += 1
+            self.curr_line_text = line
+            self.curr_line_len = len(line)
+
+    def advance_line(self):
+        self.curr_col = -1
+        self.curr_line += 1
+        self.read_line()
+
+    def get_curr_char(self):
+        return self.curr_line_text[self.curr_col]
+
+    def get_next_char(self):
+        return self.curr_line_text[self.curr_col + 1]
+
+    def get_curr_line(self):
+        return self.curr_line_text
+
+
+class MappedLines:
+    """
+    Read only sequence of the lines in a memory mapped file. Only the offset
+    that each line starts at is stored and a line is only decoded into a
+    string when it is asked for.
+    """
+
+    def __init__(self, mapped):
+        self.mapped = mapped
+        # Each line starts where the one before it ended so the offsets are a
+        # running total of the line lengths.
+        mapped.seek(0)
+        line_lengths = map(len, iter(mapped.readline, b""))
+        self.offsets = array.array("Q", itertools.chain((0,), itertools.accumulate(line_lengths)))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self.get_line(line_num) for line_num in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(f"Line {idx} is out of range")
+        return self.get_line(idx)
+
+    def get_line(self, line_num):
+        line = self.mapped[self.offsets[line_num]:self.offsets[line_num + 1]].decode()
+        # Match the new lines that reading the file in text mode would give.
+        if line.endswith("\r\n"):
+            line = line[:-2] + "\n"
+        return line
+
+
+class MappedProgram(Program):
+    """
+    Program backed by a memory mapped file rather than a list of lines read
+    up front. Only the current line is kept as a string.
+    """
+
+    def __init__(self, code):
+        self.mapped = mmap.mmap(code.fileno(), 0, access=mmap.ACCESS_READ)
+        self.lines = MappedLines(self.mapped)
+        self.curr_col = -1
+        self.curr_line = 0
+        self.curr_line_text = self.lines[0]
+        self.curr_line_len = len(self.curr_line_text)
+        self.line_count = len(self.lines)
+        self.end_pos = len(self.mapped)
+
+    def advance_line(self):
+        self.curr_col = -1
+        self.curr_line += 1
+        if self.has_next_line():
+            self.curr_line_text = self.lines[self.curr_line]
+            self.curr_line_len = len(self.curr_line_text)
+
+    def get_curr_char(self):
+        return self.curr_line_text[self.curr_col]
+
+    def get_next_char(self):
+        return self.curr_line_text[self.curr_col + 1]
+
+    def get_curr_line(self):
+        return self.curr_line_text
+
+    def close(self):
+        self.mapped.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
 ########
 # UTILS
 ########
@@ -1730,15 +1973,29 @@ class Lexer:
     def __init__(self, program):
         self.program = program
         self.token_list = []
-        self.left_paren_idx_list = []
-        self.right_paren_idx_list = []
-        self.if_idx_list = []
-        self.else_idx_list = []
-        self.macro_name_list = []
-        self.variable_name_list = []
+        # Whether NEW_LINE_TOKEN_TYPE tokens are kept in the token list. They
+        # are only useful for debugging so streaming drops them right away.
+        self.keep_new_lines = True
+        # Running information about the tokens seen so far so the checks don't
+        # need to look back through the whole token list.
+        self.token_count = 0
+        self.brace_depth = 0
+        self.prev_token = None
+        self.prev_non_new_line_token = None
+        self.last_left_paren = None
+        self.token_before_last_left_paren = None
+        self.last_paren_token = None
+        self.misplaced_else_token = None
+        # The position of each `if` and `else` keyword along with how many
+        # braces were open at the time.
+        self.if_positions = []
+        self.else_positions = []
+        self.macro_names = set()
+        self.variable_names = set()
         self.unpaired_parens = 0
         self.misused_keywords = 0
         self.comment_index = -1
+        self.comment_line_num = None
         # Function tracking information. This is needed because we need to track
         # function args as they are related to their respective functions. This
         # means that `x` in `add` shouldn't cross pollinate with `x` in `print`
@@ -1749,70 +2006,119 @@ class Lexer:
         self.function_args = {}
 
     def lex(self):
+        self.scan_tokens()
+        self.finish_tokens()
+
+        # Return the list of tokens but filter out any NEW_LINE_TOKEN_TYPE as
+        # they don't serve a value in the parser. Don't modify the original
+        # so that it can be viewed if desired for debugging.
+        return list(filter(lambda token: (token.ttype != NEW_LINE_TOKEN_TYPE), self.token_list))
+
+    def iter_tokens(self):
+        """
+        Lex the program one line at a time, yielding the tokens of each line
+        as soon as the line is done. Tokens are not kept once they have been
+        yielded so the memory used does not grow with the size of the program.
+        """
+        self.keep_new_lines = False
+        while self.program.has_next_char() and self.program.has_next_line():
+            self.scan_line()
+            yield from self.token_list
+            self.token_list.clear()
+
+        self.finish_tokens()
+        yield from self.token_list
+        self.token_list.clear()
+
+    def finish_tokens(self):
+        # Always add end of file token to list
+        self.add_token(Token(EOF_TOKEN_TYPE, 0, self.program.curr_line, EOF, LOW))
+
+        # Do checking to make sure the tokens make sense to be parsed.
+        self.check_paren_pairing()
+        self.check_if_else_blocks()
+
+    def add_token(self, token):
+        if token.ttype == LEFT_CURL_BRACE_TOKEN_TYPE:
+            self.brace_depth += 1
+        elif token.ttype == RIGHT_CURL_BRACE_TOKEN_TYPE:
+            self.brace_depth -= 1
+        elif token.ttype == LEFT_PAREN_TOKEN_TYPE:
+            self.unpaired_parens += 1
+            self.last_left_paren = token
+            self.token_before_last_left_paren = self.prev_token
+            self.last_paren_token = token
+        elif token.ttype == RIGHT_PAREN_TOKEN_TYPE:
+            self.unpaired_parens -= 1
+            self.last_paren_token = token
+
+        if token.ttype != NEW_LINE_TOKEN_TYPE:
+            # TODO(map) There's a fun bug here where if there is a string with
+            # the value of "else" there will be an exception message raised.
+            is_after_right_curl = self.prev_non_new_line_token is not None and self.prev_non_new_line_token.ttype == RIGHT_CURL_BRACE_TOKEN_TYPE
+            if token.value == ELSE and not is_after_right_curl and self.misplaced_else_token is None:
+                self.misplaced_else_token = token
+            self.prev_non_new_line_token = token
+
+        self.prev_token = token
+        self.token_count += 1
+        if self.keep_new_lines or token.ttype != NEW_LINE_TOKEN_TYPE:
+            self.token_list.append(token)
+
+    def scan_tokens(self):
         while self.program.has_next_char() and self.program.has_next_line():
+            self.scan_line()
+
+    def scan_line(self):
+        line_num = self.program.curr_line
+        while self.program.has_next_char() and self.program.curr_line == line_num:
             self.program.advance_character()
             self.update_comment_index()
 
             # There is only a comment on this line and nothing else.
             if self.comment_index == 0:
-                if self.comment_index == 0:
-                    token = Token(COMMENT_TOKEN_TYPE, self.program.curr_col, self.program.curr_line, self.program.get_curr_line()[:-1], LOW)
-                    if token.ttype not in IGNORE_TOKENS:
-                        self.token_list.append(token)
-                    token = Token(NEW_LINE_TOKEN_TYPE, len(self.program.get_curr_line()) - 1, self.program.curr_line, self.program.get_curr_line()[-1:], LOW)
-                    if token.ttype not in IGNORE_TOKENS:
-                        self.token_list.append(token)
-                    self.program.advance_line()
-                    self.comment_index = -1
+                self.add_comment_tokens(self.comment_index)
+                self.program.advance_line()
+                self.comment_index = -1
             elif self.comment_index > 0 and self.program.curr_col == self.comment_index:
-                token = Token(COMMENT_TOKEN_TYPE, self.program.curr_col, self.program.curr_line, self.program.get_curr_line()[self.comment_index:-1], LOW)
-                if token.ttype not in IGNORE_TOKENS:
-                    self.token_list.append(token)
-                token = Token(NEW_LINE_TOKEN_TYPE, len(self.program.get_curr_line()) - 1, self.program.curr_line, self.program.get_curr_line()[-1:], LOW)
-                if token.ttype not in IGNORE_TOKENS:
-                    self.token_list.append(token)
+                self.add_comment_tokens(self.comment_index)
                 self.program.advance_line()
                 self.comment_index = -1
             else:
-                token = self.generate_token(self.program.get_curr_char())
-                # Advance the line if we have an EOL token
-                if token.ttype == NEW_LINE_TOKEN_TYPE:
-                    self.program.advance_line()
-                    self.comment_index = -1
-                else:
-                    if token.ttype == NUM_TOKEN_TYPE:
-                        while self.program.get_next_char().isnumeric():
-                            token.value += self.program.get_next_char()
-                            self.program.curr_col += 1
-                    elif token.ttype == LEFT_PAREN_TOKEN_TYPE:
-                        self.unpaired_parens += 1
-                        self.left_paren_idx_list.append(len(self.token_list))
-                    elif token.ttype == RIGHT_PAREN_TOKEN_TYPE:
-                        self.unpaired_parens -= 1
-                        self.right_paren_idx_list.append(len(self.token_list))
-                if token.ttype not in IGNORE_TOKENS:
-                    self.token_list.append(token)
-
-        # Always add end of file token to list
-        self.token_list.append(Token(EOF_TOKEN_TYPE, 0, self.program.curr_line, EOF, LOW))
-
-        # Do checking to make sure the tokens make sense to be parsed.
-        self.check_paren_pairing()
-        self.check_if_else_blocks()
-
-        # Return the list of tokens but filter out any NEW_LINE_TOKEN_TYPE as
-        # they don't serve a value in the parser. Don't modify the original
-        # so that it can be viewed if desired for debugging.
-        return list(filter(lambda token: (token.ttype != NEW_LINE_TOKEN_TYPE), self.token_list))
+                self.process_curr_char()
+
+    def add_comment_tokens(self, comment_index):
+        # The comment runs to the end of the line so both the comment and the
+        # new line that ends it are added at once.
+        line = self.program.get_curr_line()
+        self.add_token(Token(COMMENT_TOKEN_TYPE, comment_index, self.program.curr_line, line[comment_index:-1], LOW))
+        self.add_token(Token(NEW_LINE_TOKEN_TYPE, len(line) - 1, self.program.curr_line, line[-1:], LOW))
+
+    def process_curr_char(self):
+        token = self.generate_token(self.program.get_curr_char())
+        # Advance the line if we have an EOL token
+        if token.ttype == NEW_LINE_TOKEN_TYPE:
+            self.program.advance_line()
+            self.comment_index = -1
+        else:
+            if token.ttype == NUM_TOKEN_TYPE:
+                while self.program.get_next_char().isnumeric():
+                    token.value += self.program.get_next_char()
+                    self.program.curr_col += 1
+        if token.ttype not in IGNORE_TOKENS:
+            self.add_token(token)
 
     def update_comment_index(self):
-        if "//" in self.program.get_curr_line():
-            self.comment_index = self.program.get_curr_line().index("//")
+        # The position of the comment only depends on the line so search for
+        # it once when a new line is reached instead of on every character.
+        if self.comment_line_num != self.program.curr_line:
+            self.comment_line_num = self.program.curr_line
+            self.comment_index = self.program.get_curr_line().find("//")
 
     def generate_token(self, character) -> Token:
         try:
             if character.isnumeric():
-                if len(self.token_list) > 0 and not self.token_list[-1].ttype != KEYWORD_TOKEN_TYPE:
+                if self.prev_token is not None and self.prev_token.ttype == KEYWORD_TOKEN_TYPE:
                     raise InvalidVariableNameError(self.program.curr_line, self.program.curr_col)
                 else:
                     return Token(NUM_TOKEN_TYPE, self.program.curr_col, self.program.curr_line, character, LOW)
@@ -1901,8 +2207,8 @@ class Lexer:
 
     def check_for_valid_termination(self, value):
         if value == "\n":
-            is_previous_token_continuation_type = self.token_list[len(self.token_list) - 1].ttype in CONTINUATION_TOKENS
-            is_previous_token_eol = self.token_list[len(self.token_list) - 1].ttype == EOL_TOKEN_TYPE
+            is_previous_token_continuation_type = self.prev_token.ttype in CONTINUATION_TOKENS
+            is_previous_token_eol = self.prev_token.ttype == EOL_TOKEN_TYPE
             if not is_previous_token_continuation_type and not is_previous_token_eol:
                 raise NoTerminatorError(self.program.curr_line, self.program.curr_col)
             elif is_previous_token_continuation_type or is_previous_token_eol:
@@ -1910,15 +2216,19 @@ class Lexer:
             else:
                 assert False, "Don't know how to handle new line termination."
         elif value == ")":
-            if len(self.left_paren_idx_list) > 0:
+            if self.last_left_paren is not None:
+                # Get the token before the left paren. If the left paren was
+                # the first token compare against the latest token instead.
+                token = self.token_before_last_left_paren or self.prev_token
                 terminator_present = self.program.get_next_char() == ";"
-                left_paren_first_token = self.token_list[self.left_paren_idx_list[-1]].col == 0
-                left_paren_first_token_after_spaces = self.token_list[self.left_paren_idx_list[-1]].row != self.token_list[self.left_paren_idx_list[-1] - 1].row
+                left_paren_first_token = self.last_left_paren.col == 0
+                left_paren_first_token_after_spaces = self.last_left_paren.row != token.row
                 left_paren_first = left_paren_first_token or left_paren_first_token_after_spaces
-                # Get the token before the left paren.
-                token = self.token_list[self.left_paren_idx_list[-1] - 1]
                 left_paren_has_keyword = token.value in LOGIC_KEYWORDS or token.value == MAIN
-                if not terminator_present and not left_paren_first and not left_paren_has_keyword:
+                # A paren after an operator is grouping part of an expression
+                # so the line keeps going after it.
+                left_paren_groups_expression = token.ttype in EXPRESSION_PAREN_PREFIX_TOKENS
+                if not terminator_present and not left_paren_first and not left_paren_has_keyword and not left_paren_groups_expression:
                     raise NoTerminatorError(self.program.curr_line, self.program.curr_col + 1)
         else:
             assert False, "Invalid scenario to check for termination."
@@ -1934,31 +2244,35 @@ class Lexer:
             self.program.advance_character()
             keyword += self.program.get_curr_char()
 
-        if keyword in FUNCTION_KEYWORDS + VARIABLE_KEYWORDS + LOGIC_KEYWORDS and not self.in_function_declaration:
+        return self.classify_keyword(keyword, original_pos)
+
+    def classify_keyword(self, keyword, original_pos):
+        if keyword in LANGUAGE_KEYWORDS and not self.in_function_declaration:
+            token = Token(KEYWORD_TOKEN_TYPE, original_pos, self.program.curr_line, keyword, ULTRA_HIGH)
             if keyword == IF:
-                self.if_idx_list.append(len(self.token_list))
+                self.if_positions.append((self.token_count, self.brace_depth))
             elif keyword == ELSE:
-                self.else_idx_list.append(len(self.token_list))
-            return Token(KEYWORD_TOKEN_TYPE, original_pos, self.program.curr_line, keyword, ULTRA_HIGH)
+                self.else_positions.append((self.token_count, self.brace_depth, token))
+            return token
         elif keyword == MACRO:
             return Token(MACRO_KEYWORD_TOKEN_TYPE, original_pos, self.program.curr_line, keyword, ULTRA_HIGH)
-        elif len(self.token_list) > 0 and self.token_list[-1].value in VARIABLE_KEYWORDS:
-            self.variable_name_list.append(keyword)
+        elif self.prev_token is not None and self.prev_token.value in VARIABLE_KEYWORDS:
+            self.variable_names.add(keyword)
             return Token(VARIABLE_NAME_TOKEN_TYPE, original_pos, self.program.curr_line, keyword, LOW)
-        elif len(self.token_list) > 0 and self.token_list[-1].value == MACRO:
-            self.macro_name_list.append(keyword)
+        elif self.prev_token is not None and self.prev_token.value == MACRO:
+            self.macro_names.add(keyword)
             return Token(MACRO_NAME_TOKEN_TYPE, original_pos, self.program.curr_line, keyword, LOW)
-        elif keyword in self.macro_name_list:
+        elif keyword in self.macro_names:
             return Token(MACRO_REFERENCE_TOKEN_TYPE, original_pos, self.program.curr_line, keyword, LOW)
-        elif keyword in self.variable_name_list:
+        elif keyword in self.variable_names:
             return Token(VARIABLE_REFERENCE_TOKEN_TYPE, original_pos, self.program.curr_line, keyword, LOW)
-        elif keyword in ["true", "false"]:
+        elif keyword in BOOLEAN_VALUES:
             return Token(BOOLEAN_TOKEN_TYPE, original_pos, self.program.curr_line, keyword, LOW)
         elif keyword == FN:
             return Token(FUNCTION_KEYWORD_TOKEN_TYPE, original_pos, self.program.curr_line, keyword, VERY_HIGH)
         elif keyword == "return":
             return Token(FUNCTION_RETURN_KEYWORD_TOKEN_TYPE, original_pos, self.program.curr_line, keyword, HIGH)
-        elif len(self.token_list) > 0 and self.token_list[-1].value == FN:
+        elif self.prev_token is not None and self.prev_token.value == FN:
             self.in_function_declaration = True
             self.curr_function_name = keyword
             self.function_args[self.curr_function_name] = {}
@@ -1966,16 +2280,16 @@ class Lexer:
         elif self.in_function_declaration and keyword not in VARIABLE_KEYWORDS and keyword != "nil":
             self.function_args[self.curr_function_name].update({keyword: ""})
             return Token(FUNCTION_ARG_TOKEN_TYPE, original_pos, self.program.curr_line, keyword, VERY_HIGH)
-        elif self.in_function_declaration and keyword in VARIABLE_KEYWORDS and self.token_list[-1].ttype != FUNCTION_SEPARATOR_TOKEN_TYPE:
-            self.function_args[self.curr_function_name].update({self.token_list[-1].value: keyword})
+        elif self.in_function_declaration and keyword in VARIABLE_KEYWORDS and self.prev_token.ttype != FUNCTION_SEPARATOR_TOKEN_TYPE:
+            self.function_args[self.curr_function_name].update({self.prev_token.value: keyword})
             return Token(FUNCTION_ARG_TYPE_TOKEN_TYPE, original_pos, self.program.curr_line, keyword, VERY_HIGH)
-        elif self.in_function_declaration and keyword in VARIABLE_KEYWORDS and self.token_list[-1].ttype == FUNCTION_SEPARATOR_TOKEN_TYPE:
+        elif self.in_function_declaration and keyword in VARIABLE_KEYWORDS and self.prev_token.ttype == FUNCTION_SEPARATOR_TOKEN_TYPE:
             return Token(FUNCTION_RETURN_TOKEN_TYPE, original_pos, self.program.curr_line, keyword, VERY_HIGH)
         elif self.in_function_declaration and keyword == "nil":
             return Token(FUNCTION_RETURN_TOKEN_TYPE, original_pos, self.program.curr_line, keyword, VERY_HIGH)
         elif keyword in self.function_args.get(self.curr_function_name, {}):
             return Token(FUNCTION_ARG_REFERENCE_TOKEN_TYPE, original_pos, self.program.curr_line, keyword, HIGH)
-        elif keyword in self.function_args.keys():
+        elif keyword in self.function_args:
             return Token(FUNCTION_REFERENCE_TOKEN_TYPE, original_pos, self.program.curr_line, keyword, VERY_HIGH)
         elif keyword == "idx":
             return Token(LOOP_INDEX_KEYWORD_TOKEN_TYPE, original_pos, self.program.curr_line, keyword, HIGH)
@@ -2032,70 +2346,297 @@ class Lexer:
         return Token(FUNCTION_SEPARATOR_TOKEN_TYPE, fn_idx, self.program.curr_line, "::", VERY_HIGH)
 
     def check_paren_pairing(self):
-        # Check to make sure all the parenthesis line up accordingly.
-        paren_error_row = 0
-        paren_error_col = 0
-        if len(self.left_paren_idx_list) != len(self.right_paren_idx_list):
-            for token in self.token_list:
-                if token.ttype == LEFT_PAREN_TOKEN_TYPE:
-                    self.unpaired_parens += 1
-                    paren_error_row = token.row
-                    paren_error_col = token.col
-                elif token.ttype == RIGHT_PAREN_TOKEN_TYPE:
-                    self.unpaired_parens -= 1
-                    paren_error_row = token.row
-                    paren_error_col = token.col
-
+        # Check to make sure all the parenthesis line up accordingly. The
+        # error points at the last paren that was seen.
         if self.unpaired_parens != 0:
-            upe = UnclosedParenthesisError(paren_error_row, paren_error_col)
-            print_exception_message(self.program.lines, paren_error_col, upe)
+            upe = UnclosedParenthesisError(self.last_paren_token.row, self.last_paren_token.col)
+            print_exception_message(self.program.lines, self.last_paren_token.col, upe)
             sys.exit()
 
     def check_if_else_blocks(self):
         # Confirm there is at least one `else` present, otherwise no need to
         # check if there are matching `if` blocks.
-        if len(self.else_idx_list) > 0:
+        if len(self.else_positions) > 0:
             # Case of there being an else with no matched if.
-            if len(self.if_idx_list) < len(self.else_idx_list):
-                for idx, if_idx in enumerate(reversed(self.if_idx_list)):
-                    brace_count = 0
-                    for token in self.token_list[if_idx:self.else_idx_list[idx]]:
-                        if token.ttype == LEFT_CURL_BRACE_TOKEN_TYPE:
-                            brace_count = brace_count + 1
-                        elif token.ttype == RIGHT_CURL_BRACE_TOKEN_TYPE:
-                            brace_count = brace_count - 1
-                        else:
-                            # Token does not affect determining the if/else
-                            # matching algorithm.
-                            pass
+            if len(self.if_positions) < len(self.else_positions):
+                for (if_idx, if_depth), (else_idx, else_depth, err_token) in zip(reversed(self.if_positions), self.else_positions):
+                    # The braces opened and closed between the `if` and the
+                    # `else` is the difference in open braces at each.
+                    brace_count = else_depth - if_depth if if_idx < else_idx else 0
                     if brace_count != 0:
-                        err_token = self.token_list[self.else_idx_list[idx]]
                         print_exception_message(self.program.lines, err_token.row, UnpairedElseError(err_token.row, err_token.col))
                         sys.exit()
                         # raise UnpairedElseError(err_token.row, err_token.col)
                 # All other if/else pairs matched so the final else must be
                 # the problem
-                err_token = self.token_list[self.else_idx_list[-1]]
+                err_token = self.else_positions[-1][2]
                 print_exception_message(self.program.lines, err_token.row, UnpairedElseError(err_token.row, err_token.col))
                 sys.exit()
 
         # If/else blocks all match, make sure there is nothing between the end
         # of an `if` block and the start of an `else` block
-        filtered_token_list = list(filter(lambda token: (token.ttype != NEW_LINE_TOKEN_TYPE), self.token_list))
-        for idx, token in enumerate(filtered_token_list):
-            # TODO(map) There's a fun bug here where if there is a string with
-            # the value of "else" there will be an exception message raised.
-            if token.value == ELSE and filtered_token_list[idx - 1].ttype != RIGHT_CURL_BRACE_TOKEN_TYPE:
-                print_exception_message(self.program.lines, token.row, BadFormattedLogicBlock(token.row, 0))
-                sys.exit()
+        if self.misplaced_else_token is not None:
+            token = self.misplaced_else_token
+            print_exception_message(self.program.lines, token.row, BadFormattedLogicBlock(token.row, 0))
+            sys.exit()
+
+
+class FastLexer(Lexer):
+    """
+    Lexer that produces the exact same tokens as the base `Lexer` but does
+    less work per character. Single character tokens come straight from a
+    lookup table and whitespace, keywords and numbers are consumed as a whole
+    run with one regex match. Everything else, like strings and the context
+    sensitive parens, goes through `Lexer.process_curr_char` so the behavior
+    stays the same.
+    """
+
+    def scan_line(self):
+        line = self.program.get_curr_line()
+        line_num = self.program.curr_line
+        comment_index = line.find("//")
+
+        while self.program.has_next_char():
+            col = self.program.curr_col + 1
+            if col == comment_index:
+                self.add_comment_tokens(comment_index)
+                self.program.advance_line()
+                break
+
+            char = line[col]
+            if char in SINGLE_CHAR_TOKENS:
+                ttype, priority = SINGLE_CHAR_TOKENS[char]
+                self.add_token(Token(ttype, col, line_num, char, priority))
+                self.program.curr_col = col
+                continue
+
+            run = RUN_PATTERN.match(line, col)
+            # A run that stops on a non ascii character may keep going in
+            # the base lexer (ie `isalpha` is true for it) so let the base
+            # lexer handle it from the start.
+            if run and (run.end() == len(line) or line[run.end()].isascii()):
+                self.program.curr_col = run.end() - 1
+                if run.lastgroup == WORD_RUN:
+                    self.add_word_token(run.group(), col)
+                elif run.lastgroup == NUM_RUN:
+                    self.add_num_token(run.group(), col)
+                continue
+
+            self.program.curr_col = col
+            self.process_curr_char()
+            # The character was a new line so move on to the next one.
+            if self.program.curr_line != line_num:
+                break
+
+    def add_word_token(self, word, col):
+        try:
+            token = self.classify_keyword(word, col)
+            if token.ttype == FUNCTION_ARG_TOKEN_TYPE and not self.fn_left_paren_set:
+                raise InvalidFunctionDeclarationException(token.row, token.col)
+            self.add_token(token)
+        except UnknownKeywordError as uke:
+            print_exception_message(self.program.lines, self.program.curr_col, uke)
+            sys.exit()
+        except InvalidFunctionDeclarationException as ifde:
+            print_exception_message(self.program.lines, self.program.curr_col, ifde)
+            sys.exit()
+
+    def add_num_token(self, num, col):
+        if self.prev_token is not None and self.prev_token.ttype == KEYWORD_TOKEN_TYPE:
+            print_exception_message(self.program.lines, col, InvalidVariableNameError(self.program.curr_line, col))
+            sys.exit()
+        self.add_token(Token(NUM_TOKEN_TYPE, col, self.program.curr_line, num, LOW))
 
 
 ########
 # PARSER
 ########
+class TokenStream:
+    """
+    Gives the parser indexed access to the tokens it is working on while only
+    pulling tokens from `tokens` as they are needed. Tokens that fall more
+    than `lookback` behind the newest one are dropped so a lazily lexed
+    program never has to be held in memory all at once.
+    """
+
+    def __init__(self, tokens, lookback=4):
+        self.tokens = iter(tokens)
+        self.buffer = collections.deque(maxlen=lookback)
+        self.start = 0
+
+    def has_token(self, idx):
+        while idx >= self.start + len(self.buffer):
+            token = next(self.tokens, None)
+            if token is None:
+                return False
+            if len(self.buffer) == self.buffer.maxlen:
+                self.start += 1
+            self.buffer.append(token)
+        return idx >= self.start
+
+    def __getitem__(self, idx):
+        # Most lookups are for a token that has already been pulled.
+        if 0 <= idx - self.start < len(self.buffer):
+            return self.buffer[idx - self.start]
+        if not self.has_token(idx):
+            raise IndexError(f"Token {idx} is not available")
+        return self.buffer[idx - self.start]
+
+
+class MacroTemplate:
+    """
+    The body of a macro flattened into a list of nodes so it can be stamped
+    out for every reference to the macro. Each copy is a fresh set of nodes
+    wired together the same way as the original, sharing the tokens, so the
+    cost of an expansion only depends on the number of nodes in the body.
+    """
+
+    def __init__(self, body_nodes):
+        template_nodes = []
+        node_idxs = {}
+        nodes_to_visit = list(reversed(body_nodes))
+        while nodes_to_visit:
+            node = nodes_to_visit.pop()
+            if id(node) in node_idxs:
+                continue
+            node_idxs[id(node)] = len(template_nodes)
+            template_nodes.append(node)
+            nodes_to_visit.extend(iter_child_nodes(node))
+
+        # Each node in the recipe keeps its class and attributes along with
+        # which attributes point at other nodes in the body so the copies can
+        # be linked up. Nodes outside of the body, like the macro node itself,
+        # are shared. The attributes are copied so later changes to the nodes
+        # in the macro's own body don't show up in the expansions.
+        self.recipe = []
+        for node in template_nodes:
+            node_links = []
+            list_links = []
+            for attr, value in node.__dict__.items():
+                if isinstance(value, Node) and id(value) in node_idxs:
+                    node_links.append((attr, node_idxs[id(value)]))
+                elif isinstance(value, list):
+                    list_links.append((attr, [(node_idxs.get(id(item)) if isinstance(item, Node) else None, item) for item in value]))
+            self.recipe.append((type(node), dict(node.__dict__), node_links, list_links))
+        self.body_idxs = [node_idxs[id(node)] for node in body_nodes]
+
+    def expand(self):
+        """
+        Build a new copy of the macro body and return its top level nodes.
+        """
+        copies = []
+        for node_type, attrs, _, _ in self.recipe:
+            node = node_type.__new__(node_type)
+            node.__dict__.update(attrs)
+            copies.append(node)
+        for node, (_, _, node_links, list_links) in zip(copies, self.recipe):
+            for attr, idx in node_links:
+                setattr(node, attr, copies[idx])
+            for attr, items in list_links:
+                setattr(node, attr, [item if idx is None else copies[idx] for idx, item in items])
+        return [copies[idx] for idx in self.body_idxs]
+
+
+# How tightly each operator holds on to the values around it when building an
+# expression. Higher binds tighter.
+EXPRESSION_BINDING_POWERS = {
+    AssignmentNode: 1,
+    CompareNode: 2,
+    PlusMinusNode: 3,
+    MultiplyDivideNode: 4,
+}
+# Nodes that can be used as a value inside of an expression.
+EXPRESSION_OPERAND_NODES = frozenset((
+    NumberNode,
+    StringNode,
+    CharNode,
+    BooleanNode,
+    VariableReferenceNode,
+    FunctionArgReferenceNode,
+    FunctionKeywordNode,
+    LoopIdxKeywordNode,
+))
+# Builds the node for a token that always becomes the same kind of node no
+# matter where it shows up.
+TOKEN_NODE_FACTORIES = {
+    MACRO_KEYWORD_TOKEN_TYPE: lambda token: MacroNode(token, token.value, children_nodes=[]),
+    FUNCTION_KEYWORD_TOKEN_TYPE: lambda token: FunctionNode(token, token.value, []),
+    NUM_TOKEN_TYPE: lambda token: NumberNode(token, token.value, None),
+    CHARACTER_TOKEN_TYPE: lambda token: CharNode(token, token.value),
+    STRING_TOKEN_TYPE: lambda token: StringNode(token, token.value, None),
+    PLUS_TOKEN_TYPE: lambda token: PlusMinusNode(token, token.value),
+    MINUS_TOKEN_TYPE: lambda token: PlusMinusNode(token, token.value),
+    MULTIPLY_TOKEN_TYPE: lambda token: MultiplyDivideNode(token, token.value),
+    DIVIDE_TOKEN_TYPE: lambda token: MultiplyDivideNode(token, token.value),
+    COMMENT_TOKEN_TYPE: NoOpNode,
+    MACRO_NAME_TOKEN_TYPE: lambda token: MacroNameNode(token, token.value),
+    FUNCTION_NAME_TOKEN_TYPE: lambda token: FunctionNameNode(token, token.value),
+    VARIABLE_REFERENCE_TOKEN_TYPE: lambda token: VariableReferenceNode(token, token.value, None),
+    ASSIGNMENT_TOKEN_TYPE: lambda token: AssignmentNode(token, token.value),
+    BOOLEAN_TOKEN_TYPE: lambda token: BooleanNode(token, token.value),
+    LOOP_INDEX_KEYWORD_TOKEN_TYPE: lambda token: LoopIdxKeywordNode(token, token.value),
+    RANGE_INDICATION_TOKEN_TYPE: lambda token: RangeNode(token, token.value),
+    EQUAL_TOKEN_TYPE: lambda token: CompareNode(token, token.value),
+    GREATER_THAN_TOKEN_TYPE: lambda token: CompareNode(token, token.value),
+    LESS_THAN_TOKEN_TYPE: lambda token: CompareNode(token, token.value),
+    COMMA_TOKEN_TYPE: ArgSeparatorNode,
+    FUNCTION_SEPARATOR_TOKEN_TYPE: FunctionDecSeparatorNode,
+    FUNCTION_ARG_TOKEN_TYPE: lambda token: FunctionArgNode(token, token.value),
+    FUNCTION_ARG_TYPE_TOKEN_TYPE: lambda token: FunctionArgTypeNode(token, token.value),
+    FUNCTION_ARG_SEPARATOR_TYPE_TOKEN_TYPE: lambda token: FunctionArgSeparatorNode(token, token.value),
+    FUNCTION_RETURN_TOKEN_TYPE: lambda token: FunctionReturnTypeNode(token, token.value),
+    FUNCTION_RETURN_KEYWORD_TOKEN_TYPE: lambda token: FunctionReturnNode(token, token.value),
+    FUNCTION_ARG_REFERENCE_TOKEN_TYPE: lambda token: FunctionArgReferenceNode(token, token.value),
+    FUNCTION_REFERENCE_TOKEN_TYPE: lambda token: FunctionReferenceNode(token, token.value),
+    EOL_TOKEN_TYPE: EndOfLineNode,
+}
+# Builds the node for a keyword token based on which keyword it is.
+KEYWORD_NODE_FACTORIES = {
+    MAIN: lambda token: StartNode(token, token.value, []),
+    PRINT: lambda token: FunctionKeywordNode(token, token.value, []),
+    PRINTL: lambda token: FunctionKeywordNode(token, token.value, []),
+    CHAR_AT: lambda token: FunctionKeywordNode(token, token.value, []),
+    UPDATE_CHAR: lambda token: FunctionKeywordNode(token, token.value, []),
+    COPY_STR: lambda token: FunctionKeywordNode(token, token.value, []),
+    IF: lambda token: LogicKeywordNode(token, token.value),
+    ELSE: lambda token: LogicKeywordNode(token, token.value),
+    LOOP_UP: lambda token: LoopUpKeywordNode(token, token.value),
+    I_LOOP_UP: lambda token: LoopUpInclusiveKeywordNode(token, token.value),
+    LOOP_DOWN: lambda token: LoopDownKeywordNode(token, token.value),
+    I_LOOP_DOWN: lambda token: LoopDownInclusiveKeywordNode(token, token.value),
+    LOOP_FROM: lambda token: LoopFromKeywordNode(token, token.value),
+    I_LOOP_FROM: lambda token: LoopFromInclusiveKeywordNode(token, token.value),
+    **dict.fromkeys(VARIABLE_KEYWORDS, lambda token: VariableKeywordNode(token, token.value)),
+}
+# The curl brace nodes used for the body of the block at the top of
+# `Parser.if_else_list`, keyed by the type of the block's node. Blocks that are
+# not in here are treated as function bodies.
+BLOCK_CURL_NODES = {
+    LoopUpKeywordNode: (LoopBodyLeftCurlNode, LoopBodyRightCurlNode),
+    LoopDownKeywordNode: (LoopBodyLeftCurlNode, LoopBodyRightCurlNode),
+    LoopFromKeywordNode: (LoopBodyLeftCurlNode, LoopBodyRightCurlNode),
+    LoopUpInclusiveKeywordNode: (LoopBodyLeftCurlNode, LoopBodyRightCurlNode),
+    LoopDownInclusiveKeywordNode: (LoopBodyLeftCurlNode, LoopBodyRightCurlNode),
+    LoopFromInclusiveKeywordNode: (LoopBodyLeftCurlNode, LoopBodyRightCurlNode),
+}
+# Same as above but for if/else blocks which share a node type.
+LOGIC_CURL_NODES = {
+    IF: (IfBodyLeftCurlNode, IfBodyRightCurlNode),
+    ELSE: (ElseBodyLeftCurlNode, ElseBodyRightCurlNode),
+}
+# The right paren node that closes each kind of left paren node.
+CLOSING_PAREN_NODES = {
+    FunctionCallLeftParenNode: FunctionCallRightParenNode,
+    FunctionDecLeftParenNode: FunctionDecRightParenNode,
+    ConditionalLeftParenNode: ConditionalRightParenNode,
+}
+
+
 class Parser:
     def __init__(self, token_list):
-        self.token_list = token_list
+        # Accepts either a list of tokens or something that yields them like
+        # `Lexer.iter_tokens`.
+        self.token_list = TokenStream(token_list)
         self.has_next_token = True
         self.curr_token_pos = -1
         self.main_node = None
@@ -2104,7 +2645,18 @@ class Parser:
         self.macro_reference_set = False
         self.node_list = []
         self.if_else_list = []
-        self.left_paren_func_call_set = False
+        # Types of the left paren nodes that haven't been closed yet.
+        self.open_paren_types = []
+        # Tokens whose node depends on the state of the parser.
+        self.contextual_node_factories = {
+            KEYWORD_TOKEN_TYPE: self.build_keyword_node,
+            VARIABLE_NAME_TOKEN_TYPE: self.build_variable_node,
+            MACRO_REFERENCE_TOKEN_TYPE: self.build_macro_reference_node,
+            LEFT_PAREN_TOKEN_TYPE: self.build_left_paren_node,
+            RIGHT_PAREN_TOKEN_TYPE: self.build_right_paren_node,
+            LEFT_CURL_BRACE_TOKEN_TYPE: self.build_left_curl_node,
+            RIGHT_CURL_BRACE_TOKEN_TYPE: self.build_right_curl_node,
+        }
         self.in_function_body = False
         self.current_if_node = None
         self.fn_name_ret_type_map = {}
@@ -2184,7 +2736,7 @@ class Parser:
 
     def advance_token(self):
         # Ensure we can advance
-        if self.curr_token_pos + 1 < len(self.token_list):
+        if self.token_list.has_token(self.curr_token_pos + 1):
             self.curr_token_pos += 1
             self.curr_token = self.token_list[self.curr_token_pos]
 
@@ -2417,7 +2969,7 @@ class Parser:
         for child_node in macro_node.children_nodes:
             child_node.parent_node = macro_node
 
-        self.macros[macro_name_node.value] = macro_node.children_nodes
+        self.macros[macro_name_node.value] = MacroTemplate(macro_node.children_nodes)
 
         return macro_node
 
@@ -2463,157 +3015,84 @@ class Parser:
         return line_ast
 
     def process_token(self):
-        node = None
-        if self.curr_token.ttype == KEYWORD_TOKEN_TYPE and self.curr_token.value == MAIN:
-            node = StartNode(self.curr_token, self.curr_token.value, [])
-        elif self.curr_token.ttype == MACRO_KEYWORD_TOKEN_TYPE:
-            node = MacroNode(self.curr_token, self.curr_token.value, children_nodes=[])
-        elif self.curr_token.ttype == FUNCTION_KEYWORD_TOKEN_TYPE:
-            node = FunctionNode(self.curr_token, self.curr_token.value, [])
-        elif self.curr_token.ttype == LEFT_PAREN_TOKEN_TYPE:
-            # Currently working on keyword
-            if self.get_prev_token().ttype == KEYWORD_TOKEN_TYPE and self.get_prev_token().value not in [IF, ELSE]:
-                node = FunctionCallLeftParenNode(self.curr_token)
-                self.left_paren_func_call_set = True
-            # Working on a function call
-            elif self.get_prev_token().ttype == FUNCTION_REFERENCE_TOKEN_TYPE:
-                node = FunctionCallLeftParenNode(self.curr_token)
-                self.left_paren_func_call_set = True
-            # Working on a function declaration
-            elif len(self.if_else_list) > 0 and type(self.if_else_list[-1]) == FunctionNode:
-                node = FunctionDecLeftParenNode(self.curr_token)
-            # Currently in an IF block of logic.
-            elif len(self.if_else_list) > 0 and type(self.if_else_list[-1]) == LogicKeywordNode and self.if_else_list[-1].value == IF:
-                node = ConditionalLeftParenNode(self.curr_token)
-            # This is a paren that is not linked to any key operations like an
-            # if/else block or a function call.
-            else:
-                node = LeftParenNode(self.curr_token, self.curr_token.value)
-        elif self.curr_token.ttype == RIGHT_PAREN_TOKEN_TYPE:
-            # Currently working on a function
-            if self.left_paren_func_call_set:
-                node = FunctionCallRightParenNode(self.curr_token)
-                self.left_paren_func_call_set = False
-            # Working on a function declaration
-            elif len(self.if_else_list) > 0 and type(self.if_else_list[-1]) == FunctionNode:
-                node = FunctionDecRightParenNode(self.curr_token)
-                self.if_else_list.pop()
-            # Currently in an "if" block of logic.
-            elif len(self.if_else_list) > 0 and type(self.if_else_list[-1]) == LogicKeywordNode and self.if_else_list[-1].value == IF:
-                node = ConditionalRightParenNode(self.curr_token)
-            # This is a paren that is not linked to any key operations like an
-            # if/else block or a function call.
-            else:
-                node = RightParenNode(self.curr_token, self.curr_token.value)
-        elif self.curr_token.ttype == LEFT_CURL_BRACE_TOKEN_TYPE:
-            # Currently working on a loop block
-            if len(self.if_else_list) > 0 and type(self.if_else_list[-1]) in [LoopUpKeywordNode, LoopDownKeywordNode, LoopFromKeywordNode, LoopUpInclusiveKeywordNode, LoopDownInclusiveKeywordNode, LoopFromInclusiveKeywordNode]:
-                node = LoopBodyLeftCurlNode(self.curr_token)
-            # Currently in an "if" block of logic.
-            elif len(self.if_else_list) > 0 and type(self.if_else_list[-1]) == LogicKeywordNode and self.if_else_list[-1].value == IF:
-                node = IfBodyLeftCurlNode(self.curr_token)
-            # Currently in an "else" block of logic.
-            elif len(self.if_else_list) > 0 and type(self.if_else_list[-1]) == LogicKeywordNode and self.if_else_list[-1].value == ELSE:
-                node = ElseBodyLeftCurlNode(self.curr_token)
-            # There is no if/else combination we are currently processing
-            else:
-                node = FunctionBodyLeftCurlNode(self.curr_token)
-        elif self.curr_token.ttype == RIGHT_CURL_BRACE_TOKEN_TYPE:
-            # Currently working on a loop block
-            if len(self.if_else_list) > 0 and type(self.if_else_list[-1]) in [LoopUpKeywordNode, LoopDownKeywordNode, LoopFromKeywordNode, LoopUpInclusiveKeywordNode, LoopDownInclusiveKeywordNode, LoopFromInclusiveKeywordNode]:
-                node = LoopBodyRightCurlNode(self.curr_token)
-                self.if_else_list.pop()
-            # Currently in an "if" block of logic.
-            elif len(self.if_else_list) > 0 and type(self.if_else_list[-1]) == LogicKeywordNode and self.if_else_list[-1].value == IF:
-                node = IfBodyRightCurlNode(self.curr_token)
-                # Remove the "if" node because we have finished processing it.
-                self.if_else_list.pop()
-            # Currently in an "else" block of logic.
-            elif len(self.if_else_list) > 0 and type(self.if_else_list[-1]) == LogicKeywordNode and self.if_else_list[-1].value == ELSE:
-                node = ElseBodyRightCurlNode(self.curr_token)
-                # Remove the "else" node because we have finished processing it.
-                self.if_else_list.pop()
-            # There is no if/else combination we are currently processing
-            else:
-                node = FunctionBodyRightCurlNode(self.curr_token)
-        elif self.curr_token.ttype == NUM_TOKEN_TYPE:
-            node = NumberNode(self.curr_token, self.curr_token.value, None)
-        elif self.curr_token.ttype == CHARACTER_TOKEN_TYPE:
-            node = CharNode(self.curr_token, self.curr_token.value)
-        elif self.curr_token.ttype == STRING_TOKEN_TYPE:
-            node = StringNode(self.curr_token, self.curr_token.value, None)
-        elif self.curr_token.ttype in [PLUS_TOKEN_TYPE, MINUS_TOKEN_TYPE]:
-            node = PlusMinusNode(self.curr_token, self.curr_token.value)
-        elif self.curr_token.ttype in [MULTIPLY_TOKEN_TYPE, DIVIDE_TOKEN_TYPE]:
-            node = MultiplyDivideNode(self.curr_token, self.curr_token.value)
-        elif self.curr_token.ttype == COMMENT_TOKEN_TYPE:
-            node = NoOpNode(self.curr_token)
-        elif self.curr_token.ttype == KEYWORD_TOKEN_TYPE and self.curr_token.value in [PRINT, PRINTL, CHAR_AT, UPDATE_CHAR, COPY_STR]:
-            node = FunctionKeywordNode(self.curr_token, self.curr_token.value, [])
-        elif self.curr_token.ttype == MACRO_NAME_TOKEN_TYPE:
-            node = MacroNameNode(self.curr_token, self.curr_token.value)
-        elif self.curr_token.ttype == FUNCTION_NAME_TOKEN_TYPE:
-            node = FunctionNameNode(self.curr_token, self.curr_token.value)
-        elif self.curr_token.ttype == KEYWORD_TOKEN_TYPE and self.curr_token.value in VARIABLE_KEYWORDS:
-            node = VariableKeywordNode(self.curr_token, self.curr_token.value)
-        elif self.curr_token.ttype == VARIABLE_NAME_TOKEN_TYPE:
-            is_const = self.token_list[self.curr_token_pos - 2].value ==  CONST
-            node = VariableNode(self.curr_token, self.curr_token.value, is_const, None)
-        elif self.curr_token.ttype == VARIABLE_REFERENCE_TOKEN_TYPE:
-            node = VariableReferenceNode(self.curr_token, self.curr_token.value, None)
-        elif self.curr_token.ttype == MACRO_REFERENCE_TOKEN_TYPE:
-            node = copy.deepcopy(self.macros[self.curr_token.value])
-            self.macro_reference_set = True
-        elif self.curr_token.ttype == ASSIGNMENT_TOKEN_TYPE:
-            node = AssignmentNode(self.curr_token, self.curr_token.value)
-        elif self.curr_token.ttype == BOOLEAN_TOKEN_TYPE:
-            node = BooleanNode(self.curr_token, self.curr_token.value)
-        elif self.curr_token.ttype == KEYWORD_TOKEN_TYPE and self.curr_token.value in [IF, ELSE]:
-            node = LogicKeywordNode(self.curr_token, self.curr_token.value)
-        elif self.curr_token.ttype == KEYWORD_TOKEN_TYPE and self.curr_token.value == LOOP_UP:
-            node = LoopUpKeywordNode(self.curr_token, self.curr_token.value)
-        elif self.curr_token.ttype == KEYWORD_TOKEN_TYPE and self.curr_token.value == I_LOOP_UP:
-            node = LoopUpInclusiveKeywordNode(self.curr_token, self.curr_token.value)
-        elif self.curr_token.ttype == KEYWORD_TOKEN_TYPE and self.curr_token.value == LOOP_DOWN:
-            node = LoopDownKeywordNode(self.curr_token, self.curr_token.value)
-        elif self.curr_token.ttype == KEYWORD_TOKEN_TYPE and self.curr_token.value == I_LOOP_DOWN:
-            node = LoopDownInclusiveKeywordNode(self.curr_token, self.curr_token.value)
-        elif self.curr_token.ttype == KEYWORD_TOKEN_TYPE and self.curr_token.value == LOOP_FROM:
-            node = LoopFromKeywordNode(self.curr_token, self.curr_token.value)
-        elif self.curr_token.ttype == KEYWORD_TOKEN_TYPE and self.curr_token.value == I_LOOP_FROM:
-            node = LoopFromInclusiveKeywordNode(self.curr_token, self.curr_token.value)
-        elif self.curr_token.ttype == LOOP_INDEX_KEYWORD_TOKEN_TYPE:
-            node = LoopIdxKeywordNode(self.curr_token, self.curr_token.value)
-        elif self.curr_token.ttype == RANGE_INDICATION_TOKEN_TYPE:
-            node = RangeNode(self.curr_token, self.curr_token.value)
-        elif self.curr_token.ttype in [EQUAL_TOKEN_TYPE, GREATER_THAN_TOKEN_TYPE, LESS_THAN_TOKEN_TYPE]:
-            node = CompareNode(self.curr_token, self.curr_token.value)
-        elif self.curr_token.ttype == COMMA_TOKEN_TYPE:
-            node = ArgSeparatorNode(self.curr_token)
-        elif self.curr_token.ttype == FUNCTION_SEPARATOR_TOKEN_TYPE:
-            node = FunctionDecSeparatorNode(self.curr_token)
-        elif self.curr_token.ttype == FUNCTION_ARG_TOKEN_TYPE:
-            node = FunctionArgNode(self.curr_token, self.curr_token.value)
-        elif self.curr_token.ttype == FUNCTION_ARG_TYPE_TOKEN_TYPE:
-            node = FunctionArgTypeNode(self.curr_token, self.curr_token.value)
-        elif self.curr_token.ttype == FUNCTION_ARG_SEPARATOR_TYPE_TOKEN_TYPE:
-            node = FunctionArgSeparatorNode(self.curr_token, self.curr_token.value)
-        elif self.curr_token.ttype == FUNCTION_RETURN_TOKEN_TYPE:
-            node = FunctionReturnTypeNode(self.curr_token, self.curr_token.value)
-        elif self.curr_token.ttype == FUNCTION_RETURN_KEYWORD_TOKEN_TYPE:
-            node = FunctionReturnNode(self.curr_token, self.curr_token.value)
-        elif self.curr_token.ttype == FUNCTION_ARG_REFERENCE_TOKEN_TYPE:
-            node = FunctionArgReferenceNode(self.curr_token, self.curr_token.value)
-        elif self.curr_token.ttype == FUNCTION_REFERENCE_TOKEN_TYPE:
-            node = FunctionReferenceNode(self.curr_token, self.curr_token.value)
-        elif self.curr_token.ttype == EOL_TOKEN_TYPE:
-            node = EndOfLineNode(self.curr_token)
+        token = self.curr_token
+        factory = TOKEN_NODE_FACTORIES.get(token.ttype)
+        if factory:
+            node = factory(token)
         else:
-            assert False, f"Unknown token type {self.curr_token.ttype}"
+            contextual_factory = self.contextual_node_factories.get(token.ttype)
+            assert contextual_factory, f"Unknown token type {token.ttype}"
+            node = contextual_factory(token)
 
         self.advance_token()
         return node
 
+    def build_keyword_node(self, token):
+        factory = KEYWORD_NODE_FACTORIES.get(token.value)
+        assert factory, f"Unknown token type {token.ttype}"
+        return factory(token)
+
+    def build_variable_node(self, token):
+        is_const = self.curr_token_pos >= 2 and self.token_list[self.curr_token_pos - 2].value == CONST
+        return VariableNode(token, token.value, is_const, None)
+
+    def build_macro_reference_node(self, token):
+        self.macro_reference_set = True
+        return self.macros[token.value].expand()
+
+    def build_left_paren_node(self, token):
+        prev_token = self.get_prev_token()
+        # Currently working on keyword or a function call
+        if (prev_token.ttype == KEYWORD_TOKEN_TYPE and prev_token.value not in [IF, ELSE]) or prev_token.ttype == FUNCTION_REFERENCE_TOKEN_TYPE:
+            node = FunctionCallLeftParenNode(token)
+        # Working on a function declaration
+        elif self.if_else_list and type(self.if_else_list[-1]) == FunctionNode:
+            node = FunctionDecLeftParenNode(token)
+        # Starting the condition of an "if" block of logic.
+        elif prev_token.ttype == KEYWORD_TOKEN_TYPE and prev_token.value == IF:
+            node = ConditionalLeftParenNode(token)
+        # This is a paren that is not linked to any key operations like an
+        # if/else block or a function call.
+        else:
+            node = LeftParenNode(token, token.value)
+        self.open_paren_types.append(type(node))
+        return node
+
+    def build_right_paren_node(self, token):
+        # The right paren always closes whatever the last unclosed left paren
+        # was, so nested calls and grouping parens close the right thing.
+        left_paren_type = self.open_paren_types.pop() if self.open_paren_types else LeftParenNode
+        closing_paren_type = CLOSING_PAREN_NODES.get(left_paren_type)
+        if not closing_paren_type:
+            return RightParenNode(token, token.value)
+        if closing_paren_type == FunctionDecRightParenNode:
+            self.if_else_list.pop()
+        return closing_paren_type(token)
+
+    def get_block_curl_nodes(self):
+        if not self.if_else_list:
+            return None
+        block_node = self.if_else_list[-1]
+        if type(block_node) == LogicKeywordNode:
+            return LOGIC_CURL_NODES.get(block_node.value)
+        return BLOCK_CURL_NODES.get(type(block_node))
+
+    def build_left_curl_node(self, token):
+        curl_nodes = self.get_block_curl_nodes()
+        # There is no loop or if/else block we are currently processing
+        if not curl_nodes:
+            return FunctionBodyLeftCurlNode(token)
+        return curl_nodes[0](token)
+
+    def build_right_curl_node(self, token):
+        curl_nodes = self.get_block_curl_nodes()
+        # There is no loop or if/else block we are currently processing
+        if not curl_nodes:
+            return FunctionBodyRightCurlNode(token)
+        # Remove the block node because we have finished processing it.
+        self.if_else_list.pop()
+        return curl_nodes[1](token)
+
     def build_non_keyword_line_ast(self, start_node):
         node_list = [start_node]
 
@@ -3190,18 +3669,12 @@ class Parser:
             elif var_typing == INT_64 and type(value_node) != NumberNode:
                 raise InvalidTypeDeclarationException(var_name_node.token.row, var_name_node.token.col)
         
-        type_to_max_val = {
-            INT_8: 255,
-            INT_16: 65536,
-            INT_32: 4294967296,
-            INT_64: 14294967296, # TODO(map) Get the right number
-            }
-        # TODO(map) Need to make a method to walk the right side and calculate
-        # the right side value to raise an error.
+        # NOTE(map) Values calculated from the right side are checked when
+        # they are folded by the ConstantFolder.
         if var_is_const:
-            max_value = type_to_max_val.get(var_type_node.value)
+            max_value = INT_MAX_VALUES.get(var_type_node.value)
         else:
-            max_value = type_to_max_val.get(var_node.value)
+            max_value = INT_MAX_VALUES.get(var_node.value)
 
         if type(value_node) == NumberNode and max_value < int(value_node.value):
             raise BufferOverflowException(var_name_node.token.row, var_name_node.token.col) 
@@ -3366,193 +3839,105 @@ class Parser:
         return comparator_node
 
     def build_ast_from_node_list(self, line_of_nodes):
-        # NOTE(map) Assumes that everything in the line_of_nodes list is either
-        # an expression of some sort (ie comparator, arithmetic, etc) or a
-        # literal node (ie strings, numbers, etc). If this is not the case then
-        # the logic here falls apart. This is because the nodes in the check
-        # below have priorities set correctly so the AST can be built. This also
-        # assumes that any node either has no children (primitive node) or only
-        # has a left/right side.
-
-        # Check to make sure the nodes are the type expected. This is really
-        # bad to have to do because this is called for every list of nodes on
-        # a conditional. Should be removed at some point but the assert is nice
-        # to have as a safety check
+        """
+        Build the AST for a line of expression nodes (ie comparators,
+        arithmetic, assignments and the values they work on) in a single pass
+        using precedence climbing.
+
+        Operands are pushed onto one stack and operators onto another. Before
+        an operator is pushed, every operator on the stack that binds at least
+        as tightly is joined with its two operands. Parens simply mark where
+        that joining has to stop, so any amount of nesting works without
+        recursing. Like before, each node after the first has its priority
+        raised by how deep in parens it is.
+        """
+        operands = []
+        operators = []
+        paren_depth = 0
+        prev_node = None
         for node in line_of_nodes:
-            assert type(node) in [NumberNode, StringNode, CharNode, BooleanNode, PlusMinusNode, MultiplyDivideNode, CompareNode, VariableReferenceNode, FunctionArgReferenceNode, AssignmentNode, FunctionKeywordNode, LeftParenNode, RightParenNode, FunctionCallLeftParenNode, FunctionCallRightParenNode, ArgSeparatorNode, LoopIdxKeywordNode], f"Type {type(node)} not allowed in AST build."
+            node_type = type(node)
+            if node_type == LeftParenNode:
+                paren_depth += 1
+                operators.append(node)
+                continue
+            elif node_type == RightParenNode:
+                paren_depth -= 1
+                while operators and type(operators[-1]) != LeftParenNode:
+                    self.reduce_expression(operands, operators)
+                if operators:
+                    operators.pop()
+                continue
 
-        # Initialize ast and loop over the list of nodes that should be valid.
-        ast = None
-        current_working_node = None
-        paren_counter = 0
-        for node in line_of_nodes:
-            # If there is a left paren we add one to the counter so it can be
-            # added to the priority of the operation giving it greater or equal
-            # priority when needed.
-            if type(node) == LeftParenNode:
-                paren_counter += 1
-            # Subtract away one from the counter if there is a right parent as
-            # this means we respect the non-inflated priorities.
-            elif type(node) == RightParenNode:
-                paren_counter -= 1
-            # AST has not been set yet
-            elif not ast:
-                ast = node
+            if paren_depth and prev_node:
+                node.priority += paren_depth
+
+            binding_power = EXPRESSION_BINDING_POWERS.get(node_type)
+            if binding_power is not None:
+                while operators:
+                    # Stop at a paren or an operator that binds less tightly.
+                    # Assignment groups from the right (ie `x = y = 3`) and
+                    # everything else groups from the left.
+                    stacked_binding_power = EXPRESSION_BINDING_POWERS.get(type(operators[-1]))
+                    if stacked_binding_power is None or stacked_binding_power < binding_power:
+                        break
+                    if stacked_binding_power == binding_power and node_type == AssignmentNode:
+                        break
+                    self.reduce_expression(operands, operators)
+                if node_type == AssignmentNode and (not operands or type(operands[-1]) != VariableReferenceNode):
+                    assert False, "Cannot assign to a non-variable node"
+                operators.append(node)
             else:
-                # Update the node's priority based on the paren counter
-                node.priority += paren_counter
-
-                # There is a node in the tree that is not complete yet.
-                if current_working_node:
-                    self.check_if_valid_operation(current_working_node.value, current_working_node.left_side, node)
-                    if type(node) in [NumberNode, CharNode, StringNode]:
-                        current_working_node.right_side = node
-                        node.parent_node = current_working_node
-                        current_working_node = None
-                    else:
-                        # Specifically want to error out if we are trying to
-                        # set the right side of a node to something other than
-                        # a primitive as the current working node should always
-                        # be able to handle a child.
-                        assert False, "Cannot process current working node."
-                # Plus or minus as current op and root of AST is lower or equal prio
-                elif type(node) == PlusMinusNode and ast.priority < node.priority:
-                    # AST is a primitive so we can just set the side appropriately
-                    if type(ast) in [NumberNode, VariableReferenceNode, FunctionArgReferenceNode]:
-                        node.left_side = ast
-                        ast.parent_node = node
-                        ast = node
-                    # We need to shuffle some things around
-                    else:
-                        node.left_side = ast.right_side
-                        node.left_side.parent_node = node
-                        ast.right_side = node
-                        node.parent_node = ast
-                        current_working_node = node
-                # Plus or minus as current op and root of AST is higher or prio
-                elif type(node) == PlusMinusNode and ast.priority >= node.priority:
-                    # AST is a compare or assignment node and the right side is set so we have to shuffle nodes
-                    if type(ast) in [CompareNode, AssignmentNode]:
-                        node.left_side = ast.right_side
-                        node.left_side.parent_node = node
-                        ast.right_side = node
-                        node.parent_node = ast
-                        current_working_node = node
-                    # Regular case where the left side of the node is assigned the AST
-                    else:
-                        node.left_side = ast
-                        ast.parent_node = node
-                        ast = node
-                # Multiply or divide as current op and root of AST is lower or equal prio
-                elif type(node) == MultiplyDivideNode and ast.priority < node.priority:
-                    # AST is a primitive so we can just set the side appropriately
-                    if type(ast) == NumberNode:
-                        node.left_side = ast
-                        ast.parent_node = node
-                        ast = node
-                    # Otherwise we have to do some shuffling around
-                    else:
-                        node.left_side = ast.right_side
-                        node.left_side.parent_node = node
-                        ast.right_side = node
-                        node.parent_node = ast
-                        current_working_node = node
-                # Multiply or divide as current op and root of AST is higher prio
-                elif type(node) == MultiplyDivideNode and ast.priority >= node.priority:
-                    node.left_side = ast
-                    ast.parent_node = node
-                    ast = node
-                # Assignment as current op
-                elif type(node) == AssignmentNode:
-                    # Check that AST is a variable reference type
-                    if type(ast) != VariableReferenceNode:
-                        assert False, "Cannot assign to a non-variable node"
-                    node.left_side = ast
-                    ast.parent_node = node
-                    ast = node
-                # Compare is the current op and root of AST is lower prio
-                elif type(node) == CompareNode and ast.priority < node.priority:
-                    node.left_side = ast
-                    ast.parent_node = node
-                    ast = node
-                # Number or variable reference node used in assignment
-                elif type(node) in [NumberNode, VariableReferenceNode] and type(ast) == AssignmentNode:
-                    left_side_type = self.variable_to_type_map.get(ast.left_side.value)
-                    if type(node) == VariableReferenceNode:
-                        right_side_type = self.variable_to_type_map.get(ast.left_side.value)
-                    elif type(node) == NumberNode and int(node.value) < 255:
-                        right_side_type = INT_8
-                    else:
-                        assert False, "In assignment and failed to determine type matching."
-
-                    # The left and right sides match so we can just set the ASTs right side
-                    if left_side_type == right_side_type:
-                        ast.right_side = node
-                        node.parent_node = ast
-                    # Both the left and right side types are int but they don't match so we have to make sure they fit.
-                    elif left_side_type in INT_KEYWORDS and right_side_type in INT_KEYWORDS:
-                        if right_side_type == INT_8:
-                            int_fits_in_var = True
-                        elif right_side_type == INT_16 and left_side_type in [INT_16, INT_32, INT_64]:
-                            int_fits_in_var = True
-                        elif right_side_type == INT_32 and left_side_type in [INT_32, INT_64]:
-                            int_fits_in_var = True
-                        elif right_side_type == INT_64 and left_side_type == INT_64:
-                            int_fits_in_var = True
-                        if int_fits_in_var:
-                            ast.right_side = node
-                            node.parent_node = ast
-                    # The types cannot be paired.
-                    else: 
-                        raise InvalidAssignmentException(ast.left_side.token.row, ast.left_side.token.col, left_side_type, right_side_type)
-                # Variable reference node and root node is compare node
-                elif type(node) == VariableReferenceNode and type(ast) == CompareNode:
-                    ast.right_side = node
-                    node.parent_node = ast
-                # Number node and no left side side of the AST
-                elif type(node) == NumberNode and not ast.left_side:
-                    ast.left_side = node
-                    node.parent_node = ast
-                # Number node and no right side side of the AST
-                elif type(node) == NumberNode and not ast.right_side:
-                    ast.right_side = node
-                    node.parent_node = ast
-                # Char node and no left side side of the AST
-                elif type(node) == CharNode and not ast.left_side:
-                    ast.left_side = node
-                    node.parent_node = ast
-                # Char node and no right side side of the AST
-                elif type(node) == CharNode and not ast.right_side:
-                    ast.right_side = node
-                    node.parent_node = ast
-                # Boolean node and no left side side of the AST
-                elif type(node) == BooleanNode and not ast.left_side:
-                    ast.left_side = node
-                    node.parent_node = ast
-                # Boolean node and no right side side of the AST
-                elif type(node) == BooleanNode and not ast.right_side:
-                    ast.right_side = node
-                    node.parent_node = ast
-                # Function node and no left side side of the AST
-                elif type(node) == FunctionKeywordNode and not ast.left_side:
-                    ast.left_side = node
-                    node.parent_node = ast
-                # Function node and no right side side of the AST
-                elif type(node) == FunctionKeywordNode and not ast.right_side:
-                    ast.right_side = node
-                    node.parent_node = ast
-                # Function arg reference node and no left side side of the AST
-                elif type(node) == FunctionArgReferenceNode and not ast.left_side:
-                    ast.left_side = node
-                    node.parent_node = ast
-                # Function arg reference node and no right side side of the AST
-                elif type(node) == FunctionArgReferenceNode and not ast.right_side:
-                    ast.right_side = node
-                    node.parent_node = ast
-                else:
-                    assert False, f"Not sure how to build AST for {type(node)}"
-
-        return ast
+                assert node_type in EXPRESSION_OPERAND_NODES, f"Type {node_type} not allowed in AST build."
+                # Only the value right after the equal sign is type checked.
+                if type(prev_node) == AssignmentNode and node_type in [NumberNode, VariableReferenceNode]:
+                    self.check_assignment_type(operands[-1], node)
+                operands.append(node)
+            prev_node = node
+
+        while operators:
+            if type(operators[-1]) == LeftParenNode:
+                operators.pop()
+            else:
+                self.reduce_expression(operands, operators)
+
+        assert len(operands) <= 1, f"Not sure how to build AST for {operands}"
+        return operands[0] if operands else None
+
+    def reduce_expression(self, operands, operators):
+        operator_node = operators.pop()
+        assert len(operands) >= 2, f"Not sure how to build AST for {type(operator_node)}"
+        right_side = operands.pop()
+        left_side = operands.pop()
+        self.check_if_valid_operation(operator_node.value, left_side, right_side)
+        operator_node.left_side = left_side
+        left_side.parent_node = operator_node
+        operator_node.right_side = right_side
+        right_side.parent_node = operator_node
+        operands.append(operator_node)
+
+    def check_assignment_type(self, variable_node, value_node):
+        left_side_type = self.variable_to_type_map.get(variable_node.value)
+        if type(value_node) == VariableReferenceNode:
+            right_side_type = self.variable_to_type_map.get(variable_node.value)
+        elif type(value_node) == NumberNode and int(value_node.value) < 255:
+            right_side_type = INT_8
+        else:
+            assert False, "In assignment and failed to determine type matching."
+
+        # Both the left and right side types are int but they don't match so
+        # we have to make sure they fit.
+        if left_side_type != right_side_type and left_side_type in INT_KEYWORDS and right_side_type in INT_KEYWORDS:
+            int_fits_in_var = (
+                right_side_type == INT_8
+                or (right_side_type == INT_16 and left_side_type in [INT_16, INT_32, INT_64])
+                or (right_side_type == INT_32 and left_side_type in [INT_32, INT_64])
+                or (right_side_type == INT_64 and left_side_type == INT_64)
+            )
+            assert int_fits_in_var, "Value does not fit in the variable."
+        # The types cannot be paired.
+        elif left_side_type != right_side_type:
+            raise InvalidAssignmentException(variable_node.token.row, variable_node.token.col, left_side_type, right_side_type)
 
     def build_arithmetic_line_ast(self, line_of_nodes):
         """
@@ -3759,13 +4144,301 @@ class Parser:
             pass
 
 
+##################
+# Constant Folding
+##################
+# Values are kept as unsigned 64 bit ints while folding, the same as the
+# registers the compiled program would do the arithmetic in.
+UINT_64_LIMIT = 2 ** 64
+# A folded value has to fit in the sign extended 32 bit immediate of a push.
+IMMEDIATE_MIN = -2 ** 31
+IMMEDIATE_MAX = 2 ** 31 - 1
+FOLDABLE_EXPRESSION_NODES = (PlusMinusNode, MultiplyDivideNode)
+
+
+class ConstantFolder:
+    """
+    Pass over the nodes from the Parser that works out anything that can be
+    known before the program runs. Arithmetic on numbers and const variables
+    is collapsed into a single number and if statements comparing them are
+    replaced with the side that would run.
+    """
+
+    def __init__(self, node_list):
+        self.node_list = node_list
+        # Name of const variables to their value and int type.
+        self.const_values = {}
+
+    def fold(self):
+        try:
+            for node in self.node_list:
+                self.fold_tree(node)
+        except BufferOverflowException as boe:
+            print_exception_message(program_lines, boe.col_num, boe)
+            sys.exit()
+        return self.node_list
+
+    def fold_tree(self, root):
+        # Declarations are checked after their right side has been folded so
+        # the walk comes back to them once their children are done.
+        nodes_to_visit = [(root, False)]
+        while nodes_to_visit:
+            node, children_folded = nodes_to_visit.pop()
+            if children_folded:
+                self.check_declaration(node)
+                continue
+            if isinstance(node, FOLDABLE_EXPRESSION_NODES):
+                node = self.fold_expression(node)
+            elif isinstance(node, LogicKeywordNode) and isinstance(node.child_node, CompareNode):
+                # The sides of the comparison have to be folded first for the
+                # branch to be known from them.
+                for side in (node.child_node.left_side, node.child_node.right_side):
+                    if isinstance(side, FOLDABLE_EXPRESSION_NODES):
+                        self.fold_expression(side)
+                taken_side = self.get_taken_side(node)
+                if taken_side is not None and self.replace_node_with_list(node, taken_side):
+                    nodes_to_visit.extend((side_node, False) for side_node in reversed(taken_side))
+                    continue
+            elif isinstance(node, AssignmentNode) and type(node.left_side) == VariableNode:
+                nodes_to_visit.append((node, True))
+            children = list(iter_child_nodes(node))
+            nodes_to_visit.extend((child, False) for child in reversed(children))
+
+    def get_leaf_value(self, node):
+        if type(node) == NumberNode:
+            return int(node.value) % UINT_64_LIMIT
+        elif type(node) == BooleanNode:
+            return 1 if node.value == "true" else 0
+        elif type(node) == VariableReferenceNode and node.value in self.const_values:
+            return self.const_values[node.value][0]
+        return None
+
+    def get_expression_values(self, root):
+        """
+        Work out the value of every node in the expression at `root` that
+        only depends on constants. Nodes that don't have None as their value.
+        """
+        values = {}
+        nodes_to_visit = [(root, False)]
+        while nodes_to_visit:
+            node, children_done = nodes_to_visit.pop()
+            if not isinstance(node, FOLDABLE_EXPRESSION_NODES):
+                values[id(node)] = self.get_leaf_value(node)
+            elif not children_done:
+                nodes_to_visit.append((node, True))
+                nodes_to_visit.append((node.right_side, False))
+                nodes_to_visit.append((node.left_side, False))
+            else:
+                values[id(node)] = self.calculate(node, values[id(node.left_side)], values[id(node.right_side)])
+        return values
+
+    def calculate(self, node, left_value, right_value):
+        if left_value is None or right_value is None:
+            return None
+        if node.value == "+":
+            # The add is checked for overflow against the type of the variable
+            # on the left, the same as the check done when the program runs.
+            int_type = INT_64
+            if type(node.left_side) == VariableReferenceNode:
+                int_type = self.const_values[node.left_side.value][1] or INT_64
+            type_limit = 2 ** INT_BIT_WIDTHS[int_type]
+            if left_value % type_limit + right_value % type_limit >= type_limit:
+                raise BufferOverflowException(node.token.row, node.token.col)
+            return (left_value + right_value) % UINT_64_LIMIT
+        elif node.value == "-":
+            return (left_value - right_value) % UINT_64_LIMIT
+        elif node.value == "*":
+            return (left_value * right_value) % UINT_64_LIMIT
+        elif node.value == "/":
+            # Leave dividing by zero to fail when the program runs.
+            if right_value == 0:
+                return None
+            return left_value // right_value
+        return None
+
+    def fold_expression(self, root):
+        """
+        Replace the largest parts of the expression at `root` that only
+        depend on constants with a number. Returns the node now at `root`.
+        """
+        values = self.get_expression_values(root)
+        new_root = root
+        nodes_to_visit = [root]
+        while nodes_to_visit:
+            node = nodes_to_visit.pop()
+            if not isinstance(node, FOLDABLE_EXPRESSION_NODES):
+                continue
+            value = values[id(node)]
+            signed_value = value - UINT_64_LIMIT if value is not None and value >= UINT_64_LIMIT // 2 else value
+            if signed_value is not None and IMMEDIATE_MIN <= signed_value <= IMMEDIATE_MAX:
+                number_node = NumberNode(node.token, str(signed_value), node.parent_node)
+                self.replace_node(node, number_node)
+                if node is root:
+                    new_root = number_node
+            else:
+                nodes_to_visit.extend((node.left_side, node.right_side))
+        return new_root
+
+    def get_taken_side(self, if_node):
+        """
+        Get the nodes of the side of an if statement that will run when its
+        comparison only depends on constants, otherwise None. A side that
+        declares variables is never thrown away since they are used after the
+        if statement.
+        """
+        compare_node = if_node.child_node
+        left_value = self.get_leaf_value(compare_node.left_side)
+        right_value = self.get_leaf_value(compare_node.right_side)
+        if left_value is None or right_value is None:
+            return None
+        # Comparisons are signed when the program runs.
+        left_value -= UINT_64_LIMIT if left_value >= UINT_64_LIMIT // 2 else 0
+        right_value -= UINT_64_LIMIT if right_value >= UINT_64_LIMIT // 2 else 0
+        if compare_node.value == ">":
+            is_true = left_value > right_value
+        elif compare_node.value == "<":
+            is_true = left_value < right_value
+        elif compare_node.value == "==":
+            is_true = left_value == right_value
+        else:
+            return None
+        taken_side, skipped_side = (if_node.true_side, if_node.false_side) if is_true else (if_node.false_side, if_node.true_side)
+        if skipped_side and self.has_declaration(skipped_side):
+            return None
+        return list(taken_side or [])
+
+    def has_declaration(self, nodes):
+        nodes_to_visit = list(nodes)
+        while nodes_to_visit:
+            node = nodes_to_visit.pop()
+            if type(node) == VariableNode:
+                return True
+            nodes_to_visit.extend(iter_child_nodes(node))
+        return False
+
+    def check_declaration(self, assignment_node):
+        """
+        Check a declared int fits in its type now that its value is known and
+        keep track of the value of const variables.
+        """
+        var_node = assignment_node.left_side
+        value_node = assignment_node.right_side
+        var_type = assignment_node.parent_node.value if assignment_node.parent_node else None
+        if type(value_node) == NumberNode and var_type in INT_KEYWORDS:
+            if int(value_node.value) > INT_MAX_VALUES[var_type]:
+                raise BufferOverflowException(var_node.token.row, var_node.token.col)
+            if var_node.is_const:
+                self.const_values[var_node.value] = (int(value_node.value) % UINT_64_LIMIT, var_type)
+        elif type(value_node) == BooleanNode and var_node.is_const:
+            self.const_values[var_node.value] = (self.get_leaf_value(value_node), None)
+
+    def replace_node(self, old_node, new_node):
+        parent_node = old_node.parent_node
+        if parent_node is None:
+            self.node_list[self.node_list.index(old_node)] = new_node
+            return
+        for attr, value in iter_child_fields(parent_node):
+            if value is old_node:
+                setattr(parent_node, attr, new_node)
+            elif isinstance(value, list):
+                for idx, item in enumerate(value):
+                    if item is old_node:
+                        value[idx] = new_node
+
+    def replace_node_with_list(self, old_node, new_nodes):
+        """
+        Swap a line in a body for the lines in `new_nodes`. Returns False if
+        the line isn't in a body that can be changed.
+        """
+        parent_node = old_node.parent_node
+        if parent_node is None:
+            return False
+        for _, value in iter_child_fields(parent_node):
+            if isinstance(value, list) and any(item is old_node for item in value):
+                idx = next(idx for idx, item in enumerate(value) if item is old_node)
+                value[idx:idx + 1] = new_nodes
+                for new_node in new_nodes:
+                    new_node.parent_node = parent_node
+                return True
+        return False
+
+
 ##########
 # Compiler
 ##########
+# Runtime functions and data that have to be written along with a runtime
+# function for it to work.
+RUNTIME_FUNCTION_DEPENDENCIES = {
+    "print_string": ("buffer_output",),
+    "printl_string": ("buffer_output", "flush_line_output"),
+    "print_num": ("divisor", "buffer_output"),
+    "printl_num": ("divisor", "buffer_output", "flush_line_output"),
+    "print_char": ("buffer_output",),
+    "printl_char": ("buffer_output", "flush_line_output"),
+    "buffer_output": ("output_buffer", "flush_output"),
+    "flush_output": ("output_buffer",),
+    "flush_line_output": ("output_buffer", "flush_output"),
+    "grow_memory_arena": ("memory_arena",),
+    "check_int_8_overflow": ("overflow_strings", "string_length", "print_string"),
+    "check_int_16_overflow": ("overflow_strings", "string_length", "print_string"),
+    "check_int_32_overflow": ("overflow_strings", "string_length", "print_string"),
+    "check_int_64_overflow": ("overflow_strings", "string_length", "print_string"),
+    "int_8_overflow": ("overflow_strings", "string_length", "print_string"),
+    "int_16_overflow": ("overflow_strings", "string_length", "print_string"),
+    "int_32_overflow": ("overflow_strings", "string_length", "print_string"),
+    "int_64_overflow": ("overflow_strings", "string_length", "print_string"),
+}
+# Scratch register and the low parts of rax and rbx that inline overflow
+# checks add together for the int types narrower than 64 bits.
+NARROW_OVERFLOW_REGISTERS = {
+    8: ("cl", "al", "bl"),
+    16: ("cx", "ax", "bx"),
+    32: ("ecx", "eax", "ebx"),
+}
+# Registers for the index and end of loops kept out of memory with
+# --register-loops. The first pair is for innermost loops, the second for the
+# loops directly around them. None of the compiled code or runtime functions
+# use these so they only need saving around calls to user functions.
+LOOP_INDEX_REGISTERS = (("r12", "r13"), ("r14", "r15"))
+# Bytes the memory arena grows by past what an allocation needs so most
+# allocations don't need a brk syscall.
+MEMORY_ARENA_CHUNK_SIZE = 65536
+# Bytes of output held before it has to be written out.
+OUTPUT_BUFFER_SIZE = 4096
+# Bytes reserved on the stack to convert a number to text. Digits are written
+# to 8 byte slots and an unsigned 64 bit number has at most 20 of them.
+NUM_TEXT_BUFFER_SIZE = 20 * 8
+
+
+def get_loop_height(loop_node):
+    """
+    Get how many levels of loops are nested inside of a loop, 0 for a loop
+    with no other loops in its body.
+    """
+    height = -1
+    visited = set()
+    nodes_to_visit = list(loop_node.loop_body)
+    while nodes_to_visit:
+        node = nodes_to_visit.pop()
+        if id(node) in visited:
+            continue
+        visited.add(id(node))
+        if isinstance(node, LoopKeywordNode):
+            height = max(height, get_loop_height(node))
+            continue
+        nodes_to_visit.extend(iter_child_nodes(node))
+    return height + 1
+
+
 class Compiler:
 
-    def __init__(self, node_list):
+    def __init__(self, node_list, optimize=False, register_loops=False, overflow_checks="inline"):
         self.node_list = node_list
+        self.optimize = optimize
+        self.register_loops = register_loops
+        # "inline" adds and jumps on carry, "call" calls the check_int_*_overflow
+        # runtime functions before adding.
+        self.overflow_checks = overflow_checks
         self.output_path = os.getcwd() + "/out.asm"
         self.string_count = 0
         self.char_count = 0
@@ -3776,11 +4449,15 @@ class Compiler:
         self.raw_char_count = 0
         self.conditional_count = 0
         self.loop_count = 0
+        self.allocation_count = 0
         self.raw_strings = {}
         self.raw_chars = {}
         self.variables = {}
         self.conditionals = {}
         self.loops = {}
+        # Loop count to the index and end registers of loops that aren't kept
+        # in the .loop_indices memory.
+        self.loop_registers = {}
         self.max_loop_count_depth = 0
         self.curr_loop_count_depth = 0
         self.loop_idx_asm = []
@@ -3788,20 +4465,47 @@ class Compiler:
         self.user_func_asm = {}
         self.function_and_args_map = {}
         self.curr_function_name = None
+        # All of the assembly for the program is written here before it ends
+        # up in the output file.
+        self.compiled_program = io.StringIO()
+        # Names of the runtime functions the program calls. Only these are
+        # written out with the program.
+        self.used_runtime_functions = set()
 
     def compile(self):
-        self.create_empty_out_file()
+        compiled_program = self.get_compiled_program()
+        self.write_compiled_program(compiled_program)
+        return compiled_program
+
+    def write_compiled_program(self, compiled_program):
+        # Everything is built in memory first so the output file only has to
+        # be opened and written once.
+        with open(self.output_path, 'w') as out_file:
+            out_file.write(compiled_program)
+
+    def get_compiled_program(self):
+        """
+        Build the assembly for the whole program in memory and return it
+        without writing anything to disk.
+        """
+        self.create_empty_program()
+        # Walk the program before writing anything so we know which runtime
+        # functions it needs.
+        asm = self.get_assembly()
         # Declare the global start only.
         self.create_global_start()
         # Set up the keyword built in functions
         self.create_keyword_functions()
         # Write the program
-        self.write_assembly()
+        self.write_assembly(asm)
         self.create_assembly_for_exit()
+        if self.optimize:
+            return "".join(optimize_assembly(self.compiled_program.getvalue().splitlines(keepends=True)))
+        return self.compiled_program.getvalue()
 
-    def create_empty_out_file(self):
-        with open(self.output_path, 'w') as compiled_program:
-            compiled_program.write(";; Start of program\n")
+    def create_empty_program(self):
+        self.compiled_program = io.StringIO()
+        self.compiled_program.write(";; Start of program\n")
 
     def create_start_point(self, compiled_program):
         compiled_program.write("section .text\n")
@@ -3812,7 +4516,7 @@ class Compiler:
         for single_node in self.node_list:
             if type(single_node) == StartNode:
                 for node in single_node.children_nodes:
-                    asm.extend(self.traverse_tree(node))
+                    self.traverse_tree(node, asm)
                     if self.max_loop_count_depth < self.curr_loop_count_depth:
                         self.max_loop_count_depth = self.curr_loop_count_depth
                     self.curr_loop_count_depth = 0
@@ -3822,77 +4526,86 @@ class Compiler:
                     self.max_loop_count_depth = self.curr_loop_count_depth
                 self.curr_loop_count_depth = 0
             else:
-                asm.extend(self.traverse_tree(single_node))
+                self.traverse_tree(single_node, asm)
         return asm
 
-    def write_assembly(self):
-        with open(self.output_path, 'a') as compiled_program:
-            asm = self.get_assembly()
-            # Write any user defined functions in to the assembly file.
-            self.write_user_functions()
-            # Write any raw strings that will be used that aren't assigned to a
-            # variable in the code.
-            for key in self.raw_strings:
-                for line in self.raw_strings[key]:
-                    compiled_program.write(line)
-            # Write any raw chars that will be used that aren't assigned to a
-            # variable in the code.
-            for key in self.raw_chars:
-                for line in self.raw_chars[key]:
-                    compiled_program.write(line)
-            # TODO(map) Order of operations isn't great here. Should consider
-            # making this a method or something
-            # Set up the loop index tracking information
-            if self.max_loop_count_depth > 0:
-                self.loop_idx_asm.append("section .loop_indices write\n")
-                for i in range(self.max_loop_count_depth):
-                    self.loop_idx_asm.append(f"    loop_idx_{i} dq 0\n")
-                    self.loop_idx_asm.append(f"    loop_end_{i} dq 0\n")
-            # Write the data for the max depth of the loops. If for instance,
-            # there is a max depth of nested loops of three, meaning there is a
-            # loop nested in a loop nested in a loop, we will only ever need
-            # to track a maximum of three loop indexes at any time.
-            for line in self.loop_idx_asm:
-                compiled_program.write(line)
-            # Write the variables first, them move to assembly.
-            for key in self.variables:
-                # Write the assembly for the string.
-                for line in self.variables[key]["asm"]:
-                    compiled_program.write(line)
-            self.create_start_point(compiled_program)
-            for line in self.initialize_vars_asm:
-                compiled_program.write(line)
-            for line in asm:
-                compiled_program.write(line)
-
-    def traverse_tree(self, node):
+    def write_assembly(self, asm):
+        compiled_program = self.compiled_program
+        # Write any user defined functions in to the assembly file.
+        self.write_user_functions()
+        # Write any raw strings that will be used that aren't assigned to a
+        # variable in the code.
+        for key in self.raw_strings:
+            compiled_program.writelines(self.raw_strings[key])
+        # Write any raw chars that will be used that aren't assigned to a
+        # variable in the code.
+        for key in self.raw_chars:
+            compiled_program.writelines(self.raw_chars[key])
+        # TODO(map) Order of operations isn't great here. Should consider
+        # making this a method or something
+        # Set up the loop index tracking information
+        if self.max_loop_count_depth > 0:
+            self.loop_idx_asm.append("section .loop_indices write\n")
+            for i in range(self.max_loop_count_depth):
+                self.loop_idx_asm.append(f"    loop_idx_{i} dq 0\n")
+                self.loop_idx_asm.append(f"    loop_end_{i} dq 0\n")
+        # Write the data for the max depth of the loops. If for instance,
+        # there is a max depth of nested loops of three, meaning there is a
+        # loop nested in a loop nested in a loop, we will only ever need
+        # to track a maximum of three loop indexes at any time.
+        compiled_program.writelines(self.loop_idx_asm)
+        # Write the variables first, them move to assembly.
+        for key in self.variables:
+            # Write the assembly for the string.
+            compiled_program.writelines(self.variables[key]["asm"])
+        self.create_start_point(compiled_program)
+        compiled_program.writelines(self.initialize_vars_asm)
+        compiled_program.writelines(asm)
+
+    def traverse_tree(self, node, tree_asm=None):
+        """
+        Walk the tree starting from `node` and return its assembly. Each step
+        of the walk adds the assembly for one node on to `tree_asm` and hands
+        back the next node to walk to, so long chains of nodes are walked in a
+        loop instead of recursing.
+        """
+        if tree_asm is None:
+            tree_asm = []
+        while node is not None:
+            node = self.traverse_node(node, tree_asm)
+        return tree_asm
+
+    def traverse_node(self, node, tree_asm):
         if isinstance(node, StartNode):
-            return []
+            return None
         elif isinstance(node, ExpressionNode):
             if node.left_side and not node.left_side.visited:
-                print_verbose_message(
-                    f"Traversing from {node} to left side node {node.left_side}")
-                return self.traverse_tree(node.left_side)
+                # Only build the message when it will be shown since printing
+                # the nodes walks their whole subtree.
+                if verbose_flag:
+                    print_verbose_message(f"Traversing from {node} to left side node {node.left_side}")
+                return node.left_side
             elif node.right_side and not node.right_side.visited:
-                print_verbose_message(
-                    f"Traversing from {node} to right side node {node.right_side}")
-                return self.traverse_tree(node.right_side)
+                if verbose_flag:
+                    print_verbose_message(f"Traversing from {node} to right side node {node.right_side}")
+                return node.right_side
             else:
                 node.visited = True
+                tree_asm.extend(self.process_op_node(node))
                 if node.can_traverse_to_parent():
-                    return self.process_op_node(node) + self.traverse_tree(node.parent_node)
-                else:
-                    return self.process_op_node(node)
+                    return node.parent_node
+                return None
         elif isinstance(node, NumberNode):
             node.visited = True
             if type(node.parent_node) == AssignmentNode:
-                return [] + self.traverse_tree(node.parent_node)
+                return node.parent_node
             elif node.can_traverse_to_parent():
-                return self.get_push_number_onto_stack_asm(node.value) + self.traverse_tree(node.parent_node)
+                tree_asm.extend(self.get_push_number_onto_stack_asm(node.value))
+                return node.parent_node
             else:
-                return self.get_push_number_onto_stack_asm(node.value)
+                tree_asm.extend(self.get_push_number_onto_stack_asm(node.value))
+                return None
         elif isinstance(node, FunctionKeywordNode):
-            asm = []
             if node.value == PRINT:
                 if type(node.arg_nodes[0]) == StringNode:
                     keyword_call_asm = self.get_print_string_keyword_asm()
@@ -3900,7 +4613,7 @@ class Compiler:
                     keyword_call_asm = self.get_print_num_keyword_asm()
                 elif type(node.arg_nodes[0]) == CharNode:
                     keyword_call_asm = self.get_print_char_keyword_asm()
-                elif type(node.arg_nodes[0]) == PlusMinusNode:
+                elif type(node.arg_nodes[0]) in (PlusMinusNode, MultiplyDivideNode):
                     # TODO(map) https://trello.com/c/wRuStWqL/11-update-the-print-node-logic-for-the-plusminusnode-to-handle-addition-of-things-other-than-strings
                     keyword_call_asm = self.get_print_num_keyword_asm()
                 elif self.variables[node.arg_nodes[0].value]:
@@ -3919,7 +4632,7 @@ class Compiler:
                     keyword_call_asm = self.get_printl_num_keyword_asm()
                 elif type(node.arg_nodes[0]) == CharNode:
                     keyword_call_asm = self.get_printl_char_keyword_asm()
-                elif type(node.arg_nodes[0]) == PlusMinusNode:
+                elif type(node.arg_nodes[0]) in (PlusMinusNode, MultiplyDivideNode):
                     # TODO(map) https://trello.com/c/wRuStWqL/11-update-the-print-node-logic-for-the-plusminusnode-to-handle-addition-of-things-other-than-strings
                     keyword_call_asm = self.get_printl_num_keyword_asm()
                 elif type(node.arg_nodes[0]) == LoopIdxKeywordNode:
@@ -3936,48 +4649,49 @@ class Compiler:
             elif node.value == UPDATE_CHAR:
                 keyword_call_asm = self.get_update_char_asm()
             elif node.value == COPY_STR:
-                # NOTE(map) This will not work with strings with different lengths.
-                # Need to implement memory management for this to work.
-                keyword_call_asm = self.get_copy_str_asm(self.variables[node.arg_nodes[0].value]["var_len"])
+                src = self.variables[node.arg_nodes[0].value]
+                keyword_call_asm = self.get_copy_str_asm(src["var_len"], self.variables[node.arg_nodes[1].value]["var_len"],
+                                                         src["is_const"])
             else:
                 # We don't know how to parse this keyword.
                 assert False, f"Unable to parse Function Keyword Node {node}"
             for arg_node in node.arg_nodes:
                 if not arg_node.visited:
-                    asm.extend(self.traverse_tree(arg_node))
+                    self.traverse_tree(arg_node, tree_asm)
+            tree_asm.extend(keyword_call_asm)
             if node.can_traverse_to_parent():
                 node.visited = True
-                return asm + keyword_call_asm + self.traverse_tree(node.parent_node)
+                return node.parent_node
             else:
                 node.visted = True
-                return asm + keyword_call_asm
+                return None
         elif isinstance(node, VariableKeywordNode):
             if node.child_node and not node.child_node.visited:
-                return self.traverse_tree(node.child_node)
+                return node.child_node
             elif node.can_traverse_to_parent():
                 node.visited = True
-                return self.traverse_tree(node.parent_node)
+                return node.parent_node
             else:
                 node.visted = True
-                return []
+                return None
         elif isinstance(node, StringNode):
             node.visited = True
             self.raw_string_count += 1
             key = f"raw_string_{self.raw_string_count}"
             self.raw_strings[key] = self.get_raw_string_asm(node.value, len(node.value), self.raw_string_count)
+            tree_asm.extend(self.get_push_string_asm(self.raw_string_count, len(node.value)))
             if node.can_traverse_to_parent():
-                return self.get_push_string_asm(self.raw_string_count, len(node.value)) + self.traverse_tree(node.parent_node)
-            else:
-                return self.get_push_string_asm(self.raw_string_count, len(node.value))
+                return node.parent_node
+            return None
         elif isinstance(node, CharNode):
             node.visited = True
             self.raw_char_count += 1
             key = f"raw_char_{self.raw_char_count}"
             self.raw_chars[key] = self.get_raw_char_asm(node.value, self.raw_char_count)
+            tree_asm.extend(self.get_push_char_asm(self.raw_char_count))
             if node.can_traverse_to_parent():
-                return self.get_push_char_asm(self.raw_char_count) + self.traverse_tree(node.parent_node)
-            else:
-                return self.get_push_char_asm(self.raw_char_count)
+                return node.parent_node
+            return None
         elif isinstance(node, VariableNode):
             self.var_count += 1
             node.visited = True
@@ -3986,7 +4700,8 @@ class Compiler:
             # as visited so we don't push onto the stack since we are just
             # assigning, and pass that value to the variable declaration.
             value_node = node.parent_node.right_side
-            print_verbose_message(f"Traversing from {node.parent_node} to right side node {value_node}")
+            if verbose_flag:
+                print_verbose_message(f"Traversing from {node.parent_node} to right side node {value_node}")
             value_node.visited = True
 
             if type(value_node) == StringNode:
@@ -4031,7 +4746,7 @@ class Compiler:
                 type_count = self.char_count
                 var_type = "char"
                 var_val = value_node.value
-                self.initialize_vars_asm.extend(self.traverse_tree(value_node))
+                self.traverse_tree(value_node, self.initialize_vars_asm)
                 self.initialize_vars_asm.extend(self.get_assign_char_at_value_to_var_asm(var_name))
             elif type(value_node) == FunctionReferenceNode:
                 # TODO(map) Need to update the appropriate count based on the type of the function return
@@ -4040,7 +4755,7 @@ class Compiler:
                 var_type = "num"
                 var_val = value_node.value
                 type_count = self.num_count
-                self.initialize_vars_asm.extend(self.traverse_tree(value_node))
+                self.traverse_tree(value_node, self.initialize_vars_asm)
                 # TODO(map) Again, this only works for ints right now
                 self.initialize_vars_asm.extend(self.get_assign_new_int_to_var_from_expression(var_name, INT_64))
             else:
@@ -4068,7 +4783,7 @@ class Compiler:
                 if type(value_node) == StringNode:
                     self.initialize_vars_asm.extend(self.get_initialize_var_asm(var_name, len(value_node.value), value_node.value))
                 self.variables[node.value]["is_const"] = False
-            return self.traverse_tree(node.parent_node)
+            return node.parent_node
         elif isinstance(node, VariableReferenceNode):
             node.visited = True
             # If the ref node is the left node of an assignment we don't need
@@ -4076,38 +4791,42 @@ class Compiler:
             # push the variable onto the stack during assignment.
             if type(node.parent_node) == AssignmentNode and node.parent_node.left_side.value == node.value:
                 if node.can_traverse_to_parent():
-                    return [] + self.traverse_tree(node.parent_node)
+                    return node.parent_node
                 else:
-                    return []
+                    return None
             elif type(node.parent_node) == AssignmentNode and type(node) in [NumberNode, VariableReferenceNode]:
                 # Case of right side of assignment is just a var
                 if node.can_traverse_to_parent():
                     var_ref = self.variables[node.value]["var_name"]
-                    return [
+                    tree_asm.extend([
                         f"    push qword [{var_ref}]\n",
                         "    pop rax\n"
-                    ] + self.traverse_tree(node.parent_node)
+                    ])
+                    return node.parent_node
                 else:
-                    return []
+                    return None
             # Case of referencing a node and needing it on the stack (ie print)
             var_ref = self.variables[node.value]["var_name"]
             is_const = self.variables[node.value]["is_const"]
             need_str_len = type(node.parent_node) == FunctionKeywordNode and node.parent_node.value in [PRINT, PRINTL]
+            tree_asm.extend(self.get_push_var_onto_stack_asm(node.value, var_ref, is_const, need_str_len))
             if node.can_traverse_to_parent():
-                return self.get_push_var_onto_stack_asm(node.value, var_ref, is_const, need_str_len) + self.traverse_tree(node.parent_node)
-            else:
-                return self.get_push_var_onto_stack_asm(node.value, var_ref, is_const, need_str_len)
+                return node.parent_node
+            return None
         elif isinstance(node, LogicKeywordNode):
             node.visited = True
             if not node.child_node.visited:
-                return self.traverse_tree(node.child_node)
+                return node.child_node
             conditional_mark_count = self.conditionals[node.child_node]
             if node.child_node.value == ">":
-                return self.traverse_greater_than_body(conditional_mark_count, node) + self.get_end_of_conditional_asm(conditional_mark_count)
+                tree_asm.extend(self.traverse_greater_than_body(conditional_mark_count, node) + self.get_end_of_conditional_asm(conditional_mark_count))
+                return None
             elif node.child_node.value == "<":
-                return self.traverse_less_than_body(conditional_mark_count, node) + self.get_end_of_conditional_asm(conditional_mark_count)
+                tree_asm.extend(self.traverse_less_than_body(conditional_mark_count, node) + self.get_end_of_conditional_asm(conditional_mark_count))
+                return None
             elif node.child_node.value == "==":
-                return self.traverse_equal_body(conditional_mark_count, node) + self.get_end_of_conditional_asm(conditional_mark_count)
+                tree_asm.extend(self.traverse_equal_body(conditional_mark_count, node) + self.get_end_of_conditional_asm(conditional_mark_count))
+                return None
             else:
                 assert False, f"Conditional {node.child_nod.value} not understood."
         # TODO(map) Passing the loop values as a tuple isn't great here. I should look for a way to map these to values to I can access them
@@ -4116,53 +4835,63 @@ class Compiler:
             if type(node) == LoopUpKeywordNode:
                 node.visited = True
                 self.loops[node] = (self.curr_loop_count_depth, self.loop_count)
+                self.assign_loop_registers(node)
                 self.loop_count += 1
                 self.curr_loop_count_depth += 1
                 if type(node.child_node) == VariableReferenceNode:
                     asm = self.get_push_loop_up_indices_with_var_asm(node.child_node.value, *self.loops[node]) + self.get_loop_up_asm_start(*self.loops[node]) + self.traverse_logic_node_children(node.loop_body) + self.get_loop_up_asm_end(*self.loops[node])
                 else:
                     asm = self.get_push_loop_indices_asm(0, node.child_node.value, *self.loops[node]) + self.get_loop_up_asm_start(*self.loops[node]) + self.traverse_logic_node_children(node.loop_body) + self.get_loop_up_asm_end(*self.loops[node])
-                return asm
+                tree_asm.extend(asm)
+                return None
             elif type(node) == LoopDownKeywordNode:
                 node.visited = True
                 self.loops[node] = (self.curr_loop_count_depth, self.loop_count)
+                self.assign_loop_registers(node)
                 self.loop_count += 1
                 self.curr_loop_count_depth += 1
                 if type(node.child_node) == VariableReferenceNode:
                     asm = self.get_push_loop_down_indices_with_var_asm(node.child_node.value, *self.loops[node]) + self.get_loop_down_asm_start(*self.loops[node]) + self.traverse_logic_node_children(node.loop_body) + self.get_loop_down_asm_end(*self.loops[node])
                 else:
                     asm = self.get_push_loop_indices_asm(node.child_node.value, 0, *self.loops[node]) + self.get_loop_down_asm_start(*self.loops[node]) + self.traverse_logic_node_children(node.loop_body) + self.get_loop_down_asm_end(*self.loops[node])
-                return asm            
+                tree_asm.extend(asm)
+                return None
             elif type(node) == LoopUpInclusiveKeywordNode:
                 node.visited = True
                 self.loops[node] = (self.curr_loop_count_depth, self.loop_count)
+                self.assign_loop_registers(node)
                 self.loop_count += 1
                 self.curr_loop_count_depth += 1
                 if type(node.child_node) == VariableReferenceNode:
                     asm = self.get_push_loop_up_indices_with_var_asm(node.child_node.value, *self.loops[node]) + self.get_loop_up_asm_start(*self.loops[node]) + self.traverse_logic_node_children(node.loop_body) + self.get_loop_up_inclusive_asm_end(*self.loops[node])
                 else:
                     asm = self.get_push_loop_indices_asm(0, node.child_node.value, *self.loops[node]) + self.get_loop_up_asm_start(*self.loops[node]) + self.traverse_logic_node_children(node.loop_body) + self.get_loop_up_inclusive_asm_end(*self.loops[node])
-                return asm
+                tree_asm.extend(asm)
+                return None
             elif type(node) == LoopDownKeywordNode:
                 node.visited = True
                 self.loops[node] = (self.curr_loop_count_depth, self.loop_count)
+                self.assign_loop_registers(node)
                 self.loop_count += 1
                 self.curr_loop_count_depth += 1
                 if type(node.child_node) == VariableReferenceNode:
                     asm = self.get_push_loop_down_indices_with_var_asm(node.child_node.value, *self.loops[node]) + self.get_loop_down_asm_start(*self.loops[node]) + self.traverse_logic_node_children(node.loop_body) + self.get_loop_down_asm_end(*self.loops[node])
                 else:
                     asm = self.get_push_loop_indices_asm(node.child_node.value, 0, *self.loops[node]) + self.get_loop_down_asm_start(*self.loops[node]) + self.traverse_logic_node_children(node.loop_body) + self.get_loop_down_asm_end(*self.loops[node])
-                return asm
+                tree_asm.extend(asm)
+                return None
             elif type(node) == LoopDownInclusiveKeywordNode:
                 node.visited = True
                 self.loops[node] = (self.curr_loop_count_depth, self.loop_count)
+                self.assign_loop_registers(node)
                 self.loop_count += 1
                 self.curr_loop_count_depth += 1
                 if type(node.child_node) == VariableReferenceNode:
                     asm = self.get_push_loop_down_indices_with_var_asm(node.child_node.value, *self.loops[node]) + self.get_loop_down_asm_start(*self.loops[node]) + self.traverse_logic_node_children(node.loop_body) + self.get_loop_down_inclusive_asm_end(*self.loops[node])
                 else:
                     asm = self.get_push_loop_indices_asm(node.child_node.value, 0, *self.loops[node]) + self.get_loop_down_asm_start(*self.loops[node]) + self.traverse_logic_node_children(node.loop_body) + self.get_loop_down_inclusive_asm_end(*self.loops[node])
-                return asm
+                tree_asm.extend(asm)
+                return None
             elif type(node) == LoopFromKeywordNode:
                 node.visited = True
                 # NOTE(map) This assumes that either side of the loopFrom values are a variable or a number.
@@ -4173,6 +4902,7 @@ class Compiler:
                 is_loop_ascending = first_loop_value < second_loop_value
                 node.visited = True
                 self.loops[node] = (self.curr_loop_count_depth, self.loop_count)
+                self.assign_loop_registers(node)
                 self.loop_count += 1
                 self.curr_loop_count_depth += 1
 
@@ -4205,7 +4935,8 @@ class Compiler:
 
                 self.curr_loop_count_depth += 1
                 self.loop_count += 1
-                return asm
+                tree_asm.extend(asm)
+                return None
             elif type(node) == LoopFromInclusiveKeywordNode:
                 node.visited = True
                 # NOTE(map) This assumes that either side of the loopFrom values are a variable or a number.
@@ -4216,6 +4947,7 @@ class Compiler:
                 is_loop_ascending = first_loop_value < second_loop_value
                 node.visited = True
                 self.loops[node] = (self.curr_loop_count_depth, self.loop_count)
+                self.assign_loop_registers(node)
                 self.loop_count += 1
                 self.curr_loop_count_depth += 1
 
@@ -4248,48 +4980,52 @@ class Compiler:
 
                 self.curr_loop_count_depth += 1
                 self.loop_count += 1
-                return asm
+                tree_asm.extend(asm)
+                return None
             else:
                 assert False, f"Not sure how to handle the loop node of type {type(node)}"
         elif type(node) == LoopIdxKeywordNode:
             loop_node = node
             while not isinstance(loop_node, LoopKeywordNode):
                 loop_node = loop_node.parent_node
-            return self.get_push_current_loop_idx_onto_stack(*self.loops[loop_node])
+            tree_asm.extend(self.get_push_current_loop_idx_onto_stack(*self.loops[loop_node]))
+            return None
         elif type(node) == BooleanNode:
             node.visited = True
             if type(node.parent_node) == AssignmentNode:
-                return [] + self.traverse_tree(node.parent_node)
-            elif node.can_traverse_to_parent():
-                return self.get_push_boolean_onto_stack(node.value) + self.traverse_tree(node.parent_node)
-            return self.get_push_boolean_onto_stack(node.value)
+                return node.parent_node
+            tree_asm.extend(self.get_push_boolean_onto_stack(node.value))
+            if node.can_traverse_to_parent():
+                return node.parent_node
+            return None
         elif type(node) == CharNode:
             node.visisted = True
             # We just need to return to the parent node because we would never
             # push the byte itself onto the stack here.
             if node.can_traverse_to_parent():
-                return [] + self.traverse_tree(node.parent_node)
-            return []
+                return node.parent_node
+            return None
         elif type(node) == MacroNode:
             # Don't need to return assembly here because the Parser already
             # subbed in the relevant nodes where the macro is referenced.
-            return []
+            return None
         elif type(node) == FunctionNode:
             # We need to walk through the function node and set it up as a label
             # that can be referenced and re-used over and over.
             node.visited = True
-            return [
+            tree_asm.extend([
                     f"section .text\n",
                     f"    {node.function_name.value}:\n",
                     "        ;; Get return address\n",
                     "        pop rcx\n",
                     "        ;; Get pointer to the args\n",
                     "        pop rdx\n",
-                    ] + self.traverse_function_node(node)
+                    ] + self.traverse_function_node(node))
+            return None
         elif type(node) == FunctionReturnNode:
             node.visited = True
             return_body_asm = self.traverse_tree(node.return_body)
-            return [
+            tree_asm.extend([
                     "        ;; Push return for this method onto the stack to save a reference\n",
                     "        push rcx\n",
                     ] + return_body_asm + [
@@ -4304,7 +5040,8 @@ class Compiler:
                     "        ;; Push return address onto stack\n",
                     "        push rcx\n",
                     "        ret\n",
-                    ]
+                    ])
+            return None
         elif type(node) == FunctionReferenceNode:
             func_reference_asm = [
                 "    ;; Push pointer to current stack position onto stack\n",
@@ -4313,21 +5050,25 @@ class Compiler:
             for idx, arg_node in enumerate(node.function_args):
                 func_reference_asm += [f"    ;; Push arg {idx + 1}\n"]
                 func_reference_asm += [f"    push {arg_node.value}\n"]
-            return func_reference_asm + [
+            save_asm, load_asm = self.get_spill_loop_registers_asm(node)
+            tree_asm.extend(save_asm + func_reference_asm + [
                 "    ;; Push pointer to the start of the args\n",
                 "    push rsp\n",
                 "    ;; Call add function\n",
                 f"    call {node.value}\n",
-            ]
+            ] + load_asm)
+            return None
         elif type(node) == FunctionArgReferenceNode:
             node.visited = True
             arg_loc = self.function_and_args_map[self.curr_function_name][node.value]
             if type(node.parent_node) == AssignmentNode:
-                return [] + self.traverse_tree(node.parent_node)
+                return node.parent_node
             elif node.can_traverse_to_parent():
-                return self.get_push_fn_arg_reference_onto_stack_asm(arg_loc) + self.traverse_tree(node.parent_node)
+                tree_asm.extend(self.get_push_fn_arg_reference_onto_stack_asm(arg_loc))
+                return node.parent_node
             else:
-                return self.get_push_fn_arg_reference_onto_stack_asm(arg_loc)
+                tree_asm.extend(self.get_push_fn_arg_reference_onto_stack_asm(arg_loc))
+                return None
         else:
             assert False, (f"This node type {type(node)} is not yet implemented.")
 
@@ -4361,12 +5102,50 @@ class Compiler:
             logic_asm += self.get_not_equal_side_asm(conditional_key)
         return logic_asm
 
+    def assign_loop_registers(self, loop_node):
+        """
+        Keep the index and end of a loop in registers when there is a pair
+        free for how many loops are nested inside of it.
+        """
+        if not self.register_loops:
+            return
+        height = get_loop_height(loop_node)
+        if height < len(LOOP_INDEX_REGISTERS):
+            self.loop_registers[self.loops[loop_node][1]] = LOOP_INDEX_REGISTERS[height]
+
+    def get_spill_loop_registers_asm(self, node):
+        """
+        Get the assembly to save the registers of the loops around a node to
+        their .loop_indices memory and to load them back again. Functions can
+        have loops of their own using the same registers.
+        """
+        save_asm = []
+        load_asm = []
+        loop_node = node.parent_node
+        while loop_node:
+            if isinstance(loop_node, LoopKeywordNode) and self.loops[loop_node][1] in self.loop_registers:
+                loop_level, loop_count = self.loops[loop_node]
+                loop_idx, loop_end = self.loop_registers[loop_count]
+                save_asm += [
+                    f"    mov qword [loop_idx_{loop_level}], {loop_idx}\n",
+                    f"    mov qword [loop_end_{loop_level}], {loop_end}\n",
+                ]
+                load_asm += [
+                    f"    mov {loop_idx}, [loop_idx_{loop_level}]\n",
+                    f"    mov {loop_end}, [loop_end_{loop_level}]\n",
+                ]
+            loop_node = loop_node.parent_node
+        if save_asm:
+            save_asm.insert(0, "    ;; Save loop registers before the call\n")
+            load_asm.insert(0, "    ;; Load loop registers after the call\n")
+        return save_asm, load_asm
+
     def traverse_logic_node_children(self, children):
         child_asm = []
         for child in children:
             if not child.visited:
                 child.visited = True
-                child_asm += self.traverse_tree(child)
+                self.traverse_tree(child, child_asm)
         return child_asm
 
     def traverse_function_node(self, node):
@@ -4402,7 +5181,7 @@ class Compiler:
         # there's no way to hold them all in the register. Need a way to track
         # the location of the args.
         for body_line in node.function_body:
-            function_body_asm += self.traverse_tree(body_line)
+            self.traverse_tree(body_line, function_body_asm)
 
         return function_body_asm
 
@@ -4437,7 +5216,8 @@ class Compiler:
                 compare_types = INT_64
             return self.get_conditional_equal_asm(self.conditional_count, compare_types)
         elif node.value == "=":
-            print_verbose_message(f"Should be assigning for node {node}")
+            if verbose_flag:
+                print_verbose_message(f"Should be assigning for node {node}")
             # This is an assignment of a new value to the variable.
             if type(node.parent_node) != VariableKeywordNode:
                 # If the right side of the assignment is an expression then we
@@ -4470,7 +5250,8 @@ class Compiler:
                     return self.get_assign_new_value_to_var_asm(self.variables[node.left_side.value]["var_name"], node.right_side.value)
             # Don't do anything if the parent is an AssignmentNode because the
             # parent_node will handle that assembly.
-            print_verbose_message(f"Node not doing anything {node}")
+            if verbose_flag:
+                print_verbose_message(f"Node not doing anything {node}")
             return []
         elif node.value == "..":
             # Don't need to get assembly here because the loop will handle it.
@@ -4479,502 +5260,520 @@ class Compiler:
             assert False, f"Unrecognized root node value {node.value}"
 
     def write_user_functions(self):
-        with open(self.output_path, 'a') as compiled_program:
-            for asm in self.user_func_asm.values():
-                for line in asm:
-                    compiled_program.write(line)
+        compiled_program = self.compiled_program
+        for asm in self.user_func_asm.values():
+            compiled_program.writelines(asm)
             
+    def use_runtime_function(self, name):
+        if name in self.used_runtime_functions:
+            return
+        self.used_runtime_functions.add(name)
+        for dependency in RUNTIME_FUNCTION_DEPENDENCIES.get(name, ()):
+            self.use_runtime_function(dependency)
+
     def create_keyword_functions(self):
-        self.create_constant_values()
-        self.create_error_string_constants()
-        self.create_print_string_function()
-        self.create_print_num_function()
-        self.create_print_char_function()
-        self.create_printl_string_function()
-        self.create_printl_num_function()
-        self.create_printl_char_function()
-        self.create_check_int_8_overflow_function()
-        self.create_check_int_16_overflow_function()
-        self.create_check_int_32_overflow_function()
-        self.create_check_int_64_overflow_function()
-        self.create_char_at_function()
-        self.create_update_char_function()
-        self.create_string_length()
-        self.allocate_memory()
+        runtime_functions = [
+            ("divisor", self.create_constant_values),
+            ("overflow_strings", self.create_error_string_constants),
+            ("output_buffer", self.create_output_buffer),
+            ("buffer_output", self.create_buffer_output_function),
+            ("flush_output", self.create_flush_output_function),
+            ("flush_line_output", self.create_flush_line_output_function),
+            ("print_string", self.create_print_string_function),
+            ("print_num", self.create_print_num_function),
+            ("print_char", self.create_print_char_function),
+            ("printl_string", self.create_printl_string_function),
+            ("printl_num", self.create_printl_num_function),
+            ("printl_char", self.create_printl_char_function),
+            ("check_int_8_overflow", self.create_check_int_8_overflow_function),
+            ("check_int_16_overflow", self.create_check_int_16_overflow_function),
+            ("check_int_32_overflow", self.create_check_int_32_overflow_function),
+            ("check_int_64_overflow", self.create_check_int_64_overflow_function),
+            ("int_8_overflow", lambda: self.create_int_overflow_handler(8)),
+            ("int_16_overflow", lambda: self.create_int_overflow_handler(16)),
+            ("int_32_overflow", lambda: self.create_int_overflow_handler(32)),
+            ("int_64_overflow", lambda: self.create_int_overflow_handler(64)),
+            ("char_at", self.create_char_at_function),
+            ("copy_string", self.create_copy_string_function),
+            ("update_char", self.create_update_char_function),
+            ("string_length", self.create_string_length),
+            ("memory_arena", self.create_memory_arena),
+            ("grow_memory_arena", self.create_grow_memory_arena_function),
+        ]
+        for name, create_function in runtime_functions:
+            if name in self.used_runtime_functions:
+                create_function()
 
     def create_constant_values(self):
-        with open(self.output_path, 'a') as compiled_program:
-            compiled_program.write("section .constants\n")
-            compiled_program.write("    divisor dq 10\n")
+        compiled_program = self.compiled_program
+        compiled_program.write("section .constants\n")
+        compiled_program.write("    ;; 2^67 / 10 rounded up so a multiply and shift right by 3 divides by 10.\n")
+        compiled_program.write("    divisor dq 0xcccccccccccccccd\n")
 
     def create_error_string_constants(self):
-        with open(self.output_path, 'a') as compiled_program:
-            compiled_program.write("section .error_strings\n")
-            compiled_program.write("    int_8_buffer_overflow_string db 'Buffer overflow on int8', 0\n")
-            compiled_program.write("    int_16_buffer_overflow_string db 'Buffer overflow on int16', 0\n")
-            compiled_program.write("    int_32_buffer_overflow_string db 'Buffer overflow on int32', 0\n")
-            compiled_program.write("    int_64_buffer_overflow_string db 'Buffer overflow on int64', 0\n")
+        compiled_program = self.compiled_program
+        compiled_program.write("section .error_strings\n")
+        compiled_program.write("    int_8_buffer_overflow_string db 'Buffer overflow on int8', 0\n")
+        compiled_program.write("    int_16_buffer_overflow_string db 'Buffer overflow on int16', 0\n")
+        compiled_program.write("    int_32_buffer_overflow_string db 'Buffer overflow on int32', 0\n")
+        compiled_program.write("    int_64_buffer_overflow_string db 'Buffer overflow on int64', 0\n")
+
+    def create_output_buffer(self):
+        compiled_program = self.compiled_program
+        compiled_program.write("section .bss\n")
+        compiled_program.write(f"    output_buffer resb {OUTPUT_BUFFER_SIZE}\n")
+        compiled_program.write("    output_buffer_len resq 1\n")
+        compiled_program.write("    ;; 0 until the first line is printed, then 1 for a terminal and 2 otherwise.\n")
+        compiled_program.write("    output_is_terminal resq 1\n")
+        compiled_program.write("    terminal_settings resb 64\n")
+
+    def create_buffer_output_function(self):
+        compiled_program = self.compiled_program
+        compiled_program.write("section .text\n")
+        compiled_program.write("    buffer_output:\n")
+        compiled_program.write("        ;; Append rdx bytes from rsi to the output buffer\n")
+        compiled_program.write("        mov rax, [output_buffer_len]\n")
+        compiled_program.write("        add rax, rdx\n")
+        compiled_program.write(f"        cmp rax, {OUTPUT_BUFFER_SIZE}\n")
+        compiled_program.write("        jbe copy_buffer_output\n")
+        compiled_program.write("        ;; Not enough room left so write out what is already buffered\n")
+        compiled_program.write("        push rsi\n")
+        compiled_program.write("        push rdx\n")
+        compiled_program.write("        call flush_output\n")
+        compiled_program.write("        pop rdx\n")
+        compiled_program.write("        pop rsi\n")
+        compiled_program.write(f"        cmp rdx, {OUTPUT_BUFFER_SIZE}\n")
+        compiled_program.write("        jbe copy_buffer_output\n")
+        compiled_program.write("        ;; Too big to ever fit in the buffer so write it straight out\n")
+        compiled_program.write("        mov rax, 1\n")
+        compiled_program.write("        mov rdi, 1\n")
+        compiled_program.write("        syscall\n")
+        compiled_program.write("        ret\n")
+        compiled_program.write("        copy_buffer_output:\n")
+        compiled_program.write("        mov rax, [output_buffer_len]\n")
+        compiled_program.write("        lea rdi, [output_buffer + rax]\n")
+        compiled_program.write("        add rax, rdx\n")
+        compiled_program.write("        mov [output_buffer_len], rax\n")
+        compiled_program.write("        mov rcx, rdx\n")
+        compiled_program.write("        rep movsb\n")
+        compiled_program.write("        ret\n")
+
+    def create_flush_output_function(self):
+        compiled_program = self.compiled_program
+        compiled_program.write("section .text\n")
+        compiled_program.write("    flush_output:\n")
+        compiled_program.write("        ;; Write out anything in the output buffer\n")
+        compiled_program.write("        mov rdx, [output_buffer_len]\n")
+        compiled_program.write("        test rdx, rdx\n")
+        compiled_program.write("        jz exit_flush_output\n")
+        compiled_program.write("        mov rsi, output_buffer\n")
+        compiled_program.write("        mov rax, 1\n")
+        compiled_program.write("        mov rdi, 1\n")
+        compiled_program.write("        syscall\n")
+        compiled_program.write("        mov qword [output_buffer_len], 0\n")
+        compiled_program.write("        exit_flush_output:\n")
+        compiled_program.write("        ret\n")
+
+    def create_flush_line_output_function(self):
+        compiled_program = self.compiled_program
+        compiled_program.write("section .text\n")
+        compiled_program.write("    flush_line_output:\n")
+        compiled_program.write("        ;; Lines are only written out straight away when printing to a terminal\n")
+        compiled_program.write("        mov rax, [output_is_terminal]\n")
+        compiled_program.write("        test rax, rax\n")
+        compiled_program.write("        jnz check_flush_line_output\n")
+        compiled_program.write("        ;; Getting the terminal settings of stdout only works for a terminal\n")
+        compiled_program.write("        mov rax, 16\n")
+        compiled_program.write("        mov rdi, 1\n")
+        compiled_program.write("        mov rsi, 0x5401\n")
+        compiled_program.write("        mov rdx, terminal_settings\n")
+        compiled_program.write("        syscall\n")
+        compiled_program.write("        test rax, rax\n")
+        compiled_program.write("        mov rax, 2\n")
+        compiled_program.write("        jnz save_flush_line_output\n")
+        compiled_program.write("        mov rax, 1\n")
+        compiled_program.write("        save_flush_line_output:\n")
+        compiled_program.write("        mov [output_is_terminal], rax\n")
+        compiled_program.write("        check_flush_line_output:\n")
+        compiled_program.write("        cmp rax, 1\n")
+        compiled_program.write("        jne exit_flush_line_output\n")
+        compiled_program.write("        call flush_output\n")
+        compiled_program.write("        exit_flush_line_output:\n")
+        compiled_program.write("        ret\n")
 
     def create_print_string_function(self):
-        with open(self.output_path, 'a') as compiled_program:
-            compiled_program.write("section .text\n")
-            compiled_program.write("    print_string:\n")
-            compiled_program.write("        ;; Print function\n")
-            compiled_program.write("        ;; Save return address\n")
-            compiled_program.write("        pop rbx\n")
-            compiled_program.write("        ;; Get variable value\n")
-            compiled_program.write("        pop rax\n")
-            compiled_program.write("        ;; Get variable length\n")
-            compiled_program.write("        pop rdx\n")
-            compiled_program.write("        mov rsi, rax\n")
-            compiled_program.write("        mov rax, 1\n")
-            compiled_program.write("        mov rdi, 1\n")
-            compiled_program.write("        syscall\n")
-            compiled_program.write("        ;; Push return address back.\n")
-            compiled_program.write("        push rbx\n")
-            compiled_program.write("        ret\n")
+        compiled_program = self.compiled_program
+        compiled_program.write("section .text\n")
+        compiled_program.write("    print_string:\n")
+        compiled_program.write("        ;; Print function\n")
+        compiled_program.write("        ;; Save return address\n")
+        compiled_program.write("        pop rbx\n")
+        compiled_program.write("        ;; Get variable value\n")
+        compiled_program.write("        pop rsi\n")
+        compiled_program.write("        ;; Get variable length\n")
+        compiled_program.write("        pop rdx\n")
+        compiled_program.write("        call buffer_output\n")
+        compiled_program.write("        ;; Push return address back.\n")
+        compiled_program.write("        push rbx\n")
+        compiled_program.write("        ret\n")
 
     def create_print_num_function(self):
-        with open(self.output_path, 'a') as compiled_program:
-            compiled_program.write("section .text\n")
-            compiled_program.write("    print_num:\n")
-            compiled_program.write("        ;; Print number function\n")
-            compiled_program.write("        ;; Save return address\n")
-            compiled_program.write("        pop rbx\n")
-            compiled_program.write("        ;; Set r9 to 0. This will be the bit counter to tell the write\n")
-            compiled_program.write("        ;; syscall how many bits to print to the screen.\n")
-            compiled_program.write("        mov r9, 0\n")
-            compiled_program.write("        ;; Get the value to print into rax\n")
-            compiled_program.write("        pop rax\n")
-            compiled_program.write("        ;; Put the divisor into the register\n")
-            compiled_program.write("        mov r8, [divisor]\n")
-            compiled_program.write("        ;; Reset the remainder\n")
-            compiled_program.write("        mov rdx, 0\n")
-            compiled_program.write("        div r8\n")
-            compiled_program.write("        ;; Add 8 bits the counter (r9)\n")
-            compiled_program.write("        add r9, 8\n")
-            compiled_program.write("        ;; Move rax (quotient) into rbx to reuse\n")
-            compiled_program.write("        mov r8, rax\n")
-            compiled_program.write("        ;; Push the remainder onto the stack (value to print)\n")
-            compiled_program.write("        add rdx, 48\n")
-            compiled_program.write("        push rdx\n")
-            compiled_program.write("        ;; We need to do an initial check for numbers that are single digit.\n")
-            compiled_program.write("        cmp r8, 0\n")
-            compiled_program.write("        ;; If single digit number\n")
-            compiled_program.write("        je print_print_num\n")
-            compiled_program.write("        ;; If not a single digit number\n")
-            compiled_program.write("        jne l1_print_num\n")
-            compiled_program.write("        l1_print_num:\n")
-            compiled_program.write("        mov rax, r8\n")
-            compiled_program.write("        ;; Put the divisor into the register\n")
-            compiled_program.write("        mov r8, [divisor]\n")
-            compiled_program.write("        ;; Reset the remainder\n")
-            compiled_program.write("        mov rdx, 0\n")
-            compiled_program.write("        div r8\n")
-            compiled_program.write("        ;; Move rax (quotient) into rbx to reuse\n")
-            compiled_program.write("        mov r8, rax\n")
-            compiled_program.write("        ;; Push the remainder onto the stack\n")
-            compiled_program.write("        add rdx, 48\n")
-            compiled_program.write("        push rdx\n")
-            compiled_program.write("        ;; Add 8 bits to the counter (r9)\n")
-            compiled_program.write("        add r9, 8\n")
-            compiled_program.write("        ;; If remainder then loop again\n")
-            compiled_program.write("        cmp r8, 0\n")
-            compiled_program.write("        ;; If no numbers remain\n")
-            compiled_program.write("        je print_print_num\n")
-            compiled_program.write("        ;; If numbers left continue to loop\n")
-            compiled_program.write("        jne l1_print_num\n")
-            compiled_program.write("        print_print_num:\n")
-            compiled_program.write("        ;; Print value\n")
-            compiled_program.write("        mov rsi, rsp\n")
-            compiled_program.write("        mov rax, 1\n")
-            compiled_program.write("        mov rdi, 1\n")
-            compiled_program.write("        mov rdx, r9\n")
-            compiled_program.write("        syscall\n")
-            compiled_program.write("        ;; Clean up data on the stack\n")
-            compiled_program.write("        clean_print_num_stack:\n")
-            compiled_program.write("        ;; Always one value guaranteed or the program wouldn't compile.\n")
-            compiled_program.write("        ;; Pop value on stack\n")
-            compiled_program.write("        pop rax\n")
-            compiled_program.write("        ;; Clobber rax with 8 as we are popping just to clean up stack.\n")
-            compiled_program.write("        ;; No sense in using a different reg since we don't care about the value.\n")
-            compiled_program.write("        mov rax, 8\n")
-            compiled_program.write("        sub r9, rax\n")
-            compiled_program.write("        cmp r9, 0\n")
-            compiled_program.write("        jne clean_print_num_stack\n")
-            compiled_program.write("        je exit_print_num\n")
-            compiled_program.write("        exit_print_num:\n")
-            compiled_program.write("        ;; Push return address back.\n")
-            compiled_program.write("        push rbx\n")
-            compiled_program.write("        ret\n")
+        compiled_program = self.compiled_program
+        compiled_program.write("section .text\n")
+        compiled_program.write("    print_num:\n")
+        compiled_program.write("        ;; Print number function\n")
+        compiled_program.write("        ;; Save return address\n")
+        compiled_program.write("        pop rbx\n")
+        compiled_program.write("        ;; Get the value to print into rax\n")
+        compiled_program.write("        pop rax\n")
+        compiled_program.write(f"        sub rsp, {NUM_TEXT_BUFFER_SIZE}\n")
+        compiled_program.writelines(self.get_num_to_text_asm("print_num"))
+        compiled_program.write("        ;; Print all of the digits at once\n")
+        compiled_program.write(f"        lea rdx, [rsp + {NUM_TEXT_BUFFER_SIZE}]\n")
+        compiled_program.write("        sub rdx, rsi\n")
+        compiled_program.write("        call buffer_output\n")
+        compiled_program.write(f"        add rsp, {NUM_TEXT_BUFFER_SIZE}\n")
+        compiled_program.write("        ;; Push return address back.\n")
+        compiled_program.write("        push rbx\n")
+        compiled_program.write("        ret\n")
+
+    def get_num_to_text_asm(self, name):
+        """
+        Convert the number in rax to text at the end of the buffer reserved
+        on the stack, leaving rsi pointing at the first digit. Each digit
+        takes up an 8 byte slot like the pushed digits it replaces did.
+        """
+        return [
+            "        ;; Fill the buffer from its end so the digits come out in order\n",
+            f"        lea rsi, [rsp + {NUM_TEXT_BUFFER_SIZE}]\n",
+            "        mov r8, [divisor]\n",
+            f"        l1_{name}:\n",
+            "        ;; Divide by 10 by multiplying with its reciprocal\n",
+            "        mov rcx, rax\n",
+            "        mul r8\n",
+            "        shr rdx, 3\n",
+            "        mov rax, rdx\n",
+            "        ;; Get the remainder from the quotient\n",
+            "        lea rdx, [rdx + rdx * 4]\n",
+            "        add rdx, rdx\n",
+            "        sub rcx, rdx\n",
+            "        add rcx, 48\n",
+            "        sub rsi, 8\n",
+            "        mov [rsi], rcx\n",
+            "        ;; If numbers left continue to loop\n",
+            "        test rax, rax\n",
+            f"        jnz l1_{name}\n",
+        ]
 
     def create_print_char_function(self):
-        with open(self.output_path, 'a') as compiled_program:
-            compiled_program.write("section .text\n")
-            compiled_program.write("    print_char:\n")
-            compiled_program.write("        ;; Save return address\n")
-            compiled_program.write("        pop rbx\n")
-            compiled_program.write("        mov rsi, rsp\n")
-            compiled_program.write("        mov rax, 1\n")
-            compiled_program.write("        mov rdi, 1\n")
-            compiled_program.write("        mov rdx, 1\n")
-            compiled_program.write("        syscall\n")
-            compiled_program.write("         ;; Push return address back.\n")
-            compiled_program.write("         push rbx\n")
-            compiled_program.write("         ret\n")
+        compiled_program = self.compiled_program
+        compiled_program.write("section .text\n")
+        compiled_program.write("    print_char:\n")
+        compiled_program.write("        ;; Save return address\n")
+        compiled_program.write("        pop rbx\n")
+        compiled_program.write("        mov rsi, rsp\n")
+        compiled_program.write("        mov rdx, 1\n")
+        compiled_program.write("        call buffer_output\n")
+        compiled_program.write("         ;; Push return address back.\n")
+        compiled_program.write("         push rbx\n")
+        compiled_program.write("         ret\n")
  
     def create_printl_string_function(self):
-        with open(self.output_path, 'a') as compiled_program:
-            compiled_program.write("section .text\n")
-            compiled_program.write("    printl_string:\n")
-            compiled_program.write("        ;; Print function\n")
-            compiled_program.write("        ;; Save return address\n")
-            compiled_program.write("        pop rbx\n")
-            compiled_program.write("        ;; Get variable value\n")
-            compiled_program.write("        pop rax\n")
-            compiled_program.write("        ;; Get variable length\n")
-            compiled_program.write("        pop rdx\n")
-            compiled_program.write("        mov rsi, rax\n")
-            compiled_program.write("        mov rax, 1\n")
-            compiled_program.write("        mov rdi, 1\n")
-            compiled_program.write("        syscall\n")
-            compiled_program.write("        ;; Add linefeed.\n")
-            compiled_program.write("        push 10\n")
-            compiled_program.write("        mov rsi, rsp\n")
-            compiled_program.write("        mov rdx, 4\n")
-            compiled_program.write("        mov rax, 1\n")
-            compiled_program.write("        mov rdi, 1\n")
-            compiled_program.write("        syscall\n")
-            compiled_program.write("        ;; Remove value at top of stack.\n")
-            compiled_program.write("        pop rax\n")
-            compiled_program.write("        ;; Add return carriage.\n")
-            compiled_program.write("        push 13\n")
-            compiled_program.write("        mov rsi, rsp\n")
-            compiled_program.write("        mov rdx, 4\n")
-            compiled_program.write("        mov rax, 1\n")
-            compiled_program.write("        mov rdi, 1\n")
-            compiled_program.write("        syscall\n")
-            compiled_program.write("        ;; Remove value at top of stack.\n")
-            compiled_program.write("        pop rax\n")
-            compiled_program.write("        ;; Push return address back.\n")
-            compiled_program.write("        push rbx\n")
-            compiled_program.write("        ret\n")
+        compiled_program = self.compiled_program
+        compiled_program.write("section .text\n")
+        compiled_program.write("    printl_string:\n")
+        compiled_program.write("        ;; Print function\n")
+        compiled_program.write("        ;; Save return address\n")
+        compiled_program.write("        pop rbx\n")
+        compiled_program.write("        ;; Get variable value\n")
+        compiled_program.write("        pop rsi\n")
+        compiled_program.write("        ;; Get variable length\n")
+        compiled_program.write("        pop rdx\n")
+        compiled_program.write("        call buffer_output\n")
+        compiled_program.writelines(self.get_buffer_line_end_asm())
+        compiled_program.write("        ;; Push return address back.\n")
+        compiled_program.write("        push rbx\n")
+        compiled_program.write("        ret\n")
+
+    def get_buffer_line_end_asm(self):
+        return [
+            "        ;; Add linefeed and return carriage.\n",
+            "        mov rcx, 0x0000000d0000000a\n",
+            "        push rcx\n",
+            "        mov rsi, rsp\n",
+            "        mov rdx, 8\n",
+            "        call buffer_output\n",
+            "        ;; Remove value at top of stack.\n",
+            "        pop rcx\n",
+            "        call flush_line_output\n",
+        ]
 
     def create_printl_num_function(self):
-        with open(self.output_path, 'a') as compiled_program:
-            compiled_program.write("section .text\n")
-            compiled_program.write("    printl_num:\n")
-            compiled_program.write("        ;; Print number function\n")
-            compiled_program.write("        ;; Save return address\n")
-            compiled_program.write("        pop rbx\n")
-            compiled_program.write("        ;; Set r9 to 0. This will be the bit counter to tell the write\n")
-            compiled_program.write("        ;; syscall how many bits to print to the screen.\n")
-            compiled_program.write("        mov r9, 0\n")
-            compiled_program.write("        ;; Get the value to print into rax\n")
-            compiled_program.write("        pop rax\n")
-            compiled_program.write("        ;; Put the divisor into the register\n")
-            compiled_program.write("        mov r8, [divisor]\n")
-            compiled_program.write("        ;; Reset the remainder\n")
-            compiled_program.write("        mov rdx, 0\n")
-            compiled_program.write("        div r8\n")
-            compiled_program.write("        ;; Add 8 bits the counter (r9)\n")
-            compiled_program.write("        add r9, 8\n")
-            compiled_program.write("        ;; Move rax (quotient) into rbx to reuse\n")
-            compiled_program.write("        mov r8, rax\n")
-            compiled_program.write("        ;; Push the remainder onto the stack (value to print)\n")
-            compiled_program.write("        add rdx, 48\n")
-            compiled_program.write("        push rdx\n")
-            compiled_program.write("        ;; If there is no need to loop go straight to printing\n")
-            compiled_program.write("        cmp r8, 0\n")
-            compiled_program.write("        ;; If no numbers remain\n")
-            compiled_program.write("        je print_printl_num\n")
-            compiled_program.write("        l1_printl_num:\n")
-            compiled_program.write("        mov rax, r8\n")
-            compiled_program.write("        ;; Put the divisor into the register\n")
-            compiled_program.write("        mov r8, [divisor]\n")
-            compiled_program.write("        ;; Reset the remainder\n")
-            compiled_program.write("        mov rdx, 0\n")
-            compiled_program.write("        div r8\n")
-            compiled_program.write("        ;; Move rax (quotient) into rbx to reuse\n")
-            compiled_program.write("        mov r8, rax\n")
-            compiled_program.write("        ;; Push the remainder onto the stack\n")
-            compiled_program.write("        add rdx, 48\n")
-            compiled_program.write("        push rdx\n")
-            compiled_program.write("        ;; Add 8 bits to the counter (r9)\n")
-            compiled_program.write("        add r9, 8\n")
-            compiled_program.write("        ;; If remainder then loop again\n")
-            compiled_program.write("        cmp r8, 0\n")
-            compiled_program.write("        ;; If no numbers remain\n")
-            compiled_program.write("        je print_printl_num\n")
-            compiled_program.write("        ;; If numbers left continue to loop\n")
-            compiled_program.write("        jne l1_printl_num\n")
-            compiled_program.write("        print_printl_num:\n")
-            compiled_program.write("        ;; Print value\n")
-            compiled_program.write("        mov rsi, rsp\n")
-            compiled_program.write("        mov rax, 1\n")
-            compiled_program.write("        mov rdi, 1\n")
-            compiled_program.write("        mov rdx, r9\n")
-            compiled_program.write("        syscall\n")
-            compiled_program.write("        ;; Clean up data on the stack\n")
-            compiled_program.write("        clean_printl_num_stack:\n")
-            compiled_program.write("        ;; Always one value guaranteed or the program wouldn't compile.\n")
-            compiled_program.write("        ;; Pop value on stack\n")
-            compiled_program.write("        pop rax\n")
-            compiled_program.write("        ;; Clobber rax with 8 as we are popping just to clean up stack.\n")
-            compiled_program.write("        ;; No sense in using a different reg since we don't care about the value.\n")
-            compiled_program.write("        mov rax, 8\n")
-            compiled_program.write("        sub r9, rax\n")
-            compiled_program.write("        cmp r9, 0\n")
-            compiled_program.write("        jne clean_printl_num_stack\n")
-            compiled_program.write("        je exit_printl_num\n")
-            compiled_program.write("        exit_printl_num:\n")
-            compiled_program.write("        ;; Add linefeed.\n")
-            compiled_program.write("        push 10\n")
-            compiled_program.write("        mov rsi, rsp\n")
-            compiled_program.write("        mov rdx, 4\n")
-            compiled_program.write("        mov rax, 1\n")
-            compiled_program.write("        mov rdi, 1\n")
-            compiled_program.write("        syscall\n")
-            compiled_program.write("        ;; Clean up line feed print\n")
-            compiled_program.write("        pop rax\n")
-            compiled_program.write("        ;; Add return carriage.\n")
-            compiled_program.write("        push 13\n")
-            compiled_program.write("        mov rsi, rsp\n")
-            compiled_program.write("        mov rdx, 4\n")
-            compiled_program.write("        mov rax, 1\n")
-            compiled_program.write("        mov rdi, 1\n")
-            compiled_program.write("        syscall\n")
-            compiled_program.write("        ;; Clean up line return carriage print\n")
-            compiled_program.write("        pop rax\n")
-            compiled_program.write("        ;; Push return address back.\n")
-            compiled_program.write("        push rbx\n")
-            compiled_program.write("        ret\n")
+        compiled_program = self.compiled_program
+        compiled_program.write("section .text\n")
+        compiled_program.write("    printl_num:\n")
+        compiled_program.write("        ;; Print number function\n")
+        compiled_program.write("        ;; Save return address\n")
+        compiled_program.write("        pop rbx\n")
+        compiled_program.write("        ;; Get the value to print into rax\n")
+        compiled_program.write("        pop rax\n")
+        compiled_program.write("        ;; Leave room after the digits for the line feed and return carriage\n")
+        compiled_program.write(f"        sub rsp, {NUM_TEXT_BUFFER_SIZE + 8}\n")
+        compiled_program.writelines(self.get_num_to_text_asm("printl_num"))
+        compiled_program.write("        ;; Add linefeed and return carriage.\n")
+        compiled_program.write("        mov rcx, 0x0000000d0000000a\n")
+        compiled_program.write(f"        mov [rsp + {NUM_TEXT_BUFFER_SIZE}], rcx\n")
+        compiled_program.write("        ;; Print all of the digits and the line end at once\n")
+        compiled_program.write(f"        lea rdx, [rsp + {NUM_TEXT_BUFFER_SIZE + 8}]\n")
+        compiled_program.write("        sub rdx, rsi\n")
+        compiled_program.write("        call buffer_output\n")
+        compiled_program.write(f"        add rsp, {NUM_TEXT_BUFFER_SIZE + 8}\n")
+        compiled_program.write("        call flush_line_output\n")
+        compiled_program.write("        ;; Push return address back.\n")
+        compiled_program.write("        push rbx\n")
+        compiled_program.write("        ret\n")
     
     def create_printl_char_function(self):
-        with open(self.output_path, 'a') as compiled_program:
-            compiled_program.write("section .text\n")
-            compiled_program.write("    printl_char:\n")
-            compiled_program.write("        ;; Save return address\n")
-            compiled_program.write("        pop rbx\n")
-            compiled_program.write("        mov rsi, rsp\n")
-            compiled_program.write("        mov rax, 1\n")
-            compiled_program.write("        mov rdi, 1\n")
-            compiled_program.write("        mov rdx, 1\n")
-            compiled_program.write("        syscall\n")
-            compiled_program.write("        ;; Add linefeed.\n")
-            compiled_program.write("        push 10\n")
-            compiled_program.write("        mov rsi, rsp\n")
-            compiled_program.write("        mov rdx, 4\n")
-            compiled_program.write("        mov rax, 1\n")
-            compiled_program.write("        mov rdi, 1\n")
-            compiled_program.write("        syscall\n")
-            compiled_program.write("        ;; Remove value at top of stack.\n")
-            compiled_program.write("        pop rax\n")
-            compiled_program.write("        ;; Add return carriage.\n")
-            compiled_program.write("        push 13\n")
-            compiled_program.write("        mov rsi, rsp\n")
-            compiled_program.write("        mov rdx, 4\n")
-            compiled_program.write("        mov rax, 1\n")
-            compiled_program.write("        mov rdi, 1\n")
-            compiled_program.write("        syscall\n")
-            compiled_program.write("        ;; Remove value at top of stack.\n")
-            compiled_program.write("        pop rax\n")
-            compiled_program.write("         ;; Push return address back.\n")
-            compiled_program.write("         push rbx\n")
-            compiled_program.write("         ret\n")
+        compiled_program = self.compiled_program
+        compiled_program.write("section .text\n")
+        compiled_program.write("    printl_char:\n")
+        compiled_program.write("        ;; Save return address\n")
+        compiled_program.write("        pop rbx\n")
+        compiled_program.write("        mov rsi, rsp\n")
+        compiled_program.write("        mov rdx, 1\n")
+        compiled_program.write("        call buffer_output\n")
+        compiled_program.writelines(self.get_buffer_line_end_asm())
+        compiled_program.write("        ;; Push return address back.\n")
+        compiled_program.write("        push rbx\n")
+        compiled_program.write("        ret\n")
 
     def create_check_int_8_overflow_function(self):
-        with open(self.output_path, 'a') as compiled_program:
-            compiled_program.write("section .text\n")
-            compiled_program.write("   check_int_8_overflow:\n")
-            compiled_program.write("      pop rcx ;; Get return address\n")
-            compiled_program.write("      pop rdx ;; Get value to add\n")
-            compiled_program.write("      pop rbx ;; Get current value of variable\n")
-            compiled_program.write("      movzx rbx, al ;; Move 8 bits into the rax registery\n")
-            compiled_program.write("      add al, dl\n")
-            compiled_program.write("      jnc no_overflow_int_8\n")
-            compiled_program.write("      jc has_overflow_int_8\n")
-            compiled_program.write("      no_overflow_int_8:\n")
-            compiled_program.write("      push rcx\n")
-            compiled_program.write("      ret\n")
-            compiled_program.write("      has_overflow_int_8:\n")
-            compiled_program.write("      ;; Calculate const string length and push onto stack with string\n")
-            compiled_program.write("      push int_8_buffer_overflow_string\n")
-            compiled_program.write("      push int_8_buffer_overflow_string\n")
-            compiled_program.write("      call string_length\n")
-            compiled_program.write("      push int_8_buffer_overflow_string\n")
-            compiled_program.write("      ;; Keyword Func\n")
-            compiled_program.write("      call print_string\n")
-            compiled_program.write("      mov rax, 60\n")
-            compiled_program.write("      mov rdi, 8\n")
-            compiled_program.write("      syscall\n")
+        compiled_program = self.compiled_program
+        compiled_program.write("section .text\n")
+        compiled_program.write("   check_int_8_overflow:\n")
+        compiled_program.write("      pop rcx ;; Get return address\n")
+        compiled_program.write("      pop rdx ;; Get value to add\n")
+        compiled_program.write("      pop rbx ;; Get current value of variable\n")
+        compiled_program.write("      movzx rbx, al ;; Move 8 bits into the rax registery\n")
+        compiled_program.write("      add al, dl\n")
+        compiled_program.write("      jnc no_overflow_int_8\n")
+        compiled_program.write("      jc has_overflow_int_8\n")
+        compiled_program.write("      no_overflow_int_8:\n")
+        compiled_program.write("      push rcx\n")
+        compiled_program.write("      ret\n")
+        compiled_program.write("      has_overflow_int_8:\n")
+        compiled_program.write("      ;; Calculate const string length and push onto stack with string\n")
+        compiled_program.write("      push int_8_buffer_overflow_string\n")
+        compiled_program.write("      push int_8_buffer_overflow_string\n")
+        compiled_program.write("      call string_length\n")
+        compiled_program.write("      push int_8_buffer_overflow_string\n")
+        compiled_program.write("      ;; Keyword Func\n")
+        compiled_program.write("      call print_string\n")
+        compiled_program.write("      call flush_output\n")
+        compiled_program.write("      mov rax, 60\n")
+        compiled_program.write("      mov rdi, 8\n")
+        compiled_program.write("      syscall\n")
 
     def create_check_int_16_overflow_function(self):
-        with open(self.output_path, 'a') as compiled_program:
-            compiled_program.write("section .text\n")
-            compiled_program.write("   check_int_16_overflow:\n")
-            compiled_program.write("       pop rcx ;; Get return address\n")
-            compiled_program.write("       pop rdx ;; Get value to add\n")
-            compiled_program.write("       pop rbx ;; Get current value of variable\n")
-            compiled_program.write("       movzx rbx, ax ;; Move 16 bits into the rax registery\n")
-            compiled_program.write("       add dx, ax\n")
-            compiled_program.write("       jnc no_overflow_int_16\n")
-            compiled_program.write("       jc has_overflow_int_16\n")
-            compiled_program.write("       no_overflow_int_16:\n")
-            compiled_program.write("       push rcx\n")
-            compiled_program.write("       ret\n")
-            compiled_program.write("       has_overflow_int_16:\n")
-            compiled_program.write("       push int_16_buffer_overflow_string\n")
-            compiled_program.write("       push int_16_buffer_overflow_string\n")
-            compiled_program.write("       call string_length\n")
-            compiled_program.write("       push int_16_buffer_overflow_string\n")
-            compiled_program.write("       call print_string\n")
-            compiled_program.write("       mov rax, 60\n")
-            compiled_program.write("       mov rdi, 16 \n")
-            compiled_program.write("       syscall\n")
+        compiled_program = self.compiled_program
+        compiled_program.write("section .text\n")
+        compiled_program.write("   check_int_16_overflow:\n")
+        compiled_program.write("       pop rcx ;; Get return address\n")
+        compiled_program.write("       pop rdx ;; Get value to add\n")
+        compiled_program.write("       pop rbx ;; Get current value of variable\n")
+        compiled_program.write("       movzx rbx, ax ;; Move 16 bits into the rax registery\n")
+        compiled_program.write("       add dx, ax\n")
+        compiled_program.write("       jnc no_overflow_int_16\n")
+        compiled_program.write("       jc has_overflow_int_16\n")
+        compiled_program.write("       no_overflow_int_16:\n")
+        compiled_program.write("       push rcx\n")
+        compiled_program.write("       ret\n")
+        compiled_program.write("       has_overflow_int_16:\n")
+        compiled_program.write("       push int_16_buffer_overflow_string\n")
+        compiled_program.write("       push int_16_buffer_overflow_string\n")
+        compiled_program.write("       call string_length\n")
+        compiled_program.write("       push int_16_buffer_overflow_string\n")
+        compiled_program.write("       call print_string\n")
+        compiled_program.write("       call flush_output\n")
+        compiled_program.write("       mov rax, 60\n")
+        compiled_program.write("       mov rdi, 16 \n")
+        compiled_program.write("       syscall\n")
 
     def create_check_int_32_overflow_function(self):
-        with open(self.output_path, 'a') as compiled_program:
-            compiled_program.write("section .text\n")
-            compiled_program.write("   check_int_32_overflow:\n")
-            compiled_program.write("       pop rcx ;; Get return address\n")
-            compiled_program.write("       pop rdx ;; Get value to add\n")
-            compiled_program.write("       pop rbx ;; Get current value of variable\n")
-            compiled_program.write("       add ebx, edx\n")
-            compiled_program.write("       jnc no_overflow_int_32\n")
-            compiled_program.write("       jc has_overflow_int_32\n")
-            compiled_program.write("       no_overflow_int_32:\n")
-            compiled_program.write("       push rcx\n")
-            compiled_program.write("       ret\n")
-            compiled_program.write("       has_overflow_int_32:\n")
-            compiled_program.write("       push int_32_buffer_overflow_string\n")
-            compiled_program.write("       push int_32_buffer_overflow_string\n")
-            compiled_program.write("       call string_length\n")
-            compiled_program.write("       push int_32_buffer_overflow_string\n")
-            compiled_program.write("       call print_string\n")
-            compiled_program.write("       mov rax, 60\n")
-            compiled_program.write("       mov rdi, 32 \n")
-            compiled_program.write("       syscall\n")
+        compiled_program = self.compiled_program
+        compiled_program.write("section .text\n")
+        compiled_program.write("   check_int_32_overflow:\n")
+        compiled_program.write("       pop rcx ;; Get return address\n")
+        compiled_program.write("       pop rdx ;; Get value to add\n")
+        compiled_program.write("       pop rbx ;; Get current value of variable\n")
+        compiled_program.write("       add ebx, edx\n")
+        compiled_program.write("       jnc no_overflow_int_32\n")
+        compiled_program.write("       jc has_overflow_int_32\n")
+        compiled_program.write("       no_overflow_int_32:\n")
+        compiled_program.write("       push rcx\n")
+        compiled_program.write("       ret\n")
+        compiled_program.write("       has_overflow_int_32:\n")
+        compiled_program.write("       push int_32_buffer_overflow_string\n")
+        compiled_program.write("       push int_32_buffer_overflow_string\n")
+        compiled_program.write("       call string_length\n")
+        compiled_program.write("       push int_32_buffer_overflow_string\n")
+        compiled_program.write("       call print_string\n")
+        compiled_program.write("       call flush_output\n")
+        compiled_program.write("       mov rax, 60\n")
+        compiled_program.write("       mov rdi, 32 \n")
+        compiled_program.write("       syscall\n")
 
     def create_check_int_64_overflow_function(self):
-        with open(self.output_path, 'a') as compiled_program:
-            compiled_program.write("section .text\n")
-            compiled_program.write("   check_int_64_overflow:\n")
-            compiled_program.write("       pop rcx ;; Get return address\n")
-            compiled_program.write("       pop rdx ;; Get value to add\n")
-            compiled_program.write("       pop rbx ;; Get current value of variable\n")
-            compiled_program.write("       add rbx, rdx\n")
-            compiled_program.write("       jnc no_overflow_int_64\n")
-            compiled_program.write("       jc has_overflow_int_64\n")
-            compiled_program.write("       no_overflow_int_64:\n")
-            compiled_program.write("       push rcx\n")
-            compiled_program.write("       ret\n")
-            compiled_program.write("       has_overflow_int_64:\n")
-            compiled_program.write("       push int_64_buffer_overflow_string\n")
-            compiled_program.write("       push int_64_buffer_overflow_string\n")
-            compiled_program.write("       call string_length\n")
-            compiled_program.write("       push int_64_buffer_overflow_string\n")
-            compiled_program.write("       call print_string\n")
-            compiled_program.write("       mov rax, 60\n")
-            compiled_program.write("       mov rdi, 64 \n")
-            compiled_program.write("       syscall\n")
+        compiled_program = self.compiled_program
+        compiled_program.write("section .text\n")
+        compiled_program.write("   check_int_64_overflow:\n")
+        compiled_program.write("       pop rcx ;; Get return address\n")
+        compiled_program.write("       pop rdx ;; Get value to add\n")
+        compiled_program.write("       pop rbx ;; Get current value of variable\n")
+        compiled_program.write("       add rbx, rdx\n")
+        compiled_program.write("       jnc no_overflow_int_64\n")
+        compiled_program.write("       jc has_overflow_int_64\n")
+        compiled_program.write("       no_overflow_int_64:\n")
+        compiled_program.write("       push rcx\n")
+        compiled_program.write("       ret\n")
+        compiled_program.write("       has_overflow_int_64:\n")
+        compiled_program.write("       push int_64_buffer_overflow_string\n")
+        compiled_program.write("       push int_64_buffer_overflow_string\n")
+        compiled_program.write("       call string_length\n")
+        compiled_program.write("       push int_64_buffer_overflow_string\n")
+        compiled_program.write("       call print_string\n")
+        compiled_program.write("       call flush_output\n")
+        compiled_program.write("       mov rax, 60\n")
+        compiled_program.write("       mov rdi, 64 \n")
+        compiled_program.write("       syscall\n")
+
+    def create_int_overflow_handler(self, bits):
+        # Inline overflow checks jump here so there's no return address to
+        # clean up, just print the error and exit with the width of the int.
+        compiled_program = self.compiled_program
+        compiled_program.write("section .text\n")
+        compiled_program.write(f"   int_{bits}_overflow:\n")
+        compiled_program.write(f"       push int_{bits}_buffer_overflow_string\n")
+        compiled_program.write(f"       push int_{bits}_buffer_overflow_string\n")
+        compiled_program.write("       call string_length\n")
+        compiled_program.write(f"       push int_{bits}_buffer_overflow_string\n")
+        compiled_program.write("       call print_string\n")
+        compiled_program.write("       call flush_output\n")
+        compiled_program.write("       mov rax, 60\n")
+        compiled_program.write(f"       mov rdi, {bits}\n")
+        compiled_program.write("       syscall\n")
 
     def create_char_at_function(self):
-        with open(self.output_path, 'a') as compiled_program:
-            compiled_program.write("section .text\n")
-            compiled_program.write("    char_at:\n")
-            compiled_program.write("        ;; charAt function\n")
-            compiled_program.write("        ;; Save return address\n")
-            compiled_program.write("        pop rcx\n")
-            compiled_program.write("        ;; Get char index\n")
-            compiled_program.write("        pop rbx\n")
-            compiled_program.write("        ;; Get string value\n")
-            compiled_program.write("        pop rax\n")
-            compiled_program.write("        ;; Get byte of string at index\n")
-            compiled_program.write("        mov dl, [rax + rbx]\n")
-            compiled_program.write("        ;; Push byte back onto stack\n")
-            compiled_program.write("        push dx\n")
-            compiled_program.write("        ;; Push return address onto stack\n")
-            compiled_program.write("        push rcx\n")
-            compiled_program.write("        ret\n")
+        compiled_program = self.compiled_program
+        compiled_program.write("section .text\n")
+        compiled_program.write("    char_at:\n")
+        compiled_program.write("        ;; charAt function\n")
+        compiled_program.write("        ;; Save return address\n")
+        compiled_program.write("        pop rcx\n")
+        compiled_program.write("        ;; Get char index\n")
+        compiled_program.write("        pop rbx\n")
+        compiled_program.write("        ;; Get string value\n")
+        compiled_program.write("        pop rax\n")
+        compiled_program.write("        ;; Get byte of string at index\n")
+        compiled_program.write("        mov dl, [rax + rbx]\n")
+        compiled_program.write("        ;; Push byte back onto stack\n")
+        compiled_program.write("        push dx\n")
+        compiled_program.write("        ;; Push return address onto stack\n")
+        compiled_program.write("        push rcx\n")
+        compiled_program.write("        ret\n")
 
     def create_update_char_function(self):
-        with open(self.output_path, 'a') as compiled_program:
-            compiled_program.write("section .text\n")
-            compiled_program.write("    update_char:\n")
-            compiled_program.write("        ;; updateChar function\n")
-            compiled_program.write("        ;; Save return address\n")
-            compiled_program.write("        pop rcx\n")
-            compiled_program.write("        ;; Get the new char\n")
-            compiled_program.write("        pop dx\n")
-            compiled_program.write("        ;; Get the index to replace\n")
-            compiled_program.write("        pop rbx\n")
-            compiled_program.write("        ;; Load up string\n")
-            compiled_program.write("        pop rax\n")
-            compiled_program.write("        ;; Move to rdi to replace\n")
-            compiled_program.write("        mov rdi, rax\n")
-            compiled_program.write("        ;; Update with the char\n")
-            compiled_program.write("        mov byte [rdi+rbx], dl\n")
-            compiled_program.write("        ;; Push return address onto stack\n")
-            compiled_program.write("        push rcx\n")
-            compiled_program.write("        ret\n")
+        compiled_program = self.compiled_program
+        compiled_program.write("section .text\n")
+        compiled_program.write("    update_char:\n")
+        compiled_program.write("        ;; updateChar function\n")
+        compiled_program.write("        ;; Save return address\n")
+        compiled_program.write("        pop rcx\n")
+        compiled_program.write("        ;; Get the new char\n")
+        compiled_program.write("        pop dx\n")
+        compiled_program.write("        ;; Get the index to replace\n")
+        compiled_program.write("        pop rbx\n")
+        compiled_program.write("        ;; Load up string\n")
+        compiled_program.write("        pop rax\n")
+        compiled_program.write("        ;; Move to rdi to replace\n")
+        compiled_program.write("        mov rdi, rax\n")
+        compiled_program.write("        ;; Update with the char\n")
+        compiled_program.write("        mov byte [rdi+rbx], dl\n")
+        compiled_program.write("        ;; Push return address onto stack\n")
+        compiled_program.write("        push rcx\n")
+        compiled_program.write("        ret\n")
 
     def create_string_length(self):
-        with open(self.output_path, 'a') as compiled_program:
-            compiled_program.write("section .text\n")
-            compiled_program.write("    string_length:\n")
-            compiled_program.write("        ;; strLen function\n")
-            compiled_program.write("        ;; Save return address\n")
-            compiled_program.write("        pop rcx\n")
-            compiled_program.write("        ;; Get the first string reference\n")
-            compiled_program.write("        pop rbx\n")
-            compiled_program.write("        ;; Get the second string reference\n")
-            compiled_program.write("        pop rax\n")
-            compiled_program.write("        loop_str_len:\n")
-            compiled_program.write("            cmp byte[rax], 0\n")
-            compiled_program.write("            jne loop_again\n")
-            compiled_program.write("            je end_str_len\n")
-            compiled_program.write("        loop_again:\n")
-            compiled_program.write("            inc rax\n")
-            compiled_program.write("            jmp loop_str_len\n")
-            compiled_program.write("        end_str_len:\n")
-            compiled_program.write("            ;; Calculate actual difference in length\n")
-            compiled_program.write("            sub rax, rbx\n")
-            compiled_program.write("            push rax\n")
-            compiled_program.write("            ;; Push return address onto stack\n")
-            compiled_program.write("        ;; Push return address onto stack\n")
-            compiled_program.write("        push rcx\n")
-            compiled_program.write("        ret\n")
-
-    def allocate_memory(self):
-        with open(self.output_path, 'a') as compiled_program:
-            compiled_program.write("section .text\n")
-            compiled_program.write("    allocate_memory:\n")
-            compiled_program.write("        ;; Save return address\n")
-            compiled_program.write("        pop rbx\n")
-            compiled_program.write("        ;; Get current break address\n")
-            compiled_program.write("        mov rdi, 0\n")
-            compiled_program.write("        mov rax, 12\n")
-            compiled_program.write("        syscall\n")
-            compiled_program.write("        ;; Move the current break to rdi\n")
-            compiled_program.write("        mov rdi, rax\n")
-            compiled_program.write("        ;; Get the number of bytes to allocate\n")
-            compiled_program.write("        pop rcx\n")
-            compiled_program.write("        ;; Attempt to allocate the bytes\n")
-            compiled_program.write("        add rdi, rcx\n")
-            compiled_program.write("        mov rax, 12\n")
-            compiled_program.write("        syscall\n")
-            compiled_program.write("        ;; Set memory address to variable\n")
-            compiled_program.write("        pop rcx\n")
-            compiled_program.write("        mov qword [rcx], rax\n")
-            compiled_program.write("        ;; Push return address onto stack\n")
-            compiled_program.write("        push rbx\n")
-            compiled_program.write("        ret\n")
+        compiled_program = self.compiled_program
+        compiled_program.write("section .text\n")
+        compiled_program.write("    string_length:\n")
+        compiled_program.write("        ;; strLen function\n")
+        compiled_program.write("        ;; Save return address\n")
+        compiled_program.write("        pop rcx\n")
+        compiled_program.write("        ;; Get the first string reference\n")
+        compiled_program.write("        pop rbx\n")
+        compiled_program.write("        ;; Get the second string reference\n")
+        compiled_program.write("        pop rax\n")
+        compiled_program.write("        loop_str_len:\n")
+        compiled_program.write("            cmp byte[rax], 0\n")
+        compiled_program.write("            jne loop_again\n")
+        compiled_program.write("            je end_str_len\n")
+        compiled_program.write("        loop_again:\n")
+        compiled_program.write("            inc rax\n")
+        compiled_program.write("            jmp loop_str_len\n")
+        compiled_program.write("        end_str_len:\n")
+        compiled_program.write("            ;; Calculate actual difference in length\n")
+        compiled_program.write("            sub rax, rbx\n")
+        compiled_program.write("            push rax\n")
+        compiled_program.write("            ;; Push return address onto stack\n")
+        compiled_program.write("        ;; Push return address onto stack\n")
+        compiled_program.write("        push rcx\n")
+        compiled_program.write("        ret\n")
+
+    def create_copy_string_function(self):
+        compiled_program = self.compiled_program
+        compiled_program.write("section .text\n")
+        compiled_program.write("    copy_string:\n")
+        compiled_program.write("        ;; Copy rcx bytes from rsi to rdi\n")
+        compiled_program.write("        rep movsb\n")
+        compiled_program.write("        ret\n")
+
+    def create_memory_arena(self):
+        compiled_program = self.compiled_program
+        compiled_program.write("section .bss\n")
+        compiled_program.write("    ;; Next free byte and end of the memory handed out by brk.\n")
+        compiled_program.write("    arena_next resq 1\n")
+        compiled_program.write("    arena_end resq 1\n")
+
+    def create_grow_memory_arena_function(self):
+        compiled_program = self.compiled_program
+        compiled_program.write("section .text\n")
+        compiled_program.write("    grow_memory_arena:\n")
+        compiled_program.write("        ;; Make room for rdi more bytes in the memory arena\n")
+        compiled_program.write("        push rdi\n")
+        compiled_program.write("        mov rax, [arena_end]\n")
+        compiled_program.write("        test rax, rax\n")
+        compiled_program.write("        jnz extend_grow_memory_arena\n")
+        compiled_program.write("        ;; Start the arena at the current break address\n")
+        compiled_program.write("        mov rdi, 0\n")
+        compiled_program.write("        mov rax, 12\n")
+        compiled_program.write("        syscall\n")
+        compiled_program.write("        mov [arena_next], rax\n")
+        compiled_program.write("        mov [arena_end], rax\n")
+        compiled_program.write("        extend_grow_memory_arena:\n")
+        compiled_program.write("        ;; Move the break past the bytes needed by a whole chunk\n")
+        compiled_program.write("        pop rdi\n")
+        compiled_program.write("        add rdi, [arena_next]\n")
+        compiled_program.write(f"        add rdi, {MEMORY_ARENA_CHUNK_SIZE}\n")
+        compiled_program.write("        mov rax, 12\n")
+        compiled_program.write("        syscall\n")
+        compiled_program.write("        mov [arena_end], rax\n")
+        compiled_program.write("        ret\n")
 
     def create_global_start(self):
-        with open(self.output_path, 'a') as compiled_program:
-            compiled_program.write("section .text\n")
-            compiled_program.write("    global _start\n")
+        compiled_program = self.compiled_program
+        compiled_program.write("section .text\n")
+        compiled_program.write("    global _start\n")
 
     def get_push_number_onto_stack_asm(self, num):
         return [
@@ -4992,10 +5791,8 @@ class Compiler:
         if STRING in val and is_const:
             if need_str_len:
                 return [
-                    "    ;; Calculate const string length and push onto stack with string\n",
-                    f"    push {val}\n",
-                    f"    push {val}\n",
-                    "    call string_length\n",
+                    "    ;; Push const string length and string onto stack\n",
+                    f"    push {self.variables[node_value]['var_len']}\n",
                     f"    push {val}\n"
                 ]
             else:
@@ -5006,11 +5803,10 @@ class Compiler:
         if STRING in val and not is_const:
             if need_str_len:
                 return [
-                    "    ;; Calculate variable string length and push onto stack with string\n",
-                    f"    push qword [{val}]\n",
-                    f"    push qword [{val}]\n",
-                    "    call string_length\n",
-                    f"    push qword [{val}]\n"
+                    "    ;; Push variable string length from in front of the string and string onto stack\n",
+                    f"    mov rax, qword [{val}]\n",
+                    "    push qword [rax-8]\n",
+                    "    push rax\n"
                 ]
             else:
                 return [
@@ -5067,6 +5863,32 @@ class Compiler:
     # TODO(map) Only the left side can be a variable right now. Write a test
     # for the right side that will fail for now.
     def get_add_asm(self, int_type=None):
+        if self.overflow_checks == "call":
+            return self.get_add_with_overflow_call_asm(int_type)
+        bits = INT_BIT_WIDTHS.get(int_type, 64)
+        handler = f"int_{bits}_overflow"
+        self.use_runtime_function(handler)
+        asm = ["    ;; Get the two values to add\n",
+                "    pop rax\n",
+                "    pop rbx\n",
+        ]
+        if bits == 64:
+            return asm + [
+                "    ;; Add and jump to the overflow handler if it carried\n",
+                "    add rax, rbx\n",
+                f"    jc {handler}\n",
+                "    push rax\n"]
+        check_reg, left_reg, right_reg = NARROW_OVERFLOW_REGISTERS[bits]
+        return asm + [
+                f"    ;; Add the low {bits} bits and jump to the overflow handler if it carried\n",
+                f"    mov {check_reg}, {left_reg}\n",
+                f"    add {check_reg}, {right_reg}\n",
+                f"    jc {handler}\n",
+                "    ;; Add\n",
+                "    add rax, rbx\n",
+                "    push rax\n"]
+
+    def get_add_with_overflow_call_asm(self, int_type=None):
         asm = ["    ;; Get the two values to add\n",
                 "    pop rax\n",
                 "    pop rbx\n",
@@ -5078,12 +5900,16 @@ class Compiler:
                 "    push rbx\n",
         ]
         if int_type == INT_8:
+            self.use_runtime_function("check_int_8_overflow")
             asm.append("    call check_int_8_overflow\n")
         elif int_type == INT_16:
+            self.use_runtime_function("check_int_16_overflow")
             asm.append("    call check_int_16_overflow\n")
         elif int_type == INT_32:
+            self.use_runtime_function("check_int_32_overflow")
             asm.append("    call check_int_32_overflow\n")
         elif int_type == INT_64 or not int_type:
+            self.use_runtime_function("check_int_64_overflow")
             asm.append("    call check_int_64_overflow\n")
         return asm + [
                 "    ;; Get the values back off the stack\n",
@@ -5121,37 +5947,44 @@ class Compiler:
                 "    push rax\n"]
 
     def get_div_asm(self):
+        # div divides rdx:rax so the top half has to be cleared first.
         return ["    ;; Divide\n",
                 "    pop rbx\n",
                 "    pop rax\n",
+                "    xor rdx, rdx\n",
                 "    div rbx\n",
                 "    push rax\n"]
 
     def get_print_string_keyword_asm(self):
+        self.use_runtime_function("print_string")
         return [
             "    ;; Keyword Func\n",
             "    call print_string\n"
         ]
 
     def get_printl_string_keyword_asm(self):
+        self.use_runtime_function("printl_string")
         return [
             "    ;; Keyword Func\n",
             "    call printl_string\n"
         ]
 
     def get_print_num_keyword_asm(self):
+        self.use_runtime_function("print_num")
         return [
             "    ;; Keyword Func\n",
             "    call print_num\n"
         ]
 
     def get_printl_num_keyword_asm(self):
+        self.use_runtime_function("printl_num")
         return [
             "    ;; Keyword Func\n",
             "    call printl_num\n"
         ]
 
     def get_print_char_keyword_asm(self):
+        self.use_runtime_function("print_char")
         return [
             "    ;; Keyword Func\n",
             "    call print_char\n",
@@ -5160,6 +5993,7 @@ class Compiler:
         ]
 
     def get_printl_char_keyword_asm(self):
+        self.use_runtime_function("printl_char")
         return [
             "    ;; Keyword Func\n",
             "    call printl_char\n",
@@ -5168,28 +6002,44 @@ class Compiler:
         ]
 
     def get_char_at_keyword_asm(self):
+        self.use_runtime_function("char_at")
         return [
             "    ;; Keyword Func\n",
             "    call char_at\n"
         ]
 
     def get_update_char_asm(self):
+        self.use_runtime_function("update_char")
         return [
             "    ;; Keyword Func\n",
             "    call update_char\n"
         ]
 
-    def get_copy_str_asm(self, var_len):
+    def get_copy_str_asm(self, src_len, dest_len, src_is_const=False):
+        self.use_runtime_function("copy_string")
+        # A shorter string is copied along with its null terminator, a longer
+        # one is cut off at the end of the string it's copied to.
+        copy_len = src_len + 1 if src_len < dest_len else dest_len
         asm = [
-            "    pop rax\n",
-            "    pop rbx\n",
+            "    ;; Copy string\n",
+            "    pop rdi\n",
+            "    pop rsi\n",
         ]
-        for i in range(var_len):
+        if src_is_const:
+            asm.append(f"    mov qword [rdi-8], {min(src_len, dest_len)}\n")
+        else:
             asm.extend([
-                f"    mov byte cl, [rbx+{i}]\n",
-                f"    mov byte [rax+{i}], cl\n"
+                "    ;; Update the length in front of the string copied to\n",
+                "    mov rax, [rsi-8]\n",
+                f"    mov rcx, {dest_len}\n",
+                "    cmp rax, rcx\n",
+                "    cmova rax, rcx\n",
+                "    mov [rdi-8], rax\n",
             ])
-        return asm
+        return asm + [
+            f"    mov rcx, {copy_len}\n",
+            "    call copy_string\n",
+        ]
 
     def get_push_loop_start_val_asm(self, loop_start):
         return [
@@ -5203,43 +6053,57 @@ class Compiler:
             f"    push {loop_end}\n"
         ]
 
+    def get_loop_index_operands(self, loop_level, loop_count):
+        """
+        Get where the index and end of a loop are kept, either the registers
+        given to it or its slots in the .loop_indices memory.
+        """
+        if loop_count in self.loop_registers:
+            return self.loop_registers[loop_count]
+        return f"qword [loop_idx_{loop_level}]", f"qword [loop_end_{loop_level}]"
+
     def get_push_loop_up_indices_with_var_asm(self, var_ref, loop_level, loop_count):
+        loop_idx, loop_end = self.get_loop_index_operands(loop_level, loop_count)
         return [
             "    ;; Push loop start and end on stack\n",
-            f"    mov qword [loop_idx_{loop_level}], 0\n",
+            f"    mov {loop_idx}, 0\n",
             f"    mov rax, [{self.variables[var_ref]['var_name']}]\n",
-            f"    mov qword [loop_end_{loop_level}], rax\n",
+            f"    mov {loop_end}, rax\n",
         ]
 
     def get_push_loop_down_indices_with_var_asm(self, var_ref, loop_level, loop_count):
+        loop_idx, loop_end = self.get_loop_index_operands(loop_level, loop_count)
         return [
             "    ;; Push loop start and end on stack\n",
             f"    mov rax, [{self.variables[var_ref]['var_name']}]\n",
-            f"    mov qword [loop_idx_{loop_level}], rax\n",
-            f"    mov qword [loop_end_{loop_level}], 0\n",
+            f"    mov {loop_idx}, rax\n",
+            f"    mov {loop_end}, 0\n",
         ]
 
-    def get_push_loop_from_indices_with_var_first_param_asm(self, var_ref, loop_end, loop_level, loop_count):
+    def get_push_loop_from_indices_with_var_first_param_asm(self, var_ref, loop_end_val, loop_level, loop_count):
+        loop_idx, loop_end = self.get_loop_index_operands(loop_level, loop_count)
         return [
             "    ;; Push loop start and end on stack\n",
             f"    mov rax, [{self.variables[var_ref]['var_name']}]\n",
-            f"    mov qword [loop_idx_{loop_level}], rax\n",
-            f"    mov qword [loop_end_{loop_level}], {loop_end}\n",
+            f"    mov {loop_idx}, rax\n",
+            f"    mov {loop_end}, {loop_end_val}\n",
         ]
 
     def get_push_loop_from_indices_with_var_second_param_asm(self, loop_start, var_ref, loop_level, loop_count):
+        loop_idx, loop_end = self.get_loop_index_operands(loop_level, loop_count)
         return [
             "    ;; Push loop start and end on stack\n",
-            f"    mov qword [loop_idx_{loop_level}], {loop_start}\n",
+            f"    mov {loop_idx}, {loop_start}\n",
             f"    mov rax, [{self.variables[var_ref]['var_name']}]\n",
-            f"    mov qword [loop_end_{loop_level}], rax\n",
+            f"    mov {loop_end}, rax\n",
         ]
 
-    def get_push_loop_indices_asm(self, loop_start, loop_end, loop_level, loop_count):
+    def get_push_loop_indices_asm(self, loop_start, loop_end_val, loop_level, loop_count):
+        loop_idx, loop_end = self.get_loop_index_operands(loop_level, loop_count)
         return [
             "    ;; Push loop start and end on stack\n",
-            f"    mov qword [loop_idx_{loop_level}], {loop_start}\n",
-            f"    mov qword [loop_end_{loop_level}], {loop_end}\n",
+            f"    mov {loop_idx}, {loop_start}\n",
+            f"    mov {loop_end}, {loop_end_val}\n",
         ]
 
     def get_loop_up_asm_start(self, loop_level, loop_count):
@@ -5254,7 +6118,18 @@ class Compiler:
             f"    loop_{loop_count}:\n",
         ]
 
+    def get_register_loop_asm_end(self, step, jump, loop_count):
+        loop_idx, loop_end = self.loop_registers[loop_count]
+        return [
+            "    ;; Compare if counter has reached the loop end\n",
+            f"    {step} {loop_idx}\n",
+            f"    cmp {loop_idx}, {loop_end}\n",
+            f"    {jump} loop_{loop_count}\n",
+        ]
+
     def get_loop_up_asm_end(self, loop_level, loop_count):
+        if loop_count in self.loop_registers:
+            return self.get_register_loop_asm_end("inc", "jl", loop_count)
         return [
             "    ;; Compare if counter is below loop end\n",
             f"    mov rcx, [loop_idx_{loop_level}]\n",
@@ -5267,6 +6142,8 @@ class Compiler:
         ]
 
     def get_loop_up_inclusive_asm_end(self, loop_level, loop_count):
+        if loop_count in self.loop_registers:
+            return self.get_register_loop_asm_end("inc", "jle", loop_count)
         return [
             "    ;; Compare if counter is below loop end\n",
             f"    mov rcx, [loop_idx_{loop_level}]\n",
@@ -5280,6 +6157,8 @@ class Compiler:
 
 
     def get_loop_down_asm_end(self, loop_level, loop_count):
+        if loop_count in self.loop_registers:
+            return self.get_register_loop_asm_end("dec", "jg", loop_count)
         return [
             "    ;; Compare if counter is above loop end\n",
             f"    mov rcx, [loop_idx_{loop_level}]\n",
@@ -5292,6 +6171,8 @@ class Compiler:
         ]
 
     def get_loop_down_inclusive_asm_end(self, loop_level, loop_count):
+        if loop_count in self.loop_registers:
+            return self.get_register_loop_asm_end("dec", "jge", loop_count)
         return [
             "    ;; Compare if counter is above loop end\n",
             f"    mov rcx, [loop_idx_{loop_level}]\n",
@@ -5334,6 +6215,11 @@ class Compiler:
         ]
 
     def get_push_current_loop_idx_onto_stack(self, loop_level, loop_count):
+        if loop_count in self.loop_registers:
+            return [
+                f"    ;; Push loop idx {loop_level} onto stack\n",
+                f"    push {self.loop_registers[loop_count][0]}\n",
+            ]
         return [
             f"    ;; Push loop idx {loop_level} onto stack\n",
             f"    mov rax, [loop_idx_{loop_level}]\n",
@@ -5538,11 +6424,27 @@ class Compiler:
         ] + var_decl
 
     def get_initialize_var_asm(self, var_name, var_len, var_val):
+        self.use_runtime_function("grow_memory_arena")
+        self.allocation_count += 1
+        # The length of the string is kept in the 8 bytes in front of it so
+        # printing doesn't have to look for the end of the string.
+        alloc_len = var_len + 9
         asm = [
-           f"    push {var_name}\n",
-           f"    push {var_len+1}\n",
-           "    call allocate_memory\n",
-           f"    mov rax, qword [{var_name}]\n",
+           f"    ;; Allocate {alloc_len} bytes from the memory arena\n",
+           "    mov rax, [arena_next]\n",
+           f"    add rax, {alloc_len}\n",
+           "    cmp rax, [arena_end]\n",
+           f"    jbe arena_allocated_{self.allocation_count}\n",
+           f"    mov rdi, {alloc_len}\n",
+           "    call grow_memory_arena\n",
+           f"    arena_allocated_{self.allocation_count}:\n",
+           "    mov rax, [arena_next]\n",
+           f"    lea rcx, [rax+{alloc_len}]\n",
+           "    mov [arena_next], rcx\n",
+           "    ;; Store the length in front of the string\n",
+           f"    mov qword [rax], {var_len}\n",
+           "    add rax, 8\n",
+           f"    mov qword [{var_name}], rax\n",
         ]
         for idx, char in enumerate(var_val):
             asm.append(f"    mov byte [rax+{idx}], '{char}'\n")
@@ -5627,17 +6529,1054 @@ class Compiler:
         ]
 
     def create_assembly_for_exit(self):
-        with open(self.output_path, 'a') as compiled_program:
-            compiled_program.write("    ;; Exit\n")
-            compiled_program.write("    mov rax, 60\n")
-            compiled_program.write("    mov rdi, 0\n")
-            compiled_program.write("    syscall\n")
+        compiled_program = self.compiled_program
+        if "flush_output" in self.used_runtime_functions:
+            compiled_program.write("    ;; Write out anything left in the output buffer\n")
+            compiled_program.write("    call flush_output\n")
+        compiled_program.write("    ;; Exit\n")
+        compiled_program.write("    mov rax, 60\n")
+        compiled_program.write("    mov rdi, 0\n")
+        compiled_program.write("    syscall\n")
+
 
+###########
+# Optimizer
+###########
+# General purpose 64 bit registers along with the names of their smaller
+# parts. The stack pointer is left out on purpose since anything touching it
+# is never moved around.
+REGISTER_PARTS = {
+    "rax": {"rax", "eax", "ax", "ah", "al"},
+    "rbx": {"rbx", "ebx", "bx", "bh", "bl"},
+    "rcx": {"rcx", "ecx", "cx", "ch", "cl"},
+    "rdx": {"rdx", "edx", "dx", "dh", "dl"},
+    "rsi": {"rsi", "esi", "si", "sil"},
+    "rdi": {"rdi", "edi", "di", "dil"},
+    "rbp": {"rbp", "ebp", "bp", "bpl"},
+    **{f"r{num}": {f"r{num}", f"r{num}d", f"r{num}w", f"r{num}b"} for num in range(8, 16)},
+}
+SMALL_REGISTER_PARTS = set().union(*REGISTER_PARTS.values()) - set(REGISTER_PARTS)
+# The 16 bit parts which can also be pushed and popped, mapped to their full register.
+WORD_REGISTERS = {
+    "ax": "rax", "bx": "rbx", "cx": "rcx", "dx": "rdx", "si": "rsi", "di": "rdi", "bp": "rbp",
+    **{f"r{num}w": f"r{num}" for num in range(8, 16)},
+}
+STACK_POINTER_PARTS = {"rsp", "esp", "sp", "spl"}
+ALL_REGISTER_PARTS = set().union(*REGISTER_PARTS.values(), STACK_POINTER_PARTS)
+# Conditional and unconditional jumps that only ever go to the label they name.
+JUMP_INSTRUCTIONS = frozenset((
+    "jmp", "je", "jne", "jz", "jnz", "jl", "jle", "jg", "jge", "ja", "jae", "jb", "jbe", "jc", "jnc",
+))
+ASM_DATA_DIRECTIVES = frozenset(("db", "dw", "dd", "dq", "equ", "resb", "resw", "resd", "resq"))
+ASM_WORD_RE = re.compile(r"\w+")
+PLAIN_MEMORY_RE = re.compile(r"^(?:qword )?\[(\w+)\]$")
+
+
+def parse_asm_line(line):
+    """
+    Split a line of assembly into its instruction and operands. Returns None
+    for comments and blank lines which can be skipped over, and an empty
+    instruction for labels and directives which can't.
+    """
+    code = line.strip()
+    if not code or code.startswith(";"):
+        return None
+    words = code.split(None, 2)
+    if code.endswith(":") or words[0] in ("section", "global") or (len(words) > 1 and words[1] in ASM_DATA_DIRECTIVES):
+        return ("", [])
+    # Data directives can hold strings with a `;` in them so comments are
+    # only split off of instructions.
+    instruction, _, operands = code.split(";", 1)[0].strip().partition(" ")
+    return (instruction, [operand.strip() for operand in operands.split(",")] if operands else [])
 
-def run_program():
-    os.system("nasm -f elf64 out.asm")
-    os.system("ld -o out out.o")
-    os.system("./out")
+
+def asm_uses_any(operands, names):
+    return any(word in names for operand in operands for word in ASM_WORD_RE.findall(operand))
+
+
+def find_next_asm_line(parsed_lines, idx):
+    """
+    Get the index of the next line after `idx` that isn't a comment.
+    """
+    idx += 1
+    while idx < len(parsed_lines) and parsed_lines[idx] is None:
+        idx += 1
+    return idx
+
+
+def remove_push_pop_pairs(asm, parsed_lines):
+    """
+    Turn a push followed by a pop into a single mov, or drop both when they
+    are the same register. Only movs that don't touch the popped register or
+    the stack can be in between since the value is now set at the push.
+    """
+    changed = False
+    for idx, parsed in enumerate(parsed_lines):
+        if not parsed or parsed[0] != "push" or len(parsed[1]) != 1:
+            continue
+        value = parsed[1][0]
+        # Only full 64 bit values or 16 bit registers can move from a push to
+        # a mov as is.
+        if asm_uses_any([value], STACK_POINTER_PARTS) or (value in SMALL_REGISTER_PARTS and value not in WORD_REGISTERS) or not (value.startswith("qword [") or ASM_WORD_RE.fullmatch(value)):
+            continue
+        pop_idx = find_next_asm_line(parsed_lines, idx)
+        while pop_idx < len(parsed_lines):
+            instruction, operands = parsed_lines[pop_idx]
+            if instruction == "pop":
+                break
+            if instruction != "mov" or asm_uses_any(operands, STACK_POINTER_PARTS):
+                pop_idx = len(parsed_lines)
+                break
+            pop_idx = find_next_asm_line(parsed_lines, pop_idx)
+        if pop_idx >= len(parsed_lines):
+            continue
+        register = parsed_lines[pop_idx][1][0]
+        # Both sides of the mov have to be the same size.
+        if (register in WORD_REGISTERS) != (value in WORD_REGISTERS) or register not in REGISTER_PARTS.keys() | WORD_REGISTERS.keys():
+            continue
+        between = [parsed_lines[between_idx][1] for between_idx in range(idx + 1, pop_idx) if parsed_lines[between_idx]]
+        if any(asm_uses_any(operands, REGISTER_PARTS[WORD_REGISTERS.get(register, register)]) for operands in between):
+            continue
+        indent = asm[idx][:len(asm[idx]) - len(asm[idx].lstrip())]
+        if value == register:
+            asm[idx] = None
+            parsed_lines[idx] = None
+        else:
+            asm[idx] = f"{indent}mov {register}, {value}\n"
+            parsed_lines[idx] = ("mov", [register, value])
+        asm[pop_idx] = None
+        parsed_lines[pop_idx] = None
+        changed = True
+    return changed
+
+
+def remove_redundant_stores(asm, parsed_lines):
+    """
+    Drop a store of a register back into the memory it was loaded from when
+    nothing in between could have changed either of them. Only memory named
+    by a label is looked at since the address in a register can change and
+    a store through one could be to any memory.
+    """
+    changed = False
+    for idx, parsed in enumerate(parsed_lines):
+        if not parsed or parsed[0] != "mov" or len(parsed[1]) != 2:
+            continue
+        memory_match = PLAIN_MEMORY_RE.match(parsed[1][0])
+        register = parsed[1][1]
+        if not memory_match or memory_match.group(1) in ALL_REGISTER_PARTS or register not in REGISTER_PARTS:
+            continue
+        memory = memory_match.group(1)
+        load_idx = idx - 1
+        while load_idx >= 0:
+            prev = parsed_lines[load_idx]
+            if prev is None:
+                load_idx -= 1
+                continue
+            instruction, operands = prev
+            if instruction == "mov" and operands[0] == register and PLAIN_MEMORY_RE.match(operands[1]) and PLAIN_MEMORY_RE.match(operands[1]).group(1) == memory:
+                break
+            # Anything that could write to the register or the memory stops
+            # the search.
+            if instruction in ("cmp", "test"):
+                safe = True
+            elif instruction in ("mov", "add", "sub", "inc", "dec") and operands:
+                destination_memory = PLAIN_MEMORY_RE.match(operands[0])
+                if destination_memory:
+                    safe = destination_memory.group(1) not in ALL_REGISTER_PARTS and destination_memory.group(1) != memory
+                else:
+                    safe = operands[0] in REGISTER_PARTS and operands[0] != register
+            else:
+                safe = False
+            if not safe:
+                load_idx = -1
+                break
+            load_idx -= 1
+        if load_idx >= 0:
+            asm[idx] = None
+            parsed_lines[idx] = None
+            changed = True
+    return changed
+
+
+def remove_jumps_to_next_line(asm, parsed_lines):
+    """
+    Drop jumps to a label that comes right after them since the code falls
+    through to it either way.
+    """
+    changed = False
+    for idx, parsed in enumerate(parsed_lines):
+        if not parsed or parsed[0] not in JUMP_INSTRUCTIONS or len(parsed[1]) != 1:
+            continue
+        next_idx = find_next_asm_line(parsed_lines, idx)
+        if next_idx < len(asm) and asm[next_idx].strip() == f"{parsed[1][0]}:":
+            asm[idx] = None
+            parsed_lines[idx] = None
+            changed = True
+    return changed
+
+
+def optimize_assembly(asm):
+    """
+    Run peephole optimizations over the lines of assembly until none of them
+    make any more changes. Returns the new lines of assembly.
+    """
+    asm = list(asm)
+    changed = True
+    while changed:
+        parsed_lines = [parse_asm_line(line) for line in asm]
+        changed = False
+        for optimization in (remove_push_pop_pairs, remove_redundant_stores, remove_jumps_to_next_line):
+            if optimization(asm, parsed_lines):
+                changed = True
+        asm = [line for line in asm if line is not None]
+    return asm
+
+
+#############
+# ELF Backend
+#############
+# Instead of handing the assembly to nasm and ld, the ELF backend encodes the
+# instructions the compiler writes into machine code itself and lays them out
+# in a static executable. It only understands the part of nasm's syntax the
+# compiler uses.
+ELF_BASE_ADDRESS = 0x400000
+ELF_PAGE_SIZE = 0x1000
+ELF_HEADER_SIZE = 64
+ELF_PROGRAM_HEADER_SIZE = 56
+ELF_SECTION_ALIGNMENT = 16
+# Code and read only data go in one segment and writable data and .bss in the
+# other, along with the header that marks the stack as not executable.
+ELF_PROGRAM_HEADER_COUNT = 3
+PT_LOAD = 1
+PT_GNU_STACK = 0x6474e551
+SEGMENT_EXECUTE = 1
+SEGMENT_WRITE = 2
+SEGMENT_READ = 4
+
+AsmRegister = collections.namedtuple("AsmRegister", ["name", "number", "size"])
+AsmMemory = collections.namedtuple("AsmMemory", ["base", "index", "scale", "displacement", "symbol", "size"])
+# Immediates that name a label or constant keep the name in `symbol` and the
+# value is added to it once it's known.
+AsmImmediate = collections.namedtuple("AsmImmediate", ["value", "symbol"])
+
+ASM_REGISTER_NAMES = (
+    ("rax", "eax", "ax", "al"), ("rcx", "ecx", "cx", "cl"), ("rdx", "edx", "dx", "dl"), ("rbx", "ebx", "bx", "bl"),
+    ("rsp", "esp", "sp", "spl"), ("rbp", "ebp", "bp", "bpl"), ("rsi", "esi", "si", "sil"), ("rdi", "edi", "di", "dil"),
+    *((f"r{num}", f"r{num}d", f"r{num}w", f"r{num}b") for num in range(8, 16)),
+)
+ASM_REGISTERS = {
+    name: AsmRegister(name, number, size)
+    for number, names in enumerate(ASM_REGISTER_NAMES)
+    for name, size in zip(names, (8, 4, 2, 1))
+}
+# The high bytes share their numbers with spl, bpl, sil and dil, which can
+# only be told apart by whether the instruction has a REX prefix.
+HIGH_BYTE_REGISTERS = frozenset(("ah", "ch", "dh", "bh"))
+REX_BYTE_REGISTERS = frozenset(("spl", "bpl", "sil", "dil"))
+ASM_REGISTERS.update({name: AsmRegister(name, number, 1) for number, name in enumerate(("ah", "ch", "dh", "bh"), 4)})
+ASM_OPERAND_SIZES = {"byte": 1, "word": 2, "dword": 4, "qword": 8}
+ASM_SIZED_OPERAND_RE = re.compile(r"^(byte|word|dword|qword)(?:\s+|(?=\[))(.*)$")
+ASM_NUMBER_RE = re.compile(r"^-?(?:0x[0-9a-fA-F]+|\d+)$")
+ASM_SYMBOL_RE = re.compile(r"^[A-Za-z_][\w.]*$")
+ASM_MEMORY_TERM_RE = re.compile(r"([+-]?)\s*([^+-]+)")
+ASM_QUOTES = "'\"`"
+ASM_DATA_SIZES = {"db": 1, "dw": 2, "dd": 4, "dq": 8}
+ASM_RESERVE_SIZES = {"resb": 1, "resw": 2, "resd": 4, "resq": 8}
+ASM_PREFIXES = {"rep": b"\xf3", "repe": b"\xf3", "repz": b"\xf3", "repne": b"\xf2", "repnz": b"\xf2"}
+# Instructions without any operands.
+FIXED_ENCODINGS = {
+    "ret": b"\xc3", "syscall": b"\x0f\x05", "nop": b"\x90", "leave": b"\xc9", "cqo": b"\x48\x99", "cdq": b"\x99",
+    "movsb": b"\xa4", "movsq": b"\x48\xa5", "stosb": b"\xaa", "stosq": b"\x48\xab", "lodsb": b"\xac",
+    "cmpsb": b"\xa6", "scasb": b"\xae",
+}
+# The ModRM extension of each arithmetic instruction, which is also its
+# opcode divided by 8 for the register forms.
+ALU_EXTENSIONS = {"add": 0, "or": 1, "adc": 2, "sbb": 3, "and": 4, "sub": 5, "xor": 6, "cmp": 7}
+UNARY_EXTENSIONS = {"not": 2, "neg": 3, "mul": 4, "imul": 5, "div": 6, "idiv": 7}
+SHIFT_EXTENSIONS = {"rol": 0, "ror": 1, "shl": 4, "sal": 4, "shr": 5, "sar": 7}
+CONDITION_CODES = {
+    "o": 0, "no": 1, "b": 2, "c": 2, "nae": 2, "ae": 3, "nb": 3, "nc": 3, "e": 4, "z": 4, "ne": 5, "nz": 5,
+    "be": 6, "na": 6, "a": 7, "nbe": 7, "s": 8, "ns": 9, "p": 10, "pe": 10, "np": 11, "po": 11,
+    "l": 12, "nge": 12, "ge": 13, "nl": 13, "le": 14, "ng": 14, "g": 15, "nle": 15,
+}
+
+
+def find_unquoted(text, character):
+    """
+    Get the index of the first `character` in `text` that isn't inside a
+    quoted string, or -1 if there isn't one.
+    """
+    # Most lines have no quotes at all so they don't need to be walked.
+    if character not in text or ("'" not in text and '"' not in text and "`" not in text):
+        return text.find(character)
+    quote = None
+    for idx, char in enumerate(text):
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in ASM_QUOTES:
+            quote = char
+        elif char == character:
+            return idx
+    return -1
+
+
+def strip_asm_comment(line):
+    comment_start = find_unquoted(line, ";")
+    return line if comment_start == -1 else line[:comment_start]
+
+
+def split_asm_operands(operands):
+    """
+    Split operands on commas, leaving alone any commas in quoted characters
+    or strings like `mov byte [rax], ','`.
+    """
+    split_operands = []
+    comma = find_unquoted(operands, ",")
+    while comma != -1:
+        split_operands.append(operands[:comma].strip())
+        operands = operands[comma + 1:]
+        comma = find_unquoted(operands, ",")
+    split_operands.append(operands.strip())
+    return split_operands
+
+
+def is_quoted(text):
+    return len(text) >= 2 and text[0] in ASM_QUOTES and text[-1] == text[0]
+
+
+def parse_asm_number(text):
+    """
+    Get the value of a number or a quoted character, nasm stores the
+    characters of longer quoted strings from the lowest byte up. Returns None
+    for anything else.
+    """
+    if is_quoted(text):
+        return int.from_bytes(text[1:-1].encode(), "little")
+    if ASM_NUMBER_RE.match(text):
+        return int(text, 16) if "x" in text else int(text)
+    return None
+
+
+def encode_asm_integer(value, size):
+    """
+    Get the little endian bytes of a value that has to fit in `size` bytes
+    either as a signed or an unsigned number.
+    """
+    bits = size * 8
+    if not -(1 << (bits - 1)) <= value < (1 << bits):
+        raise ValueError(f"{value} doesn't fit in {bits} bits")
+    return (value & ((1 << bits) - 1)).to_bytes(size, "little")
+
+
+def is_sign_extended_immediate(immediate):
+    """
+    Immediates for 64 bit operations are stored in 32 bits and sign extended,
+    so only the values that survive that can be used. Labels are always
+    somewhere in the first 2GB of memory.
+    """
+    return immediate.symbol is not None or -(1 << 31) <= immediate.value < (1 << 31)
+
+
+def parse_asm_memory(address, size):
+    base = None
+    index = None
+    scale = 1
+    displacement = 0
+    symbol = None
+    for sign, term in ASM_MEMORY_TERM_RE.findall(address):
+        term = term.strip()
+        register, _, multiplier = (part.strip() for part in term.partition("*"))
+        if register in ASM_REGISTERS:
+            if sign == "-":
+                raise ValueError("registers can't be subtracted in an address")
+            if ASM_REGISTERS[register].size != 8:
+                raise ValueError("addresses have to use 64 bit registers")
+            if multiplier or base is not None:
+                if index is not None:
+                    raise ValueError("an address can only use two registers")
+                index = ASM_REGISTERS[register]
+                scale = int(multiplier) if multiplier else 1
+            else:
+                base = ASM_REGISTERS[register]
+        elif parse_asm_number(term) is not None:
+            displacement += -parse_asm_number(term) if sign == "-" else parse_asm_number(term)
+        elif ASM_SYMBOL_RE.match(term) and symbol is None and sign != "-":
+            symbol = term
+        else:
+            raise ValueError(f"can't use '{term}' in an address")
+    if scale not in (1, 2, 4, 8) or (index is not None and index.name == "rsp"):
+        raise ValueError("invalid index in an address")
+    return AsmMemory(base, index, scale, displacement, symbol, size)
+
+
+def parse_asm_operand(operand):
+    size = None
+    sized_operand = ASM_SIZED_OPERAND_RE.match(operand)
+    if sized_operand:
+        size = ASM_OPERAND_SIZES[sized_operand.group(1)]
+        operand = sized_operand.group(2).strip()
+    if operand.startswith("[") and operand.endswith("]"):
+        return parse_asm_memory(operand[1:-1], size)
+    if operand in ASM_REGISTERS:
+        return ASM_REGISTERS[operand]
+    value = parse_asm_number(operand)
+    if value is not None:
+        return AsmImmediate(value, None)
+    if ASM_SYMBOL_RE.match(operand):
+        return AsmImmediate(0, operand)
+    raise ValueError(f"unknown operand '{operand}'")
+
+
+def get_operand_size(*operands):
+    """
+    Get the size in bytes of the registers and sized memory in the operands,
+    which all have to be the same.
+    """
+    sizes = {operand.size for operand in operands if not isinstance(operand, AsmImmediate) and operand.size}
+    if len(sizes) != 1:
+        raise ValueError("operand sizes don't match" if sizes else "operation size not specified")
+    return sizes.pop()
+
+
+def check_register_or_memory(operand):
+    if isinstance(operand, AsmImmediate):
+        raise ValueError("expected a register or memory")
+    return operand
+
+
+def get_section_kind(name, flags):
+    if name == ".bss" or "nobits" in flags:
+        return "bss"
+    if name == ".text" or "exec" in flags:
+        return "text"
+    if name == ".data" or "write" in flags:
+        return "data"
+    return "rodata"
+
+
+class ElfAssembler:
+    """
+    Encodes the assembly the compiler writes into a static x86-64 Linux
+    executable.
+    """
+
+    def __init__(self, asm):
+        self.asm = asm
+        # Section names to their bytes in the order they first show up. The
+        # .bss sections are only ever zeros that don't end up in the file.
+        self.sections = {}
+        self.section_kinds = {}
+        self.current_section = None
+        # Labels are an offset into their section until the sections are laid
+        # out, constants from `equ` have no section.
+        self.symbols = {}
+        # Places where the address of a symbol gets filled in once it's known.
+        self.fixups = []
+        self.entry_symbol = None
+        self.current_line = None
+        # Instructions don't depend on anything around them, so the bytes and
+        # fixups of each one are only worked out once no matter how many
+        # times it's repeated.
+        self.encoded_instructions = {}
+        self.instruction_code = bytearray()
+        self.instruction_fixups = []
+
+    def assemble(self):
+        """
+        Returns the bytes of the executable.
+        """
+        for line_num, line in enumerate(self.asm.splitlines()):
+            code = strip_asm_comment(line).strip()
+            if not code:
+                continue
+            self.current_line = (line_num, code)
+            try:
+                self.assemble_line(code)
+            except ValueError as err:
+                raise UnsupportedAssemblyError(line_num, code, err)
+        return self.link()
+
+    def assemble_line(self, code):
+        words = code.split(None, 2)
+        if code.endswith(":") and ASM_SYMBOL_RE.match(code[:-1]):
+            self.define_symbol(code[:-1], len(self.get_section()))
+        elif words[0] == "section":
+            self.switch_section(words[1], words[2:])
+        elif words[0] == "global":
+            self.entry_symbol = (self.current_line, words[1])
+        elif len(words) > 1 and words[1] == "equ":
+            self.symbols[words[0]] = (None, self.evaluate_constant(words[2] if len(words) > 2 else ""))
+        elif len(words) > 1 and (words[1] in ASM_DATA_SIZES or words[1] in ASM_RESERVE_SIZES):
+            self.define_symbol(words[0], len(self.get_section()))
+            self.assemble_data(words[1], words[2] if len(words) > 2 else "")
+        elif words[0] in ASM_DATA_SIZES or words[0] in ASM_RESERVE_SIZES:
+            self.assemble_data(words[0], code[len(words[0]):])
+        else:
+            self.assemble_instruction(code)
+
+    def get_section(self):
+        # nasm puts anything before the first section in .text.
+        if self.current_section is None:
+            self.switch_section(".text", [])
+        return self.sections[self.current_section]
+
+    def switch_section(self, name, flags):
+        self.current_section = name
+        if name not in self.sections:
+            self.sections[name] = bytearray()
+            self.section_kinds[name] = get_section_kind(name, " ".join(flags).split())
+
+    def define_symbol(self, name, offset):
+        if name in self.symbols:
+            raise ValueError(f"'{name}' is defined more than once")
+        self.symbols[name] = (self.current_section, offset)
+
+    def evaluate_constant(self, expression):
+        """
+        Work out constants that are either a number or the length of the data
+        since a label, like `len_1 equ $ - string_1`.
+        """
+        value = parse_asm_number(expression.strip())
+        if value is not None:
+            return value
+        here, _, label = (part.strip() for part in expression.partition("-"))
+        if here == "$" and label in self.symbols and self.symbols[label][0] == self.current_section:
+            return len(self.get_section()) - self.symbols[label][1]
+        raise ValueError(f"can't work out the value of '{expression.strip()}'")
+
+    def assemble_data(self, directive, operands):
+        if directive in ASM_RESERVE_SIZES:
+            count = parse_asm_number(operands.strip())
+            if count is None:
+                raise ValueError(f"can't reserve '{operands.strip()}' items")
+            self.get_section().extend(bytes(count * ASM_RESERVE_SIZES[directive]))
+            return
+        size = ASM_DATA_SIZES[directive]
+        data = bytearray()
+        fixups = []
+        for operand in split_asm_operands(operands):
+            if is_quoted(operand):
+                # Strings are padded out to a whole number of items.
+                string = operand[1:-1].encode()
+                data += string + bytes(-len(string) % size)
+            elif parse_asm_number(operand) is not None:
+                data += encode_asm_integer(parse_asm_number(operand), size)
+            elif ASM_SYMBOL_RE.match(operand):
+                fixups.append((len(data), size, operand, 0, False))
+                data += bytes(size)
+            else:
+                raise ValueError(f"can't store '{operand}'")
+        self.write(data, fixups)
+
+    def write(self, code, fixups=()):
+        section = self.get_section()
+        if self.section_kinds[self.current_section] == "bss":
+            raise ValueError("only space can be reserved in .bss")
+        for offset, size, symbol, addend, relative in fixups:
+            self.fixups.append((self.current_section, len(section) + offset, size, symbol, addend, relative, self.current_line))
+        section.extend(code)
+
+    def assemble_instruction(self, code):
+        if code not in self.encoded_instructions:
+            self.instruction_code = bytearray()
+            self.instruction_fixups = []
+            self.encode_instruction(code)
+            self.encoded_instructions[code] = (bytes(self.instruction_code), self.instruction_fixups)
+        self.write(*self.encoded_instructions[code])
+
+    def add_code(self, code, fixups=()):
+        for offset, *fixup in fixups:
+            self.instruction_fixups.append((len(self.instruction_code) + offset, *fixup))
+        self.instruction_code += code
+
+    def encode_instruction(self, code):
+        mnemonic, _, operands = code.partition(" ")
+        if mnemonic in ASM_PREFIXES:
+            self.add_code(ASM_PREFIXES[mnemonic])
+            mnemonic, _, operands = operands.strip().partition(" ")
+        operands = [parse_asm_operand(operand) for operand in split_asm_operands(operands)] if operands.strip() else []
+        if mnemonic in FIXED_ENCODINGS and not operands:
+            self.add_code(FIXED_ENCODINGS[mnemonic])
+        elif mnemonic in ALU_EXTENSIONS and len(operands) == 2:
+            self.encode_alu(ALU_EXTENSIONS[mnemonic], *operands)
+        elif mnemonic == "mov" and len(operands) == 2:
+            self.encode_mov(*operands)
+        elif mnemonic in ("movzx", "movsx") and len(operands) == 2:
+            self.encode_extend(mnemonic, *operands)
+        elif mnemonic == "lea" and len(operands) == 2 and isinstance(operands[0], AsmRegister) and isinstance(operands[1], AsmMemory):
+            self.emit(b"\x8d", operands[0].size, operands[0], operands[1])
+        elif mnemonic == "test" and len(operands) == 2:
+            self.encode_test(*operands)
+        elif mnemonic in ("inc", "dec") and len(operands) == 1:
+            size = get_operand_size(operands[0])
+            self.emit(b"\xfe" if size == 1 else b"\xff", size, int(mnemonic == "dec"), check_register_or_memory(operands[0]))
+        elif mnemonic in UNARY_EXTENSIONS and len(operands) == 1:
+            size = get_operand_size(operands[0])
+            self.emit(b"\xf6" if size == 1 else b"\xf7", size, UNARY_EXTENSIONS[mnemonic], check_register_or_memory(operands[0]))
+        elif mnemonic == "imul" and len(operands) == 2 and isinstance(operands[0], AsmRegister):
+            self.emit(b"\x0f\xaf", get_operand_size(*operands), operands[0], check_register_or_memory(operands[1]))
+        elif mnemonic in SHIFT_EXTENSIONS and len(operands) == 2:
+            self.encode_shift(SHIFT_EXTENSIONS[mnemonic], *operands)
+        elif mnemonic in ("push", "pop") and len(operands) == 1:
+            self.encode_push_pop(mnemonic, operands[0])
+        elif mnemonic in ("call", "jmp") and len(operands) == 1:
+            if isinstance(operands[0], AsmImmediate):
+                self.encode_relative_jump(b"\xe8" if mnemonic == "call" else b"\xe9", operands[0])
+            else:
+                self.emit(b"\xff", None, 2 if mnemonic == "call" else 4, check_register_or_memory(operands[0]))
+        elif mnemonic[:1] == "j" and mnemonic[1:] in CONDITION_CODES and len(operands) == 1:
+            self.encode_relative_jump(bytes((0x0f, 0x80 + CONDITION_CODES[mnemonic[1:]])), operands[0])
+        elif mnemonic[:4] == "cmov" and mnemonic[4:] in CONDITION_CODES and len(operands) == 2 and isinstance(operands[0], AsmRegister):
+            self.emit(bytes((0x0f, 0x40 + CONDITION_CODES[mnemonic[4:]])), get_operand_size(*operands), operands[0], check_register_or_memory(operands[1]))
+        elif mnemonic[:3] == "set" and mnemonic[3:] in CONDITION_CODES and len(operands) == 1 and get_operand_size(operands[0]) == 1:
+            self.emit(bytes((0x0f, 0x90 + CONDITION_CODES[mnemonic[3:]])), None, 0, check_register_or_memory(operands[0]))
+        else:
+            raise ValueError("unknown instruction or operands")
+
+    def emit(self, opcode, size=None, reg=0, rm=None, immediate=None, immediate_size=0, opcode_register=None):
+        """
+        Write one instruction. `reg` is the register or opcode extension in
+        the ModRM byte along with the register or memory in `rm`, while an
+        `opcode_register` is added to the last byte of the opcode instead of
+        using a ModRM byte. A `size` of 2 or 8 adds the prefix for 16 or 64
+        bit operands.
+        """
+        registers = [operand for operand in (reg, rm, opcode_register) if isinstance(operand, AsmRegister)]
+        if isinstance(rm, AsmMemory):
+            registers += [register for register in (rm.base, rm.index) if register is not None]
+        reg_number = reg.number if isinstance(reg, AsmRegister) else reg
+        rex = 0x08 if size == 8 else 0
+        if reg_number >= 8:
+            rex |= 0x04
+        if isinstance(rm, AsmMemory):
+            rex |= (0x02 if rm.index is not None and rm.index.number >= 8 else 0) | (0x01 if rm.base is not None and rm.base.number >= 8 else 0)
+        elif rm is not None and rm.number >= 8:
+            rex |= 0x01
+        if opcode_register is not None and opcode_register.number >= 8:
+            rex |= 0x01
+        if any(register.name in REX_BYTE_REGISTERS for register in registers):
+            rex |= 0x40
+        code = bytearray(b"\x66" if size == 2 else b"")
+        if rex:
+            if any(register.name in HIGH_BYTE_REGISTERS for register in registers):
+                raise ValueError("ah, bh, ch and dh can't be used along with registers that need a REX prefix")
+            code.append(0x40 | rex)
+        code += opcode
+        if opcode_register is not None:
+            code[-1] += opcode_register.number & 7
+        fixups = []
+        if rm is not None:
+            self.encode_modrm(code, fixups, reg_number & 7, rm)
+        if immediate is not None:
+            if immediate.symbol is not None:
+                fixups.append((len(code), immediate_size, immediate.symbol, immediate.value, False))
+                code += bytes(immediate_size)
+            else:
+                code += encode_asm_integer(immediate.value, immediate_size)
+        self.add_code(code, fixups)
+
+    def encode_modrm(self, code, fixups, reg_bits, rm):
+        if isinstance(rm, AsmRegister):
+            code.append(0xc0 | reg_bits << 3 | rm.number & 7)
+            return
+        scale_bits = (1, 2, 4, 8).index(rm.scale)
+        index_bits = rm.index.number & 7 if rm.index is not None else 4
+        if rm.base is None:
+            # A plain 32 bit address is relative to rip in 64 bit mode, so an
+            # absolute one goes through a SIB byte without a base.
+            mode = 2
+            code.append(reg_bits << 3 | 4)
+            code.append(scale_bits << 6 | index_bits << 3 | 5)
+        else:
+            if rm.symbol is not None or not -128 <= rm.displacement < 128:
+                mode = 2
+            elif rm.displacement == 0 and rm.base.number & 7 != 5:
+                mode = 0
+            else:
+                mode = 1
+            if rm.index is not None or rm.base.number & 7 == 4:
+                code.append(mode << 6 | reg_bits << 3 | 4)
+                code.append(scale_bits << 6 | index_bits << 3 | rm.base.number & 7)
+            else:
+                code.append(mode << 6 | reg_bits << 3 | rm.base.number & 7)
+        if mode == 1:
+            code += encode_asm_integer(rm.displacement, 1)
+        elif mode == 2 and rm.symbol is not None:
+            fixups.append((len(code), 4, rm.symbol, rm.displacement, False))
+            code += bytes(4)
+        elif mode == 2:
+            code += encode_asm_integer(rm.displacement, 4)
+
+    def encode_alu(self, extension, destination, source):
+        size = get_operand_size(destination, source)
+        check_register_or_memory(destination)
+        if isinstance(source, AsmImmediate):
+            if size == 1:
+                self.emit(b"\x80", size, extension, destination, source, 1)
+            elif source.symbol is None and -128 <= source.value < 128:
+                self.emit(b"\x83", size, extension, destination, source, 1)
+            elif size != 8 or is_sign_extended_immediate(source):
+                self.emit(b"\x81", size, extension, destination, source, min(size, 4))
+            else:
+                raise ValueError("immediate doesn't fit in 32 bits")
+        elif isinstance(source, AsmRegister):
+            self.emit(bytes((extension * 8 + (size != 1),)), size, source, destination)
+        elif isinstance(destination, AsmRegister):
+            self.emit(bytes((extension * 8 + 2 + (size != 1),)), size, destination, source)
+        else:
+            raise ValueError("can't use two memory operands")
+
+    def encode_mov(self, destination, source):
+        if isinstance(source, AsmImmediate) and isinstance(destination, AsmRegister):
+            if destination.size != 8:
+                self.emit(b"\xb0" if destination.size == 1 else b"\xb8", destination.size, immediate=source,
+                          immediate_size=destination.size, opcode_register=destination)
+            elif source.symbol is None and 0 <= source.value < (1 << 32):
+                # Writing the low 32 bits clears the rest of the register.
+                self.emit(b"\xb8", None, immediate=source, immediate_size=4, opcode_register=destination)
+            elif is_sign_extended_immediate(source):
+                self.emit(b"\xc7", 8, 0, destination, source, 4)
+            else:
+                self.emit(b"\xb8", 8, immediate=source, immediate_size=8, opcode_register=destination)
+        elif isinstance(source, AsmImmediate):
+            size = get_operand_size(check_register_or_memory(destination))
+            if size == 8 and not is_sign_extended_immediate(source):
+                raise ValueError("immediate doesn't fit in 32 bits")
+            self.emit(b"\xc6" if size == 1 else b"\xc7", size, 0, destination, source, min(size, 4))
+        elif isinstance(source, AsmRegister):
+            size = get_operand_size(destination, source)
+            self.emit(b"\x88" if size == 1 else b"\x89", size, source, check_register_or_memory(destination))
+        elif isinstance(destination, AsmRegister):
+            size = get_operand_size(destination, source)
+            self.emit(b"\x8a" if size == 1 else b"\x8b", size, destination, source)
+        else:
+            raise ValueError("can't use two memory operands")
+
+    def encode_extend(self, mnemonic, destination, source):
+        source_size = get_operand_size(check_register_or_memory(source))
+        if not isinstance(destination, AsmRegister) or source_size not in (1, 2) or destination.size <= source_size:
+            raise ValueError(f"invalid operands for {mnemonic}")
+        opcode = (0xb6 if mnemonic == "movzx" else 0xbe) + (source_size == 2)
+        self.emit(bytes((0x0f, opcode)), destination.size, destination, source)
+
+    def encode_test(self, destination, source):
+        size = get_operand_size(destination, source)
+        if isinstance(source, AsmImmediate):
+            if size == 8 and not is_sign_extended_immediate(source):
+                raise ValueError("immediate doesn't fit in 32 bits")
+            self.emit(b"\xf6" if size == 1 else b"\xf7", size, 0, check_register_or_memory(destination), source, min(size, 4))
+        elif isinstance(source, AsmRegister):
+            self.emit(b"\x84" if size == 1 else b"\x85", size, source, check_register_or_memory(destination))
+        elif isinstance(destination, AsmRegister):
+            self.emit(b"\x84" if size == 1 else b"\x85", size, destination, source)
+        else:
+            raise ValueError("can't use two memory operands")
+
+    def encode_shift(self, extension, destination, count):
+        size = get_operand_size(check_register_or_memory(destination))
+        if isinstance(count, AsmRegister) and count.name == "cl":
+            self.emit(b"\xd2" if size == 1 else b"\xd3", size, extension, destination)
+        elif isinstance(count, AsmImmediate) and count.symbol is None and count.value == 1:
+            self.emit(b"\xd0" if size == 1 else b"\xd1", size, extension, destination)
+        elif isinstance(count, AsmImmediate) and count.symbol is None:
+            self.emit(b"\xc0" if size == 1 else b"\xc1", size, extension, destination, count, 1)
+        else:
+            raise ValueError("shifts take a number or cl")
+
+    def encode_push_pop(self, mnemonic, operand):
+        if isinstance(operand, AsmImmediate):
+            if mnemonic == "pop":
+                raise ValueError("can't pop into an immediate")
+            if operand.symbol is None and -128 <= operand.value < 128:
+                self.emit(b"\x6a", immediate=operand, immediate_size=1)
+            elif is_sign_extended_immediate(operand):
+                self.emit(b"\x68", immediate=operand, immediate_size=4)
+            else:
+                raise ValueError("immediate doesn't fit in 32 bits")
+            return
+        # Pushes and pops are 64 bit unless they say otherwise.
+        size = operand.size or 8
+        if size not in (2, 8):
+            raise ValueError(f"can only {mnemonic} 16 or 64 bit values")
+        size = 2 if size == 2 else None
+        if isinstance(operand, AsmRegister):
+            self.emit(b"\x50" if mnemonic == "push" else b"\x58", size, opcode_register=operand)
+        else:
+            self.emit(b"\xff" if mnemonic == "push" else b"\x8f", size, 6 if mnemonic == "push" else 0, operand)
+
+    def encode_relative_jump(self, opcode, target):
+        if not isinstance(target, AsmImmediate) or target.symbol is None:
+            raise ValueError("jumps have to go to a label")
+        # Every jump gets a 32 bit offset so the size of an instruction never
+        # depends on where its label ends up.
+        self.add_code(opcode + bytes(4), [(len(opcode), 4, target.symbol, target.value, True)])
+
+    def get_symbol_address(self, symbol, addresses):
+        if symbol not in self.symbols:
+            raise ValueError(f"'{symbol}' is never defined")
+        section, value = self.symbols[symbol]
+        return value if section is None else addresses[section] + value
+
+    def link(self):
+        """
+        Lay the sections out with the code and read only data in a read and
+        execute segment and the writable data and .bss in a read and write
+        segment on the next page, fill in the addresses of the labels and
+        build the executable.
+        """
+        text_sections = [name for kind in ("text", "rodata") for name in self.sections if self.section_kinds[name] == kind]
+        data_sections = [name for name in self.sections if self.section_kinds[name] == "data"]
+        bss_sections = [name for name in self.sections if self.section_kinds[name] == "bss"]
+        addresses = {}
+        offset = ELF_HEADER_SIZE + ELF_PROGRAM_HEADER_COUNT * ELF_PROGRAM_HEADER_SIZE
+        for name in text_sections:
+            offset += -offset % ELF_SECTION_ALIGNMENT
+            addresses[name] = ELF_BASE_ADDRESS + offset
+            offset += len(self.sections[name])
+        text_size = offset
+        # The data segment starts on a new page so it can have different
+        # permissions, with its place in the file on the same spot of a page
+        # as its address.
+        data_offset = offset + (-offset % ELF_PAGE_SIZE)
+        offset = data_offset
+        for name in data_sections:
+            offset += -offset % ELF_SECTION_ALIGNMENT
+            addresses[name] = ELF_BASE_ADDRESS + offset
+            offset += len(self.sections[name])
+        data_size = offset - data_offset
+        for name in bss_sections:
+            offset += -offset % ELF_SECTION_ALIGNMENT
+            addresses[name] = ELF_BASE_ADDRESS + offset
+            offset += len(self.sections[name])
+        memory_size = offset - data_offset
+
+        for section, fixup_offset, size, symbol, addend, relative, (line_num, code) in self.fixups:
+            try:
+                value = self.get_symbol_address(symbol, addresses) + addend
+                if relative:
+                    value -= addresses[section] + fixup_offset + size
+                self.sections[section][fixup_offset:fixup_offset + size] = encode_asm_integer(value, size)
+            except ValueError as err:
+                raise UnsupportedAssemblyError(line_num, code, err)
+
+        entry = ELF_BASE_ADDRESS + text_size
+        if self.entry_symbol is not None:
+            (line_num, code), symbol = self.entry_symbol
+            try:
+                entry = self.get_symbol_address(symbol, addresses)
+            except ValueError as err:
+                raise UnsupportedAssemblyError(line_num, code, err)
+        elif ".text" in addresses:
+            entry = addresses[".text"]
+
+        executable = bytearray(struct.pack(
+            "<4sBBBBB7sHHIQQQIHHHHHH", b"\x7fELF", 2, 1, 1, 0, 0, bytes(7), 2, 0x3e, 1, entry, ELF_HEADER_SIZE, 0, 0,
+            ELF_HEADER_SIZE, ELF_PROGRAM_HEADER_SIZE, ELF_PROGRAM_HEADER_COUNT, 0, 0, 0,
+        ))
+        for segment_type, flags, segment_offset, file_size, segment_memory_size in (
+            (PT_LOAD, SEGMENT_READ | SEGMENT_EXECUTE, 0, text_size, text_size),
+            (PT_LOAD, SEGMENT_READ | SEGMENT_WRITE, data_offset, data_size, memory_size),
+            (PT_GNU_STACK, SEGMENT_READ | SEGMENT_WRITE, 0, 0, 0),
+        ):
+            address = ELF_BASE_ADDRESS + segment_offset if segment_type == PT_LOAD else 0
+            executable += struct.pack("<IIQQQQQQ", segment_type, flags, segment_offset, address, address,
+                                      file_size, segment_memory_size, ELF_PAGE_SIZE if segment_type == PT_LOAD else 16)
+        for name in text_sections + data_sections:
+            executable += bytes(addresses[name] - ELF_BASE_ADDRESS - len(executable))
+            executable += self.sections[name]
+        return bytes(executable)
+
+
+def write_elf_executable(asm, path):
+    """
+    Assemble the program and write it out as an executable at `path`, which
+    stands in for running nasm and ld on the assembly.
+    """
+    executable = ElfAssembler(asm).assemble()
+    with open(path, "wb") as out_file:
+        out_file.write(executable)
+    os.chmod(path, 0o755)
+
+
+#######
+# Stats
+#######
+STATS_FORMATS = ("text", "json")
+
+
+def count_nodes(node_list):
+    """
+    Count every node in the trees under `node_list`, including the ones in
+    lists like the bodies of loops and functions.
+    """
+    visited = set()
+    nodes_to_visit = list(node_list)
+    while nodes_to_visit:
+        node = nodes_to_visit.pop()
+        if id(node) in visited:
+            continue
+        visited.add(id(node))
+        nodes_to_visit.extend(iter_child_nodes(node))
+    return len(visited)
+
+
+def count_asm_instructions(asm):
+    return sum(1 for line in asm.splitlines() if (parsed := parse_asm_line(line)) and parsed[0])
+
+
+class BuildStats:
+    """
+    Wall time and peak memory of each phase of a build for --stats, along
+    with counts of the tokens, nodes and instructions it made. Memory is
+    what tracemalloc sees Python allocate, so it isn't measured for phases
+    that are other programs like nasm, ld and the program being run.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.phases = []
+        self.counts = {}
+        if enabled:
+            tracemalloc.start()
+
+    @contextlib.contextmanager
+    def phase(self, name, traced=True):
+        if not self.enabled:
+            yield
+            return
+        # Peaks are only per phase where tracemalloc can reset them (Python
+        # 3.9 and up), otherwise they're the peak so far.
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.phases.append({
+                "phase": name,
+                "seconds": seconds,
+                "peak_memory_bytes": tracemalloc.get_traced_memory()[1] if traced else None,
+            })
+
+    def count_tokens(self, tokens):
+        """
+        Count tokens as they're pulled through when the lexer streams them.
+        """
+        self.counts["tokens"] = 0
+        for token in tokens:
+            self.counts["tokens"] += 1
+            yield token
+
+    def report(self, stats_format="text"):
+        if stats_format == "json":
+            return json.dumps({"phases": self.phases, **self.counts}, indent=2)
+        lines = [f"{'phase':<20} {'time':>10} {'peak memory':>14}"]
+        for phase in self.phases:
+            peak = phase["peak_memory_bytes"]
+            memory = f"{peak / 1024:>10.1f} KiB" if peak is not None else f"{'-':>14}"
+            lines.append(f"{phase['phase']:<20} {phase['seconds']:>9.4f}s {memory}")
+        lines.extend(f"{name}: {value}" for name, value in self.counts.items())
+        return "\n".join(lines)
+
+
+#############
+# Build Cache
+#############
+BUILD_CACHE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "katana")
+# The command line options that change what gets built from a program.
+BUILD_CACHE_OPTIONS = ("lexer", "no_constant_folding", "register_loops", "optimize", "overflow_checks", "backend")
+BUILD_CACHE_CHUNK_SIZE = 1 << 16
+# Builds are cached under the default output name no matter where they were
+# written, with the executable having no extension.
+BUILD_CACHE_OUTPUT = "out"
+
+
+def get_build_cache_key(program_path, options):
+    """
+    Hash the contents of the program along with the compiler itself and the
+    options it's built with, so a change to any of them is a different build.
+    """
+    digest = hashlib.sha256()
+    # There's no version number to go off of so the compiler's own source
+    # stands in for it.
+    for path in (__file__, program_path):
+        with open(path, "rb") as hashed_file:
+            for chunk in iter(lambda: hashed_file.read(BUILD_CACHE_CHUNK_SIZE), b""):
+                digest.update(chunk)
+        digest.update(b"\0")
+    digest.update(repr(sorted(options.items())).encode())
+    return digest.hexdigest()
+
+
+def restore_cached_build(cache_key, output="out"):
+    """
+    Copy the files of a cached build to `output`, the same files a fresh
+    build leaves there. Returns False if the build isn't cached.
+    """
+    cache_dir = os.path.join(BUILD_CACHE_DIR, cache_key)
+    if not os.path.isfile(os.path.join(cache_dir, BUILD_CACHE_OUTPUT)):
+        return False
+    for name in os.listdir(cache_dir):
+        shutil.copy2(os.path.join(cache_dir, name), output + name[len(BUILD_CACHE_OUTPUT):])
+    return True
+
+
+def store_cached_build(cache_key, output, extensions):
+    """
+    Copy the files of a finished build at `output` with each of the
+    `extensions` into the cache. They're gathered in a temporary directory
+    that is renamed into place so a build that's only partly copied is never
+    picked up.
+    """
+    os.makedirs(BUILD_CACHE_DIR, exist_ok=True)
+    staging_dir = tempfile.mkdtemp(dir=BUILD_CACHE_DIR)
+    for extension in extensions:
+        shutil.copy2(output + extension, os.path.join(staging_dir, BUILD_CACHE_OUTPUT + extension))
+    try:
+        os.rename(staging_dir, os.path.join(BUILD_CACHE_DIR, cache_key))
+    except OSError:
+        # Another run cached the same build first.
+        shutil.rmtree(staging_dir)
+
+
+def run_executable(output):
+    # A bare name would be looked up on the PATH instead of run from here.
+    os.system(shlex.quote(os.path.join(".", output)))
+
+
+def run_program(backend="nasm", compiled_program=None, cache_key=None, stats=None, output="out"):
+    """
+    Build the executable at `output` from the assembly already written to
+    `output` with .asm added and run it.
+    """
+    stats = stats or BuildStats(enabled=False)
+    if backend == "elf":
+        with stats.phase("elf"):
+            try:
+                write_elf_executable(compiled_program, output)
+            except UnsupportedAssemblyError as uae:
+                asm_lines = compiled_program.splitlines()
+                bad_line = asm_lines[uae.line_num - 1]
+                print_exception_message(asm_lines, len(bad_line) - len(bad_line.lstrip()), uae)
+                sys.exit(1)
+        extensions = ["", ".asm"]
+        built = True
+    else:
+        with stats.phase("nasm", traced=False):
+            nasm_status = os.system(f"nasm -f elf64 -o {shlex.quote(output + '.o')} {shlex.quote(output + '.asm')}")
+        with stats.phase("ld", traced=False):
+            ld_status = os.system(f"ld -o {shlex.quote(output)} {shlex.quote(output + '.o')}")
+        extensions = ["", ".asm", ".o"]
+        built = nasm_status == 0 and ld_status == 0
+    # Only a build that worked can be cached, otherwise whatever was left over
+    # from an earlier build would be.
+    if built and cache_key is not None:
+        with stats.phase("cache store"):
+            store_cached_build(cache_key, output, extensions)
+    with stats.phase("run", traced=False):
+        run_executable(output)
 
 
 ######
@@ -5652,6 +7591,13 @@ if __name__ == "__main__":
                             help="Adds verbosity output to the steps.")
     arg_parser.add_argument("--raise-assertions", action="store_true",
                             help="Will raise more verbose messages. For example like the assertions in the __eq__ methods.")
+    arg_parser.add_argument("--lexer", choices=["default", "fast"], default="default",
+                            help="Which lexer to use. The fast lexer produces the same tokens with less work per character.")
+    input_group = arg_parser.add_mutually_exclusive_group()
+    input_group.add_argument("--stream", action="store_true",
+                             help="Read and lex the program a line at a time as the parser needs tokens instead of all up front.")
+    input_group.add_argument("--mmap", action="store_true",
+                             help="Memory map the program instead of reading all of its lines up front.")
     arg_parser.add_argument("--lex", action="store_true",
                             help="Lex the program and return a token list.")
     arg_parser.add_argument("--parse", action="store_true",
@@ -5660,25 +7606,97 @@ if __name__ == "__main__":
                             help="Compile the program and create assembly.")
     arg_parser.add_argument("--run", action="store_true",
                             help="Run the assembled program.")
+    arg_parser.add_argument("--no-constant-folding", action="store_true",
+                            help="Leaves arithmetic and comparisons on constants to be worked out when the program runs.")
+    arg_parser.add_argument("--register-loops", action="store_true",
+                            help="Keeps the index and end of the two innermost levels of loops in registers instead of memory.")
+    arg_parser.add_argument("--optimize", action="store_true",
+                            help="Run peephole optimizations over the assembly before writing it.")
+    arg_parser.add_argument("--overflow-checks", choices=["inline", "call"], default="inline",
+                            help="Check additions for overflow with a jump after the add or by calling a check function before it.")
+    arg_parser.add_argument("--backend", choices=["nasm", "elf"], default="nasm",
+                            help="Build the executable with nasm and ld or encode the machine code and write the ELF executable directly.")
+    arg_parser.add_argument("--no-cache", action="store_true",
+                            help=f"Always build the program when running it instead of reusing a build of the same program, compiler and options cached in {BUILD_CACHE_DIR}.")
+    arg_parser.add_argument("--output", default="out",
+                            help="Path of the executable to build. The assembly and object files are written next to it with .asm and .o added.")
+    arg_parser.add_argument("--stats", nargs="?", const="text", choices=STATS_FORMATS,
+                            help="Print the time and peak memory of each phase along with token, node and instruction counts to stderr, as text or json. Tracing memory slows the phases down.")
     args = arg_parser.parse_args()
 
     verbose_flag = args.verbose
     raise_assertion_flag = args.raise_assertions
-    with open(args.program, 'r') as code:
+    stats = BuildStats(enabled=args.stats is not None)
+    build_cache_key = None
+    # The cache is only used when the program is just being run, asking for
+    # the output of any of the other steps goes through all of them.
+    if args.run and not (args.lex or args.parse or args.compile or args.no_cache):
+        with stats.phase("cache lookup"):
+            build_cache_key = get_build_cache_key(args.program, {option: getattr(args, option) for option in BUILD_CACHE_OPTIONS})
+            is_cached = restore_cached_build(build_cache_key, args.output)
+        if is_cached:
+            print_verbose_message(f"Running the cached build of {args.program}")
+            with stats.phase("run", traced=False):
+                run_executable(args.output)
+            if stats.enabled:
+                print(stats.report(args.stats), file=sys.stderr)
+            sys.exit()
+    # None of the ways of reading a program have a first line to start from
+    # in an empty file.
+    if os.path.getsize(args.program) == 0:
+        print(f"{args.program} is empty.")
+        sys.exit(1)
+    with open(args.program, 'r') as code, contextlib.ExitStack() as program_stack:
         token_list = None
         ast = None
         if args.lex or args.parse or args.compile or args.run:
-            program = Program(code.readlines())
+            with stats.phase("program"):
+                if args.stream:
+                    program = StreamingProgram(code)
+                elif args.mmap:
+                    # Kept open until the end since errors found after lexing
+                    # still show the lines around them.
+                    program = program_stack.enter_context(MappedProgram(code))
+                else:
+                    program = Program(code.readlines())
             program_lines = program.lines
-            lexer = Lexer(program)
-            token_list = lexer.lex()
-            print_verbose_message(token_list)
+            lexer = FastLexer(program) if args.lexer == "fast" else Lexer(program)
+            if args.stream:
+                # Streamed tokens are lexed as the parser pulls them through,
+                # so their time and memory are part of parsing.
+                token_list = stats.count_tokens(lexer.iter_tokens()) if stats.enabled else lexer.iter_tokens()
+                # Nothing else will pull the tokens through when only lexing.
+                if not (args.parse or args.compile or args.run):
+                    with stats.phase("lex"):
+                        for token in token_list:
+                            print_verbose_message(token)
+            else:
+                with stats.phase("lex"):
+                    token_list = lexer.lex()
+                stats.counts["tokens"] = len(token_list)
+                print_verbose_message(token_list)
         if args.parse or args.compile or args.run:
             parser = Parser(token_list)
-            parser.parse()
+            with stats.phase("parse"):
+                parser.parse()
+            if stats.enabled:
+                stats.counts["nodes"] = count_nodes(parser.get_nodes())
             print_verbose_message(parser.get_nodes())
         if args.compile or args.run:
-            compiler = Compiler(parser.get_nodes())
-            compiler.compile()
+            nodes = parser.get_nodes()
+            if not args.no_constant_folding:
+                with stats.phase("constant folding"):
+                    nodes = ConstantFolder(nodes).fold()
+            compiler = Compiler(nodes, optimize=args.optimize, register_loops=args.register_loops,
+                                overflow_checks=args.overflow_checks)
+            compiler.output_path = f"{args.output}.asm"
+            with stats.phase("compile"):
+                compiled_program = compiler.get_compiled_program()
+            with stats.phase("write assembly"):
+                compiler.write_compiled_program(compiled_program)
+            if stats.enabled:
+                stats.counts["instructions"] = count_asm_instructions(compiled_program)
         if args.run:
-            run_program()
+            run_program(args.backend, compiled_program, build_cache_key, stats, args.output)
+    if stats.enabled:
+        print(stats.report(args.stats), file=sys.stderr)
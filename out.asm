@@ -0,0 +1,15 @@
+;; Start of program
+section .text
+    global _start
+section .var_1
+    number_1 dq 1
+section .var_2
+    string_1 db 'Hello, Katana!', 0
+section .var_3
+    char_1 db 'A', 0
+section .text
+    _start:
+    ;; Exit
+    mov rax, 60
+    mov rdi, 0
+    syscall
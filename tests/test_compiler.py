@@ -1,10 +1,30 @@
 import pytest
 import os
+import platform
+import json
+import subprocess
+import sys
+import tracemalloc
+from unittest.mock import patch
 from katana.katana import (
+    ELF_BASE_ADDRESS,
+    BufferOverflowException,
+    BuildStats,
     Compiler,
+    ConstantFolder,
+    ElfAssembler,
     Lexer,
     Parser,
     Program,
+    UnsupportedAssemblyError,
+    count_asm_instructions,
+    count_nodes,
+    get_build_cache_key,
+    optimize_assembly,
+    restore_cached_build,
+    run_program,
+    store_cached_build,
+    write_elf_executable,
 )
 
 
@@ -60,36 +80,18 @@ class TestCompilerMathematics:
                 "    ;; Get the two values to add\n",
                 "    pop rax\n",
                 "    pop rbx\n",
-                "    ;; Push copy of values to be preserved after overflow check\n",
-                "    push rax\n",
-                "    push rbx\n",
-                "    ;; Push copy of values to be consumed in overflow check\n",
-                "    push rax\n",
-                "    push rbx\n",
-                "    call check_int_64_overflow\n",
-                "    ;; Get the values back off the stack\n",
-                "    pop rax\n",
-                "    pop rbx\n",
-                "    ;; Add\n",
+                "    ;; Add and jump to the overflow handler if it carried\n",
                 "    add rax, rbx\n",
+                "    jc int_64_overflow\n",
                 "    push rax\n",
                 "    ;; Push number onto stack\n",
                 "    push 3\n",
                 "    ;; Get the two values to add\n",
                 "    pop rax\n",
                 "    pop rbx\n",
-                "    ;; Push copy of values to be preserved after overflow check\n",
-                "    push rax\n",
-                "    push rbx\n",
-                "    ;; Push copy of values to be consumed in overflow check\n",
-                "    push rax\n",
-                "    push rbx\n",
-                "    call check_int_64_overflow\n",
-                "    ;; Get the values back off the stack\n",
-                "    pop rax\n",
-                "    pop rbx\n",
-                "    ;; Add\n",
+                "    ;; Add and jump to the overflow handler if it carried\n",
                 "    add rax, rbx\n",
+                "    jc int_64_overflow\n",
                 "    push rax\n",
             ]
 
@@ -151,6 +153,7 @@ class TestCompilerMathematics:
                 "    ;; Divide\n",
                 "    pop rbx\n",
                 "    pop rax\n",
+                "    xor rdx, rdx\n",
                 "    div rbx\n",
                 "    push rax\n",
                 "    ;; Push number onto stack\n",
@@ -158,6 +161,7 @@ class TestCompilerMathematics:
                 "    ;; Divide\n",
                 "    pop rbx\n",
                 "    pop rax\n",
+                "    xor rdx, rdx\n",
                 "    div rbx\n",
                 "    push rax\n",
             ]
@@ -183,26 +187,29 @@ class TestCompilerMathematics:
                 "    ;; Divide\n",
                 "    pop rbx\n",
                 "    pop rax\n",
+                "    xor rdx, rdx\n",
                 "    div rbx\n",
                 "    push rax\n",
                 "    ;; Get the two values to add\n",
                 "    pop rax\n",
                 "    pop rbx\n",
-                "    ;; Push copy of values to be preserved after overflow check\n",
-                "    push rax\n",
-                "    push rbx\n",
-                "    ;; Push copy of values to be consumed in overflow check\n",
-                "    push rax\n",
-                "    push rbx\n",
-                "    call check_int_64_overflow\n",
-                "    ;; Get the values back off the stack\n",
-                "    pop rax\n",
-                "    pop rbx\n",
-                "    ;; Add\n",
+                "    ;; Add and jump to the overflow handler if it carried\n",
                 "    add rax, rbx\n",
+                "    jc int_64_overflow\n",
                 "    push rax\n",
             ]
 
+    def test_long_addition_chain(self):
+        """
+        Expressions are walked in a loop so a long chain of additions shouldn't
+        run into the recursion limit.
+        """
+        term_count = 5000
+        terms = " + ".join(["1"] * term_count)
+        assembly = get_assembly_for_program(["main() {\n", f"    {terms};\n", "}\n"])
+        assert assembly.count("    push 1\n") == term_count
+        assert assembly.count("    add rax, rbx\n") == term_count - 1
+
 
 class TestCompilerParenthesis:
 
@@ -218,18 +225,9 @@ class TestCompilerParenthesis:
                 "    ;; Get the two values to add\n",
                 "    pop rax\n",
                 "    pop rbx\n",
-                "    ;; Push copy of values to be preserved after overflow check\n",
-                "    push rax\n",
-                "    push rbx\n",
-                "    ;; Push copy of values to be consumed in overflow check\n",
-                "    push rax\n",
-                "    push rbx\n",
-                "    call check_int_64_overflow\n",
-                "    ;; Get the values back off the stack\n",
-                "    pop rax\n",
-                "    pop rbx\n",
-                "    ;; Add\n",
+                "    ;; Add and jump to the overflow handler if it carried\n",
                 "    add rax, rbx\n",
+                "    jc int_64_overflow\n",
                 "    push rax\n",
                 "    ;; Push number onto stack\n",
                 "    push 3\n",
@@ -267,6 +265,18 @@ class TestCompilerPrint:
                 "    call printl_num\n",
             ]
 
+    @pytest.mark.parametrize("keyword, func_name", [("print", "print_num"), ("printl", "printl_num")])
+    def test_print_num_buffers_once(self, keyword, func_name):
+        compiler = get_compiler_class(["main() {\n", f"    {keyword}(3);\n", "}\n"])
+        compiled_program = compiler.get_compiled_program()
+        start = compiled_program.index(f"    {func_name}:\n")
+        end = compiled_program.index("        ret\n", start)
+        func_asm = compiled_program[start:end]
+        assert func_asm.count("call buffer_output\n") == 1
+        assert "syscall\n" not in func_asm
+        assert "div " not in func_asm
+        assert "    divisor dq 0xcccccccccccccccd\n" in compiled_program
+
     def test_printl_keyword_with_char(self):
         curr_dir = os.getcwd()
         with open(curr_dir + "/tests/test_programs/sample_printl_char.ktna") as f:
@@ -305,23 +315,38 @@ class TestCompilerPrint:
                 "    ;; Get the two values to add\n",
                 "    pop rax\n",
                 "    pop rbx\n",
-                "    ;; Push copy of values to be preserved after overflow check\n",
-                "    push rax\n",
-                "    push rbx\n",
-                "    ;; Push copy of values to be consumed in overflow check\n",
-                "    push rax\n",
-                "    push rbx\n",
-                "    call check_int_64_overflow\n",
-                "    ;; Get the values back off the stack\n",
-                "    pop rax\n",
-                "    pop rbx\n",
-                "    ;; Add\n",
+                "    ;; Add and jump to the overflow handler if it carried\n",
                 "    add rax, rbx\n",
+                "    jc int_64_overflow\n",
                 "    push rax\n",
                 "    ;; Keyword Func\n",
                 "    call printl_num\n",
             ]
 
+    @pytest.mark.parametrize("keyword, func_name", [("print", "print_num"), ("printl", "printl_num")])
+    def test_print_keyword_with_multiply_of_group(self, keyword, func_name):
+        assembly = get_assembly_for_program(["main() {\n", f"    {keyword}(2 * (3 + 4));\n", "}\n"])
+        assert assembly[-6:] == [
+            "    pop rax\n",
+            "    pop rbx\n",
+            "    mul rbx\n",
+            "    push rax\n",
+            "    ;; Keyword Func\n",
+            f"    call {func_name}\n",
+        ]
+
+    def test_printl_keyword_with_divide(self):
+        assembly = get_assembly_for_program(["main() {\n", "    int64 x = 4;\n", "    printl(x / 2);\n", "}\n"])
+        assert assembly[-7:] == [
+            "    pop rbx\n",
+            "    pop rax\n",
+            "    xor rdx, rdx\n",
+            "    div rbx\n",
+            "    push rax\n",
+            "    ;; Keyword Func\n",
+            "    call printl_num\n",
+        ]
+
     def test_assignment_keyword_used(self):
         curr_dir = os.getcwd()
         with open(curr_dir + "/tests/test_programs/sample_assignment_used.ktna") as f:
@@ -367,6 +392,82 @@ class TestCompilerMain:
                 "    call print_string\n",
             ]
 
+    def test_compiled_program_built_in_memory(self, tmp_path):
+        curr_dir = os.getcwd()
+        with open(curr_dir + "/tests/test_programs/sample_main.ktna") as f:
+            lines = f.readlines()
+        compiler = get_compiler_class(lines)
+        compiler.output_path = str(tmp_path / "out.asm")
+        compiled_program = compiler.get_compiled_program()
+        assert not os.path.exists(compiler.output_path)
+        assert compiled_program.startswith(";; Start of program\n")
+        assert "    call print_string\n" in compiled_program
+        assert compiled_program.endswith("    syscall\n")
+
+        compiler = get_compiler_class(lines)
+        compiler.output_path = str(tmp_path / "out.asm")
+        compiler.compile()
+        with open(compiler.output_path) as out_file:
+            assert out_file.read() == compiled_program
+
+    def test_only_used_runtime_functions_written(self):
+        curr_dir = os.getcwd()
+        with open(curr_dir + "/tests/test_programs/sample_main.ktna") as f:
+            compiler = get_compiler_class(f.readlines())
+        compiled_program = compiler.get_compiled_program()
+        assert compiler.used_runtime_functions == {"print_string", "buffer_output", "output_buffer", "flush_output"}
+        assert "    print_string:\n" in compiled_program
+        assert "    print_num:\n" not in compiled_program
+        assert "int_64_overflow" not in compiled_program
+        assert "divisor" not in compiled_program
+
+    def test_runtime_function_dependencies_written(self):
+        compiler = get_compiler_class(["main() {\n", "    1 + 2;\n", "}\n"])
+        compiled_program = compiler.get_compiled_program()
+        assert compiler.used_runtime_functions == {
+            "int_64_overflow",
+            "overflow_strings",
+            "string_length",
+            "print_string",
+            "buffer_output",
+            "output_buffer",
+            "flush_output",
+        }
+        assert "   int_64_overflow:\n" in compiled_program
+        assert "    string_length:\n" in compiled_program
+        assert "    print_string:\n" in compiled_program
+        assert "section .error_strings\n" in compiled_program
+        assert "section .bss\n" in compiled_program
+
+    def test_output_flushed_before_exit(self):
+        compiled_program = get_compiler_class(["main() {\n", "    print(\"Hi\");\n", "}\n"]).get_compiled_program()
+        assert compiled_program.endswith(
+            "    ;; Write out anything left in the output buffer\n"
+            "    call flush_output\n"
+            "    ;; Exit\n"
+            "    mov rax, 60\n"
+            "    mov rdi, 0\n"
+            "    syscall\n"
+        )
+        assert "flush_line_output" not in compiled_program
+
+    def test_no_output_buffer_without_printing(self):
+        compiler = get_compiler_class(["main() {\n", "    int64 x = 3;\n", "}\n"])
+        compiled_program = compiler.get_compiled_program()
+        assert compiler.used_runtime_functions == set()
+        assert "output_buffer" not in compiled_program
+        assert "flush_output" not in compiled_program
+
+    def test_printl_flushes_lines_on_terminal(self):
+        compiler = get_compiler_class(["main() {\n", "    printl(\"Hi\");\n", "}\n"])
+        compiled_program = compiler.get_compiled_program()
+        assert "flush_line_output" in compiler.used_runtime_functions
+        start = compiled_program.index("    printl_string:\n")
+        end = compiled_program.index("        ret\n", start)
+        assert compiled_program[start:end].endswith("        call flush_line_output\n"
+                                                    "        ;; Push return address back.\n"
+                                                    "        push rbx\n")
+
 
 class TestCompilerInt:
     """
@@ -627,10 +728,21 @@ class TestCompilerString:
                 }
             }
             assert compiler.initialize_vars_asm == [
-                "    push string_1\n",
-                "    push 15\n",
-                "    call allocate_memory\n",
-                "    mov rax, qword [string_1]\n",
+                "    ;; Allocate 23 bytes from the memory arena\n",
+                "    mov rax, [arena_next]\n",
+                "    add rax, 23\n",
+                "    cmp rax, [arena_end]\n",
+                "    jbe arena_allocated_1\n",
+                "    mov rdi, 23\n",
+                "    call grow_memory_arena\n",
+                "    arena_allocated_1:\n",
+                "    mov rax, [arena_next]\n",
+                "    lea rcx, [rax+23]\n",
+                "    mov [arena_next], rcx\n",
+                "    ;; Store the length in front of the string\n",
+                "    mov qword [rax], 14\n",
+                "    add rax, 8\n",
+                "    mov qword [string_1], rax\n",
                 "    mov byte [rax+0], 'H'\n",
                 "    mov byte [rax+1], 'e'\n",
                 "    mov byte [rax+2], 'l'\n",
@@ -648,15 +760,42 @@ class TestCompilerString:
                 "    mov byte [rax+14], 0\n",
             ]
             assert assembly == [
-                "    ;; Calculate variable string length and push onto stack with string\n",
-                "    push qword [string_1]\n",
-                "    push qword [string_1]\n",
-                "    call string_length\n",
-                "    push qword [string_1]\n",
+                "    ;; Push variable string length from in front of the string and string onto stack\n",
+                "    mov rax, qword [string_1]\n",
+                "    push qword [rax-8]\n",
+                "    push rax\n",
                 "    ;; Keyword Func\n",
                 "    call print_string\n"
             ]
 
+    def test_print_const_string_pushes_known_length(self):
+        compiler = get_compiler_class(["main() {\n", "    const string x = \"Hello\";\n", "    print(x);\n", "}\n"])
+        assembly = compiler.get_assembly()
+        assert assembly == [
+            "    ;; Push const string length and string onto stack\n",
+            "    push 5\n",
+            "    push string_1\n",
+            "    ;; Keyword Func\n",
+            "    call print_string\n",
+        ]
+        assert "string_length" not in compiler.used_runtime_functions
+
+    def test_non_const_strings_share_memory_arena(self):
+        compiler = get_compiler_class([
+            "main() {\n",
+            "    string x = \"Hi\";\n",
+            "    string y = \"Hey\";\n",
+            "}\n",
+        ])
+        compiled_program = compiler.get_compiled_program()
+        assert "    jbe arena_allocated_1\n" in compiler.initialize_vars_asm
+        assert "    jbe arena_allocated_2\n" in compiler.initialize_vars_asm
+        assert "    lea rcx, [rax+12]\n" in compiler.initialize_vars_asm
+        assert "    mov qword [rax], 3\n" in compiler.initialize_vars_asm
+        assert "    mov qword [string_2], rax\n" in compiler.initialize_vars_asm
+        assert compiled_program.count("    grow_memory_arena:\n") == 1
+        assert "    arena_next resq 1\n" in compiled_program
+
     @pytest.mark.skip
     def test_concatenate_char_to_string(self):
         curr_dir = os.getcwd()
@@ -978,19 +1117,54 @@ class TestCompilerCopyStr:
                 "    push qword [string_2]\n",
                 "    ;; Push variable string onto stack without length\n",
                 "    push qword [string_1]\n",
-                "    pop rax\n",
-                "    pop rbx\n",
-                "    mov byte cl, [rbx+0]\n",
-                "    mov byte [rax+0], cl\n",
-                "    mov byte cl, [rbx+1]\n",
-                "    mov byte [rax+1], cl\n",
-                "    mov byte cl, [rbx+2]\n",
-                "    mov byte [rax+2], cl\n",
-                "    mov byte cl, [rbx+3]\n",
-                "    mov byte [rax+3], cl\n",
-                "    mov byte cl, [rbx+4]\n",
-                "    mov byte [rax+4], cl\n",
+                "    ;; Copy string\n",
+                "    pop rdi\n",
+                "    pop rsi\n",
+                "    ;; Update the length in front of the string copied to\n",
+                "    mov rax, [rsi-8]\n",
+                "    mov rcx, 5\n",
+                "    cmp rax, rcx\n",
+                "    cmova rax, rcx\n",
+                "    mov [rdi-8], rax\n",
+                "    mov rcx, 5\n",
+                "    call copy_string\n",
             ]
+            assert "copy_string" in compiler.used_runtime_functions
+
+    @pytest.mark.parametrize("src, dest, copy_len", [
+        ("Hi", "Hello", 3),
+        ("Hello", "Hi", 2),
+    ])
+    def test_copy_str_different_lengths(self, src, dest, copy_len):
+        compiler = get_compiler_class([
+            "main() {\n",
+            f"    string x = \"{src}\";\n",
+            f"    string y = \"{dest}\";\n",
+            "    copyStr(x, y);\n",
+            "}\n",
+        ])
+        assembly = compiler.get_assembly()
+        assert assembly[-2:] == [
+            f"    mov rcx, {copy_len}\n",
+            "    call copy_string\n",
+        ]
+
+    def test_copy_str_from_const(self):
+        compiler = get_compiler_class([
+            "main() {\n",
+            "    const string x = \"Hi\";\n",
+            "    string y = \"Hello\";\n",
+            "    copyStr(x, y);\n",
+            "}\n",
+        ])
+        assembly = compiler.get_assembly()
+        assert assembly[-5:] == [
+            "    pop rdi\n",
+            "    pop rsi\n",
+            "    mov qword [rdi-8], 2\n",
+            "    mov rcx, 3\n",
+            "    call copy_string\n",
+        ]
 
 
 class TestCompilerBool:
@@ -1812,18 +1986,9 @@ class TestCompilerMacroKeyword:
                 "    ;; Get the two values to add\n",
                 "    pop rax\n",
                 "    pop rbx\n",
-                "    ;; Push copy of values to be preserved after overflow check\n",
-                "    push rax\n",
-                "    push rbx\n",
-                "    ;; Push copy of values to be consumed in overflow check\n",
-                "    push rax\n",
-                "    push rbx\n",
-                "    call check_int_64_overflow\n",
-                "    ;; Get the values back off the stack\n",
-                "    pop rax\n",
-                "    pop rbx\n",
-                "    ;; Add\n",
+                "    ;; Add and jump to the overflow handler if it carried\n",
                 "    add rax, rbx\n",
+                "    jc int_64_overflow\n",
                 "    push rax\n",
                 "    ;; Keyword Func\n",
                 "    call print_num\n",
@@ -1846,18 +2011,9 @@ class TestCompilerMacroKeyword:
                 "    ;; Get the two values to add\n",
                 "    pop rax\n",
                 "    pop rbx\n",
-                "    ;; Push copy of values to be preserved after overflow check\n",
-                "    push rax\n",
-                "    push rbx\n",
-                "    ;; Push copy of values to be consumed in overflow check\n",
-                "    push rax\n",
-                "    push rbx\n",
-                "    call check_int_64_overflow\n",
-                "    ;; Get the values back off the stack\n",
-                "    pop rax\n",
-                "    pop rbx\n",
-                "    ;; Add\n",
+                "    ;; Add and jump to the overflow handler if it carried\n",
                 "    add rax, rbx\n",
+                "    jc int_64_overflow\n",
                 "    push rax\n",
                 "    ;; Keyword Func\n",
                 "    call print_num\n",
@@ -1903,18 +2059,9 @@ class TestCompilerFunctions:
                 "    ;; Get the two values to add\n",
                 "    pop rax\n",
                 "    pop rbx\n",
-                "    ;; Push copy of values to be preserved after overflow check\n",
-                "    push rax\n",
-                "    push rbx\n",
-                "    ;; Push copy of values to be consumed in overflow check\n",
-                "    push rax\n",
-                "    push rbx\n",
-                "    call check_int_64_overflow\n",
-                "    ;; Get the values back off the stack\n",
-                "    pop rax\n",
-                "    pop rbx\n",
-                "    ;; Add\n",
+                "    ;; Add and jump to the overflow handler if it carried\n",
                 "    add rax, rbx\n",
+                "    jc int_64_overflow\n",
                 "    push rax\n",
                 "        ;; Get return value before pointer reset\n",
                 "        pop rax\n",
@@ -1941,3 +2088,825 @@ class TestCompilerFunctions:
                 "    ;; Call add function\n",
                 "    call add\n"
             ]
+
+
+class TestCompilerOptimizer:
+    """
+    All tests related to the peephole optimizer run with --optimize.
+    """
+
+    def test_push_pop_same_register_removed(self):
+        assert optimize_assembly([
+            "    add rax, rbx\n",
+            "    push rax\n",
+            "    ;; Get the value back\n",
+            "    pop rax\n",
+            "    ret\n",
+        ]) == [
+            "    add rax, rbx\n",
+            "    ;; Get the value back\n",
+            "    ret\n",
+        ]
+
+    def test_push_pop_becomes_mov(self):
+        assert optimize_assembly([
+            "    push 1\n",
+            "    push qword [number_1]\n",
+            "    pop rax\n",
+            "    pop rbx\n",
+        ]) == [
+            "    mov rbx, 1\n",
+            "    mov rax, qword [number_1]\n",
+        ]
+
+    def test_push_pop_with_mov_in_between(self):
+        assert optimize_assembly([
+            "    push rax\n",
+            "    mov rcx, 2\n",
+            "    pop rbx\n",
+        ]) == [
+            "    mov rbx, rax\n",
+            "    mov rcx, 2\n",
+        ]
+
+    def test_word_push_pop_becomes_mov(self):
+        assert optimize_assembly([
+            "    mov bl, [raw_char_2]\n",
+            "    push bx\n",
+            "    pop ax\n",
+        ]) == [
+            "    mov bl, [raw_char_2]\n",
+            "    mov ax, bx\n",
+        ]
+
+    @pytest.mark.parametrize("between", [
+        "    mov rbx, 2\n",
+        "    mov bl, 2\n",
+        "    mov rax, rsp\n",
+        "    add rcx, 2\n",
+        "    call print_num\n",
+        "    label_1:\n",
+    ])
+    def test_push_pop_kept_when_not_safe(self, between):
+        asm = ["    push rax\n", between, "    pop rbx\n"]
+        assert optimize_assembly(asm) == asm
+
+    @pytest.mark.parametrize("value, register", [
+        ("rsp", "rbx"),
+        ("al", "rbx"),
+        ("byte [rax]", "rbx"),
+        ("bx", "rax"),
+        ("rbx", "ax"),
+        ("5", "ax"),
+    ])
+    def test_push_pop_kept_for_unsafe_values(self, value, register):
+        asm = [f"    push {value}\n", f"    pop {register}\n"]
+        assert optimize_assembly(asm) == asm
+
+    def test_pop_with_comment_removed(self):
+        assert optimize_assembly([
+            "    push rcx\n",
+            "    pop rcx ;; Get return address\n",
+        ]) == []
+
+    def test_redundant_loop_end_store_removed(self):
+        assert optimize_assembly([
+            "    mov rbx, [loop_end_0]\n",
+            "    mov rax, [loop_idx_0]\n",
+            "    cmp rax, rbx\n",
+            "    mov qword [loop_end_0], rbx\n",
+        ]) == [
+            "    mov rbx, [loop_end_0]\n",
+            "    mov rax, [loop_idx_0]\n",
+            "    cmp rax, rbx\n",
+        ]
+
+    @pytest.mark.parametrize("between", [
+        "    inc rbx\n",
+        "    mov qword [loop_end_0], rax\n",
+        "    mov byte [rax], bl\n",
+        "    loop_start_0:\n",
+    ])
+    def test_store_kept_when_value_could_change(self, between):
+        asm = [
+            "    mov rbx, [loop_end_0]\n",
+            between,
+            "    mov qword [loop_end_0], rbx\n",
+        ]
+        assert optimize_assembly(asm) == asm
+
+    @pytest.mark.parametrize("asm", [
+        # The address in the register changed between the load and the store.
+        ["    mov rbx, [rax]\n", "    add rax, 8\n", "    mov [rax], rbx\n"],
+        ["    mov rbx, [rax]\n", "    mov rax, rcx\n", "    mov [rax], rbx\n"],
+        # A store through a register could be to the same memory.
+        ["    mov rbx, [x]\n", "    mov qword [rdi], 5\n", "    mov [x], rbx\n"],
+    ])
+    def test_store_kept_when_memory_could_change(self, asm):
+        assert optimize_assembly(asm) == asm
+
+    def test_jump_to_next_label_removed(self):
+        assert optimize_assembly([
+            "        cmp rax, 0\n",
+            "        jne l1_print_num\n",
+            "        ;; Fall through to the loop\n",
+            "    l1_print_num:\n",
+        ]) == [
+            "        cmp rax, 0\n",
+            "        ;; Fall through to the loop\n",
+            "    l1_print_num:\n",
+        ]
+
+    def test_jump_to_other_label_kept(self):
+        asm = [
+            "    jne l2_print_num\n",
+            "    l1_print_num:\n",
+            "    l2_print_num:\n",
+        ]
+        assert optimize_assembly(asm) == asm
+
+    def test_data_lines_not_changed(self):
+        asm = [
+            "section .data\n",
+            "    raw_string_1 db \"push rax; pop rax\", 10\n",
+            "    raw_len_1 equ $ - raw_string_1\n",
+            "    number_1 dd 4\n",
+        ]
+        assert optimize_assembly(asm) == asm
+
+    @pytest.mark.parametrize("program", sorted(os.listdir(os.getcwd() + "/sample_programs")))
+    def test_sample_programs_optimized(self, program):
+        with open(os.getcwd() + "/sample_programs/" + program) as f:
+            lines = f.readlines()
+        try:
+            compiled_program = get_compiler_class(lines).get_compiled_program()
+        except (Exception, SystemExit):
+            pytest.skip("Program doesn't compile.")
+        compiler = get_compiler_class(lines)
+        compiler.optimize = True
+        optimized_program = compiler.get_compiled_program()
+        # Labels and data are never touched so every jump and reference still
+        # has somewhere to go.
+        labels = [line for line in compiled_program.splitlines() if line.endswith(":") or line.startswith("section")]
+        assert labels == [line for line in optimized_program.splitlines() if line.endswith(":") or line.startswith("section")]
+        assert len(optimized_program.splitlines()) <= len(compiled_program.splitlines())
+
+    @pytest.mark.skipif(sys.platform != "linux" or platform.machine() != "x86_64", reason="Runs an x86-64 Linux executable.")
+    @pytest.mark.parametrize("register_loops", [False, True])
+    @pytest.mark.parametrize("program", sorted(os.listdir(os.getcwd() + "/sample_programs")))
+    def test_sample_programs_optimized_output(self, program, register_loops, tmp_path):
+        expected_output_path = os.getcwd() + "/expected_outputs/" + program.split(".")[0] + "_expected_output.txt"
+        with open(os.getcwd() + "/sample_programs/" + program) as f:
+            lines = f.readlines()
+        try:
+            compiler = get_compiler_class(lines)
+            compiler.optimize = True
+            compiler.register_loops = register_loops
+            optimized_program = compiler.get_compiled_program()
+        except (Exception, SystemExit):
+            pytest.skip("Program doesn't compile.")
+        executable_path = str(tmp_path / "out")
+        write_elf_executable(optimized_program, executable_path)
+        result = subprocess.run([executable_path], stdout=subprocess.PIPE, timeout=60)
+        with open(expected_output_path, "rb") as expected_output:
+            assert result.stdout == expected_output.read()
+
+
+class TestCompilerRegisterLoops:
+    """
+    All tests related to keeping loop indices in registers with --register-loops.
+    """
+
+    def get_register_loops_assembly(self, lines):
+        compiler = get_compiler_class(lines)
+        compiler.register_loops = True
+        return compiler.get_assembly()
+
+    def test_loop_up_access_index(self):
+        curr_dir = os.getcwd()
+        with open(curr_dir + "/tests/test_programs/sample_loop_up_access_index.ktna") as f:
+            assembly = self.get_register_loops_assembly(f.readlines())
+            assert assembly == [
+                "    ;; Push loop start and end on stack\n",
+                "    mov r12, 0\n",
+                "    mov r13, 3\n",
+                "    ;; Loop up\n",
+                "    loop_0:\n",
+                "    ;; Push a raw string and length onto stack\n",
+                "    push 11\n",
+                "    push raw_string_1\n",
+                "    ;; Keyword Func\n",
+                "    call print_string\n",
+                "    ;; Push loop idx 0 onto stack\n",
+                "    push r12\n",
+                "    ;; Keyword Func\n",
+                "    call printl_num\n",
+                "    ;; Compare if counter has reached the loop end\n",
+                "    inc r12\n",
+                "    cmp r12, r13\n",
+                "    jl loop_0\n",
+            ]
+
+    def test_nested_loops(self):
+        curr_dir = os.getcwd()
+        with open(curr_dir + "/tests/test_programs/sample_loop_up_and_down_nested.ktna") as f:
+            assembly = self.get_register_loops_assembly(f.readlines())
+            assert assembly == [
+                "    ;; Push loop start and end on stack\n",
+                "    mov r14, 0\n",
+                "    mov r15, 2\n",
+                "    ;; Loop up\n",
+                "    loop_0:\n",
+                "    ;; Push loop start and end on stack\n",
+                "    mov r12, 3\n",
+                "    mov r13, 0\n",
+                "    ;; Loop down\n",
+                "    loop_1:\n",
+                "    ;; Push a raw string and length onto stack\n",
+                "    push 6\n",
+                "    push raw_string_1\n",
+                "    ;; Keyword Func\n",
+                "    call printl_string\n",
+                "    ;; Compare if counter has reached the loop end\n",
+                "    dec r12\n",
+                "    cmp r12, r13\n",
+                "    jg loop_1\n",
+                "    ;; Compare if counter has reached the loop end\n",
+                "    inc r14\n",
+                "    cmp r14, r15\n",
+                "    jl loop_0\n",
+            ]
+
+    def test_outer_loops_stay_in_memory(self):
+        assembly = self.get_register_loops_assembly([
+            "main() {\n",
+            "    loopUp(2) {\n",
+            "        loopUp(3) {\n",
+            "            loopUp(4) {\n",
+            "                printl(idx);\n",
+            "            }\n",
+            "        }\n",
+            "    }\n",
+            "}\n",
+        ])
+        assert assembly[:3] == [
+            "    ;; Push loop start and end on stack\n",
+            "    mov qword [loop_idx_0], 0\n",
+            "    mov qword [loop_end_0], 2\n",
+        ]
+        assert "    mov r14, 0\n" in assembly
+        assert "    mov r12, 0\n" in assembly
+        assert assembly[-3:] == [
+            "    mov qword [loop_idx_0], rcx\n",
+            "    mov qword [loop_end_0], rbx\n",
+            "    jl loop_0\n",
+        ]
+
+    def test_loop_registers_saved_around_calls(self):
+        curr_dir = os.getcwd()
+        with open(curr_dir + "/tests/test_programs/sample_loop_up_and_down_nested.ktna") as f:
+            compiler = get_compiler_class(f.readlines())
+            compiler.register_loops = True
+            compiler.get_assembly()
+            inner_loop_node = compiler.node_list[0].children_nodes[0].loop_body[0]
+            save_asm, load_asm = compiler.get_spill_loop_registers_asm(inner_loop_node.loop_body[0])
+            assert save_asm == [
+                "    ;; Save loop registers before the call\n",
+                "    mov qword [loop_idx_1], r12\n",
+                "    mov qword [loop_end_1], r13\n",
+                "    mov qword [loop_idx_0], r14\n",
+                "    mov qword [loop_end_0], r15\n",
+            ]
+            assert load_asm == [
+                "    ;; Load loop registers after the call\n",
+                "    mov r12, [loop_idx_1]\n",
+                "    mov r13, [loop_end_1]\n",
+                "    mov r14, [loop_idx_0]\n",
+                "    mov r15, [loop_end_0]\n",
+            ]
+
+    def test_loops_in_memory_by_default(self):
+        curr_dir = os.getcwd()
+        with open(curr_dir + "/tests/test_programs/sample_loop_up_and_down_nested.ktna") as f:
+            assembly = get_assembly_for_program(f.readlines())
+            assert not any("r12" in line or "r14" in line for line in assembly)
+
+
+class TestCompilerConstantFolding:
+    """
+    All tests related to folding constants with the ConstantFolder before compiling.
+    """
+
+    def get_folded_assembly(self, lines):
+        nodes = ConstantFolder(get_nodes(get_token_list(lines))).fold()
+        return get_compiler_class(input_nodes=nodes).get_assembly()
+
+    def test_addition_folded(self):
+        assembly = self.get_folded_assembly(["main() {\n", "    1 + 2 + 3;\n", "}\n"])
+        assert assembly == [
+            "    ;; Push number onto stack\n",
+            "    push 6\n",
+        ]
+
+    def test_order_of_operations_folded(self):
+        assembly = self.get_folded_assembly(["main() {\n", "    print(10 - 4 / 2 * 3);\n", "}\n"])
+        assert assembly == [
+            "    ;; Push number onto stack\n",
+            "    push 4\n",
+            "    ;; Keyword Func\n",
+            "    call print_num\n",
+        ]
+
+    def test_const_variable_folded(self):
+        assembly = self.get_folded_assembly([
+            "main() {\n",
+            "    const int64 rowCount = 79;\n",
+            "    print(rowCount + 1);\n",
+            "}\n",
+        ])
+        assert assembly == [
+            "    ;; Push number onto stack\n",
+            "    push 80\n",
+            "    ;; Keyword Func\n",
+            "    call print_num\n",
+        ]
+
+    def test_constant_part_of_expression_folded(self):
+        assembly = self.get_folded_assembly([
+            "main() {\n",
+            "    int64 x = 3;\n",
+            "    print(2 * 3 + x);\n",
+            "}\n",
+        ])
+        assert assembly[:2] == [
+            "    ;; Push number onto stack\n",
+            "    push 6\n",
+        ]
+        assert "    jc int_64_overflow\n" in assembly
+
+    def test_negative_result_folded(self):
+        assembly = self.get_folded_assembly(["main() {\n", "    1 - 3;\n", "}\n"])
+        assert assembly == [
+            "    ;; Push number onto stack\n",
+            "    push -2\n",
+        ]
+
+    @pytest.mark.parametrize("expression", ["4 / 0", "100000 * 100000"])
+    def test_expression_left_for_runtime(self, expression):
+        lines = ["main() {\n", f"    {expression};\n", "}\n"]
+        assert self.get_folded_assembly(lines) == get_assembly_for_program(lines)
+
+    def test_declaration_folded(self):
+        compiler = get_compiler_class(input_nodes=ConstantFolder(get_nodes(get_token_list([
+            "main() {\n",
+            "    int64 x = 1 + 2 + 3;\n",
+            "}\n",
+        ]))).fold())
+        compiler.get_assembly()
+        assert compiler.variables["x"]["var_val"] == "6"
+
+    @pytest.mark.parametrize("condition, printed", [
+        ("3 > 2", "yes"),
+        ("3 < 2", "no"),
+        ("3 == 3", "yes"),
+        ("1 + 2 > 2", "yes"),
+        ("2 * 3 < 5", "no"),
+        ("(10 - 4) / 2 == 1 + 2", "yes"),
+    ])
+    def test_if_else_resolved(self, condition, printed):
+        assembly = self.get_folded_assembly([
+            "main() {\n",
+            f"    if ({condition}) {{\n",
+            "        print(\"yes\");\n",
+            "    } else {\n",
+            "        print(\"no\");\n",
+            "    }\n",
+            "}\n",
+        ])
+        assert assembly == [
+            "    ;; Push a raw string and length onto stack\n",
+            f"    push {len(printed)}\n",
+            "    push raw_string_1\n",
+            "    ;; Keyword Func\n",
+            "    call print_string\n",
+        ]
+
+    def test_if_resolved_with_const_variable(self):
+        assembly = self.get_folded_assembly([
+            "main() {\n",
+            "    const int64 rowCount = 79;\n",
+            "    if (rowCount == 80) {\n",
+            "        print(\"yes\");\n",
+            "    }\n",
+            "}\n",
+        ])
+        assert assembly == []
+
+    def test_if_resolved_with_arithmetic_on_const_variable(self):
+        assembly = self.get_folded_assembly([
+            "main() {\n",
+            "    const int64 rowCount = 79;\n",
+            "    if (rowCount + 1 == 80) {\n",
+            "        print(\"yes\");\n",
+            "    }\n",
+            "}\n",
+        ])
+        assert assembly == [
+            "    ;; Push a raw string and length onto stack\n",
+            "    push 3\n",
+            "    push raw_string_1\n",
+            "    ;; Keyword Func\n",
+            "    call print_string\n",
+        ]
+
+    def test_if_kept_when_skipped_side_declares(self):
+        lines = [
+            "main() {\n",
+            "    if (3 > 2) {\n",
+            "        print(\"yes\");\n",
+            "    } else {\n",
+            "        int64 x = 1;\n",
+            "    }\n",
+            "}\n",
+        ]
+        assert self.get_folded_assembly(lines) == get_assembly_for_program(lines)
+
+    @patch("katana.katana.print_exception_message")
+    def test_declaration_overflow(self, mock_print):
+        with pytest.raises(SystemExit):
+            ConstantFolder(get_nodes(get_token_list([
+                "main() {\n",
+                "    int8 x = 200 + 100;\n",
+                "}\n",
+            ]))).fold()
+        mock_print.assert_called_with([], 9, BufferOverflowException(1, 9))
+
+    @patch("katana.katana.print_exception_message")
+    def test_addition_overflow_for_const_type(self, mock_print):
+        with pytest.raises(SystemExit):
+            ConstantFolder(get_nodes(get_token_list([
+                "main() {\n",
+                "    const int8 y = 250;\n",
+                "    print(y + 10);\n",
+                "}\n",
+            ]))).fold()
+        mock_print.assert_called_with([], 12, BufferOverflowException(2, 12))
+
+    def test_long_expression_folded(self):
+        terms = " + ".join(["1"] * 5000)
+        assembly = self.get_folded_assembly(["main() {\n", f"    {terms};\n", "}\n"])
+        assert assembly == [
+            "    ;; Push number onto stack\n",
+            "    push 5000\n",
+        ]
+
+
+class TestCompilerOverflowChecks:
+    """
+    All tests related to checking additions for overflow
+    """
+
+    def get_add_assembly(self, int_type, overflow_checks="inline"):
+        lines = ["main() {\n", f"    {int_type} x = 1;\n", "    x = x + 2;\n", "}\n"]
+        compiler = Compiler(get_nodes(get_token_list(lines)), overflow_checks=overflow_checks)
+        assembly = compiler.get_assembly()
+        start = assembly.index("    ;; Get the two values to add\n")
+        end = assembly.index("    ;; Assign expression value to new var\n")
+        return compiler, assembly[start:end]
+
+    def test_int_64_add_checked_inline(self):
+        compiler, assembly = self.get_add_assembly("int64")
+        assert assembly == [
+            "    ;; Get the two values to add\n",
+            "    pop rax\n",
+            "    pop rbx\n",
+            "    ;; Add and jump to the overflow handler if it carried\n",
+            "    add rax, rbx\n",
+            "    jc int_64_overflow\n",
+            "    push rax\n",
+        ]
+        assert "int_64_overflow" in compiler.used_runtime_functions
+        assert "check_int_64_overflow" not in compiler.used_runtime_functions
+
+    @pytest.mark.parametrize("int_type, bits, registers", [
+        ("int8", 8, ("cl", "al", "bl")),
+        ("int16", 16, ("cx", "ax", "bx")),
+        ("int32", 32, ("ecx", "eax", "ebx")),
+    ])
+    def test_narrow_int_add_checked_inline(self, int_type, bits, registers):
+        compiler, assembly = self.get_add_assembly(int_type)
+        check_reg, left_reg, right_reg = registers
+        assert assembly == [
+            "    ;; Get the two values to add\n",
+            "    pop rax\n",
+            "    pop rbx\n",
+            f"    ;; Add the low {bits} bits and jump to the overflow handler if it carried\n",
+            f"    mov {check_reg}, {left_reg}\n",
+            f"    add {check_reg}, {right_reg}\n",
+            f"    jc int_{bits}_overflow\n",
+            "    ;; Add\n",
+            "    add rax, rbx\n",
+            "    push rax\n",
+        ]
+        assert f"int_{bits}_overflow" in compiler.used_runtime_functions
+
+    def test_overflow_handler_shared_between_adds(self):
+        lines = ["main() {\n", "    int16 x = 1;\n", "    x = x + 2;\n", "    x = x + 3;\n", "}\n"]
+        compiled_program = Compiler(get_nodes(get_token_list(lines))).get_compiled_program()
+        assert compiled_program.count("    jc int_16_overflow\n") == 2
+        assert compiled_program.count("   int_16_overflow:\n") == 1
+        assert "       mov rdi, 16\n" in compiled_program
+        assert "int_8_overflow" not in compiled_program
+
+    def test_add_checked_with_call(self):
+        compiler, assembly = self.get_add_assembly("int32", overflow_checks="call")
+        assert "    call check_int_32_overflow\n" in assembly
+        assert "jc int_32_overflow\n" not in assembly
+        assert compiler.used_runtime_functions >= {"check_int_32_overflow", "overflow_strings"}
+        assert "int_32_overflow" not in compiler.used_runtime_functions
+
+
+class TestCompilerElfBackend:
+    """
+    All tests related to encoding the assembly and writing the executable
+    with --backend=elf
+    """
+
+    def assemble_text(self, lines):
+        assembler = ElfAssembler("section .text\n" + "".join(lines))
+        assembler.assemble()
+        return bytes(assembler.sections[".text"])
+
+    @pytest.mark.parametrize("line, encoding", [
+        ("    mov rax, 60\n", "b83c000000"),
+        ("    mov rcx, 0x0000000d0000000a\n", "48b90a0000000d000000"),
+        ("    mov rax, -1\n", "48c7c0ffffffff"),
+        ("    mov cx, 258\n", "66b90201"),
+        ("    mov sil, [rax]\n", "408a30"),
+        ("    mov byte [rax+5], ','\n", "c640052c"),
+        ("    mov qword [rdi-8], 3\n", "48c747f803000000"),
+        ("    mov [rsp+8], r12\n", "4c89642408"),
+        ("    movzx rax, byte [rbx+rcx]\n", "480fb6040b"),
+        ("    lea rsi, [rsp+rcx*8+160]\n", "488db4cca0000000"),
+        ("    add rax, rbx\n", "4801d8"),
+        ("    add cl, bl\n", "00d9"),
+        ("    sub rsp, 168\n", "4881eca8000000"),
+        ("    cmp byte [rax], 0\n", "803800"),
+        ("    cmova rax, rcx\n", "480f47c1"),
+        ("    shr rdx, 3\n", "48c1ea03"),
+        ("    div rbx\n", "48f7f3"),
+        ("    inc r8\n", "49ffc0"),
+        ("    push 3\n", "6a03"),
+        ("    push 4096\n", "6800100000"),
+        ("    push r12\n", "4154"),
+        ("    pop bx\n", "665b"),
+        ("    rep movsb\n", "f3a4"),
+        ("    syscall\n", "0f05"),
+    ])
+    def test_instruction_encoding(self, line, encoding):
+        assert self.assemble_text([line]).hex() == encoding
+
+    def test_labels_are_absolute_and_jumps_relative(self):
+        assembler = ElfAssembler("".join([
+            "section .text\n",
+            "    _start:\n",
+            "    mov rax, [number_1]\n",
+            "    jmp _start\n",
+            "    call done\n",
+            "    done:\n",
+            "    ret\n",
+            "section .var_1 write\n",
+            "    number_1 dq 7\n",
+        ]))
+        executable = assembler.assemble()
+        text = assembler.sections[".text"]
+        data_address = int.from_bytes(text[4:8], "little")
+        # Data goes on the page after the code, at the same spot in the file.
+        assert data_address % 0x1000 == 0
+        assert executable[data_address - ELF_BASE_ADDRESS:][:8] == (7).to_bytes(8, "little")
+        assert text[:4].hex() == "488b0425"
+        # Back to the start of the mov from the end of the jmp, then on to
+        # the ret right after the call.
+        assert text[8:13].hex() == "e9f3ffffff"
+        assert text[13:18].hex() == "e800000000"
+
+    def test_data_directives(self):
+        assembler = ElfAssembler("".join([
+            "section .raw_string_1\n",
+            "    raw_string_1 db 'a;b, c', 0\n",
+            "    raw_len_1 equ $ - raw_string_1\n",
+            "    number_1 dw -2\n",
+            "section .bss\n",
+            "    buffer resq 4\n",
+        ]))
+        assembler.assemble()
+        assert bytes(assembler.sections[".raw_string_1"]) == b"a;b, c\x00\xfe\xff"
+        assert assembler.symbols["raw_len_1"] == (None, 7)
+        assert len(assembler.sections[".bss"]) == 32
+
+    def test_elf_header(self):
+        lines = ["main() {\n", "    print(1);\n", "}\n"]
+        assembler = ElfAssembler(Compiler(get_nodes(get_token_list(lines))).get_compiled_program())
+        executable = assembler.assemble()
+        assert executable[:4] == b"\x7fELF"
+        entry = int.from_bytes(executable[24:32], "little")
+        section, offset = assembler.symbols["_start"]
+        assert section == ".text"
+        assert executable[entry - ELF_BASE_ADDRESS:][:8] == assembler.sections[".text"][offset:offset + 8]
+
+    @pytest.mark.parametrize("line", [
+        "    mov ah, sil\n",
+        "    mov [rax], [rbx]\n",
+        "    mov [rax], 1\n",
+        "    push 0x100000000\n",
+        "    fld st0\n",
+        "    jmp missing_label\n",
+    ])
+    def test_unsupported_assembly(self, line):
+        with pytest.raises(UnsupportedAssemblyError) as error:
+            ElfAssembler("".join(["global _start\n", "section .text\n", "    _start:\n", line])).assemble()
+        assert error.value.line_num == 4
+        assert error.value.line == line.strip()
+
+    def test_unsupported_assembly_when_run(self, tmp_path, capsys):
+        compiled_program = "".join(["global _start\n", "section .text\n", "    _start:\n", "    push 3000000000\n"])
+        with pytest.raises(SystemExit) as error:
+            run_program("elf", compiled_program, output=str(tmp_path / "out"))
+        assert error.value.code == 1
+        assert capsys.readouterr().out.splitlines()[-3:] == [
+            "    push 3000000000",
+            "    ^",
+            "Cannot encode 'push 3000000000' on line 4 of the assembly: immediate doesn't fit in 32 bits.",
+        ]
+        assert not (tmp_path / "out").exists()
+
+    @pytest.mark.skipif(sys.platform != "linux" or platform.machine() != "x86_64", reason="Runs an x86-64 Linux executable.")
+    def test_executable_runs(self, tmp_path):
+        lines = [
+            "main() {\n",
+            "    string x = \"Hello\";\n",
+            "    loopUp(3) {\n",
+            "        printl(x);\n",
+            "    }\n",
+            "    printl(12 + 30);\n",
+            "}\n",
+        ]
+        executable_path = str(tmp_path / "out")
+        write_elf_executable(Compiler(get_nodes(get_token_list(lines))).get_compiled_program(), executable_path)
+        result = subprocess.run([executable_path], stdout=subprocess.PIPE, check=True)
+        line_end = b"\n\x00\x00\x00\r\x00\x00\x00"
+        number = b"".join(digit + bytes(7) for digit in (b"4", b"2"))
+        assert result.stdout == (b"Hello" + line_end) * 3 + number + line_end
+
+    @pytest.mark.skipif(sys.platform != "linux" or platform.machine() != "x86_64", reason="Runs an x86-64 Linux executable.")
+    def test_grouped_expressions_print(self, tmp_path):
+        lines = [
+            "main() {\n",
+            "    int64 x = 2;\n",
+            "    printl(x * (x + 4));\n",
+            "    printl(x * 7 / 2);\n",
+            "}\n",
+        ]
+        executable_path = str(tmp_path / "out")
+        write_elf_executable(Compiler(get_nodes(get_token_list(lines))).get_compiled_program(), executable_path)
+        result = subprocess.run([executable_path], stdout=subprocess.PIPE, check=True)
+        line_end = b"\n\x00\x00\x00\r\x00\x00\x00"
+        numbers = [b"".join(digit + bytes(7) for digit in digits) for digits in ((b"1", b"2"), (b"7",))]
+        assert result.stdout == numbers[0] + line_end + numbers[1] + line_end
+
+
+class TestBuildCache:
+    """
+    All tests related to caching builds of programs that are run
+    """
+
+    options = {"backend": "nasm", "optimize": False}
+
+    @pytest.fixture
+    def build_dir(self, tmp_path, monkeypatch):
+        monkeypatch.setattr("katana.katana.BUILD_CACHE_DIR", str(tmp_path / "cache"))
+        monkeypatch.chdir(tmp_path)
+        (tmp_path / "program.ktna").write_text("main() {\n    print(1);\n}\n")
+        return tmp_path
+
+    def test_key_changes_with_program_and_options(self, build_dir):
+        key = get_build_cache_key("program.ktna", self.options)
+        assert key == get_build_cache_key("program.ktna", dict(reversed(list(self.options.items()))))
+        assert key != get_build_cache_key("program.ktna", {**self.options, "optimize": True})
+        (build_dir / "program.ktna").write_text("main() {\n    print(2);\n}\n")
+        assert key != get_build_cache_key("program.ktna", self.options)
+
+    def test_store_and_restore(self, build_dir):
+        key = get_build_cache_key("program.ktna", self.options)
+        assert not restore_cached_build(key)
+        (build_dir / "out.asm").write_text(";; Start of program\n")
+        (build_dir / "out").write_bytes(b"\x7fELF")
+        os.chmod(build_dir / "out", 0o755)
+        store_cached_build(key, "out", ["", ".asm"])
+        os.remove(build_dir / "out.asm")
+        os.remove(build_dir / "out")
+        assert restore_cached_build(key)
+        assert (build_dir / "out.asm").read_text() == ";; Start of program\n"
+        assert (build_dir / "out").read_bytes() == b"\x7fELF"
+        assert os.access(build_dir / "out", os.X_OK)
+
+    def test_store_twice_keeps_first_build(self, build_dir):
+        (build_dir / "out").write_bytes(b"first")
+        store_cached_build("key", "out", [""])
+        (build_dir / "out").write_bytes(b"second")
+        store_cached_build("key", "out", [""])
+        assert os.listdir(build_dir / "cache") == ["key"]
+        assert (build_dir / "cache" / "key" / "out").read_bytes() == b"first"
+
+    def test_restore_to_output_path(self, build_dir):
+        (build_dir / "out").write_bytes(b"\x7fELF")
+        (build_dir / "out.o").write_bytes(b"object")
+        store_cached_build("key", "out", ["", ".o"])
+        os.mkdir(build_dir / "build")
+        assert restore_cached_build("key", os.path.join("build", "program"))
+        assert sorted(os.listdir(build_dir / "build")) == ["program", "program.o"]
+        assert (build_dir / "build" / "program.o").read_bytes() == b"object"
+
+    @patch("katana.katana.os.system", return_value=0)
+    def test_build_at_output_path(self, mock_system, build_dir):
+        run_program(output="build dir/program")
+        assert [call.args[0] for call in mock_system.call_args_list] == [
+            "nasm -f elf64 -o 'build dir/program.o' 'build dir/program.asm'",
+            "ld -o 'build dir/program' 'build dir/program.o'",
+            "'./build dir/program'",
+        ]
+
+    @patch("katana.katana.os.system", return_value=256)
+    def test_failed_build_not_cached(self, mock_system, build_dir):
+        (build_dir / "out.asm").write_text("")
+        (build_dir / "out").write_bytes(b"left over from an earlier build")
+        run_program(cache_key="key")
+        assert not restore_cached_build("key")
+        assert mock_system.call_args_list[-1].args == ("./out",)
+
+
+class TestBuildStats:
+    """
+    All tests related to the timing and memory stats printed with --stats
+    """
+
+    @pytest.fixture(autouse=True)
+    def stop_tracing(self):
+        yield
+        tracemalloc.stop()
+
+    def test_phases_recorded(self):
+        stats = BuildStats()
+        with stats.phase("compile"):
+            allocated = [bytes(1024) for _ in range(100)]
+        with stats.phase("run", traced=False):
+            pass
+        assert [phase["phase"] for phase in stats.phases] == ["compile", "run"]
+        assert stats.phases[0]["peak_memory_bytes"] >= 100 * 1024
+        assert stats.phases[0]["seconds"] >= 0
+        assert stats.phases[1]["peak_memory_bytes"] is None
+        del allocated
+
+    def test_disabled_records_nothing(self):
+        stats = BuildStats(enabled=False)
+        with stats.phase("compile"):
+            pass
+        assert stats.phases == []
+        assert not tracemalloc.is_tracing()
+
+    def test_reports(self):
+        stats = BuildStats()
+        with stats.phase("lex"):
+            pass
+        with stats.phase("nasm", traced=False):
+            pass
+        stats.counts["tokens"] = 12
+        report = json.loads(stats.report("json"))
+        assert [phase["phase"] for phase in report["phases"]] == ["lex", "nasm"]
+        assert report["tokens"] == 12
+        text_lines = stats.report("text").splitlines()
+        assert text_lines[0].split() == ["phase", "time", "peak", "memory"]
+        assert text_lines[1].startswith("lex") and text_lines[1].endswith("KiB")
+        assert text_lines[2].startswith("nasm") and text_lines[2].endswith("-")
+        assert text_lines[3] == "tokens: 12"
+
+    def test_streamed_tokens_counted(self):
+        stats = BuildStats()
+        tokens = list(stats.count_tokens(iter(get_token_list(["main() {\n", "    print(1);\n", "}\n"]))))
+        assert stats.counts["tokens"] == len(tokens)
+
+    def test_counts(self):
+        lines = ["main() {\n", "    loopUp(3) {\n", "        print(1 + 2);\n", "    }\n", "}\n"]
+        nodes = get_nodes(get_token_list(lines))
+        # The start node, the loop and the 3 it counts up to, the print, the
+        # addition and both of its numbers.
+        assert count_nodes(nodes) == 7
+        assert count_asm_instructions("".join([
+            ";; Start of program\n",
+            "section .text\n",
+            "    _start:\n",
+            "    ;; Push number onto stack\n",
+            "    push 3\n",
+            "    number_1 dq 0\n",
+            "    syscall\n",
+        ])) == 2
@@ -1,9 +1,16 @@
+import io
+import os
+import subprocess
+import sys
 from unittest.mock import patch
 import pytest
 
 from katana.katana import (
+    FastLexer,
     Lexer,
+    MappedProgram,
     Program,
+    StreamingProgram,
     Token,
     ASSIGNMENT_TOKEN_TYPE,
     BOOLEAN_TOKEN_TYPE,
@@ -35,6 +42,7 @@ from katana.katana import (
     MACRO_REFERENCE_TOKEN_TYPE,
     MINUS_TOKEN_TYPE,
     MULTIPLY_TOKEN_TYPE,
+    NEW_LINE_TOKEN_TYPE,
     NUM_TOKEN_TYPE,
     PLUS_TOKEN_TYPE,
     RANGE_INDICATION_TOKEN_TYPE,
@@ -113,6 +121,24 @@ class TestLexerComments:
         lexer = Lexer(program)
         assert token_list == lexer.lex()
 
+    def test_comments_at_different_columns(self):
+        program = Program(["1; // First\n", "1 + 2;\n", "1 + 2; // Second\n"])
+        token_list = [Token(NUM_TOKEN_TYPE, 0, 0, "1", LOW),
+                      Token(EOL_TOKEN_TYPE, 1, 0, ";", LOW),
+                      Token(COMMENT_TOKEN_TYPE, 3, 0, "// First", LOW),
+                      Token(NUM_TOKEN_TYPE, 0, 1, "1", LOW),
+                      Token(PLUS_TOKEN_TYPE, 2, 1, "+", MEDIUM),
+                      Token(NUM_TOKEN_TYPE, 4, 1, "2", LOW),
+                      Token(EOL_TOKEN_TYPE, 5, 1, ";", LOW),
+                      Token(NUM_TOKEN_TYPE, 0, 2, "1", LOW),
+                      Token(PLUS_TOKEN_TYPE, 2, 2, "+", MEDIUM),
+                      Token(NUM_TOKEN_TYPE, 4, 2, "2", LOW),
+                      Token(EOL_TOKEN_TYPE, 5, 2, ";", LOW),
+                      Token(COMMENT_TOKEN_TYPE, 7, 2, "// Second", LOW),
+                      Token(EOF_TOKEN_TYPE, 0, 3, "EOF", LOW)]
+        lexer = Lexer(program)
+        assert token_list == lexer.lex()
+
 
 class TestLexerBasicLexingAbilities:
     """
@@ -353,6 +379,26 @@ class TestLexerParenthesis:
             lexer.lex()
         mock_print.assert_called_with(["1 + 2) + 3;\n"], 5, UnclosedParenthesisError(0, 5))
 
+    def test_paren_grouping_inside_assignment(self):
+        program = Program(["x = (1 + 2) * 3;\n"])
+        lexer = Lexer(program)
+        lexer.variable_names.add("x")
+        token_list = [
+            Token(VARIABLE_REFERENCE_TOKEN_TYPE, 0, 0, "x", LOW),
+            Token(ASSIGNMENT_TOKEN_TYPE, 2, 0, "=", HIGH),
+            Token(LEFT_PAREN_TOKEN_TYPE, 4, 0, "(", VERY_HIGH),
+            Token(NUM_TOKEN_TYPE, 5, 0, "1", LOW),
+            Token(PLUS_TOKEN_TYPE, 7, 0, "+", MEDIUM),
+            Token(NUM_TOKEN_TYPE, 9, 0, "2", LOW),
+            Token(RIGHT_PAREN_TOKEN_TYPE, 10, 0, ")", VERY_HIGH),
+            Token(MULTIPLY_TOKEN_TYPE, 12, 0, "*", HIGH),
+            Token(NUM_TOKEN_TYPE, 14, 0, "3", LOW),
+            Token(EOL_TOKEN_TYPE, 15, 0, ";", LOW),
+            Token(EOF_TOKEN_TYPE, 0, 1, "EOF", LOW),
+        ]
+        assert token_list == lexer.lex()
+
+
 class TestLexerEndOfLineSemicolon:
     """
     Tests to ensure that the lines that should end in a semicolon do so.
@@ -1626,3 +1672,156 @@ class TestLexerFunction:
         ]
         lexer = Lexer(program)
         assert token_list == lexer.lex()
+
+
+def get_all_program_paths():
+    curr_dir = os.getcwd()
+    paths = []
+    for program_dir in ["/sample_programs", "/tests/test_programs"]:
+        for program in sorted(os.listdir(curr_dir + program_dir)):
+            paths.append(curr_dir + program_dir + "/" + program)
+    return paths
+
+
+def lex_or_get_exception(lexer_class, lines):
+    with patch("katana.katana.print_exception_message") as mock_print:
+        try:
+            return lexer_class(Program(lines)).lex()
+        except SystemExit:
+            return mock_print.call_args
+
+
+def lex_program_or_get_exception(lex):
+    with patch("katana.katana.print_exception_message") as mock_print:
+        try:
+            return lex()
+        except SystemExit:
+            # Only the column and exception are compared because programs
+            # that aren't a list of lines pass something else for the lines.
+            return mock_print.call_args[0][1:]
+
+
+def stream_or_get_exception(lexer_class, lines):
+    program = StreamingProgram(io.StringIO("".join(lines)))
+    return lex_program_or_get_exception(lambda: list(lexer_class(program).iter_tokens()))
+
+
+def get_exception_position(result):
+    return result[0][1:] if not isinstance(result, list) else result
+
+
+class TestFastLexer:
+    """
+    The fast lexer must give back exactly the same tokens as the base lexer,
+    including the errors, for it to be a drop in replacement.
+    """
+
+    @pytest.mark.parametrize("program_path", get_all_program_paths())
+    def test_same_tokens_as_lexer(self, program_path):
+        with open(program_path) as f:
+            lines = f.readlines()
+        assert lex_or_get_exception(Lexer, lines) == lex_or_get_exception(FastLexer, lines)
+
+    @pytest.mark.parametrize(
+        "lines",
+        [
+            ["1 + 2; // Comment\n"],
+            ["    // Comment\n", "int64 x = 10;\n"],
+            ["print(\"a//b\");\n"],
+            ["int8\tx  =\t12 ;\n"],
+            ["foo(3+4);\n"],
+            ["3 + 4\n"],
+            ["1 + (2 + 3;\n"],
+            ["int64 1x = 3;\n"],
+            ["`;"],
+        ]
+    )
+    def test_same_tokens_as_lexer_for_snippets(self, lines):
+        assert lex_or_get_exception(Lexer, lines) == lex_or_get_exception(FastLexer, lines)
+
+
+class TestStreamingLexer:
+    """
+    Lexing a program a line at a time should give the same tokens and errors
+    as lexing the whole program at once.
+    """
+
+    @pytest.mark.parametrize("lexer_class", [Lexer, FastLexer])
+    @pytest.mark.parametrize("program_path", get_all_program_paths())
+    def test_same_tokens_as_lex(self, program_path, lexer_class):
+        with open(program_path) as f:
+            lines = f.readlines()
+        expected = get_exception_position(lex_or_get_exception(lexer_class, lines))
+        assert expected == stream_or_get_exception(lexer_class, lines)
+
+    @pytest.mark.parametrize(
+        "lines",
+        [
+            ["1 + 2; // Comment\n"],
+            ["3 + 4\n"],
+            ["1 + (2 + 3;\n"],
+            ["if (true) {\n", "}\n", "else {\n", "}\n"],
+            ["else {\n", "}\n"],
+        ]
+    )
+    def test_same_tokens_as_lex_for_snippets(self, lines):
+        expected = get_exception_position(lex_or_get_exception(Lexer, lines))
+        assert expected == stream_or_get_exception(Lexer, lines)
+
+    def test_new_lines_are_not_kept(self):
+        lexer = Lexer(StreamingProgram(io.StringIO("1 + 2;\n3 + 4;\n")))
+        token_types = [token.ttype for token in lexer.iter_tokens()]
+        assert NEW_LINE_TOKEN_TYPE not in token_types
+        assert lexer.token_list == []
+
+    def test_only_recent_lines_are_kept(self):
+        program = StreamingProgram(io.StringIO("1 + 2;\n" * 100), window_size=4)
+        list(Lexer(program).iter_tokens())
+        assert len(program.lines.lines) == 4
+        assert program.lines[96:100] == ["1 + 2;\n"] * 4
+
+
+class TestMappedProgram:
+    """
+    Lexing a memory mapped program should give the same tokens as lexing the
+    lines read from the file.
+    """
+
+    @pytest.mark.parametrize("program_path", get_all_program_paths())
+    def test_same_tokens_as_lex(self, program_path):
+        with open(program_path) as f:
+            lines = f.readlines()
+        expected = get_exception_position(lex_or_get_exception(Lexer, lines))
+        with open(program_path) as f:
+            program = MappedProgram(f)
+            assert program.lines[:] == lines
+            assert expected == lex_program_or_get_exception(lambda: Lexer(program).lex())
+
+    def test_lines_without_trailing_new_line(self, tmp_path):
+        program_path = tmp_path / "program.ktna"
+        program_path.write_bytes(b"1 + 2;\r\n3 + 4;")
+        with open(program_path) as f:
+            program = MappedProgram(f)
+            assert len(program.lines) == 2
+            assert program.lines[0] == "1 + 2;\n"
+            assert program.lines[-1] == "3 + 4;"
+            assert program.lines[0:5] == ["1 + 2;\n", "3 + 4;"]
+
+    def test_closed_after_with(self, tmp_path):
+        program_path = tmp_path / "program.ktna"
+        program_path.write_text("1 + 2;\n")
+        with open(program_path) as f:
+            with MappedProgram(f) as program:
+                assert program.lines[0] == "1 + 2;\n"
+            assert program.mapped.closed
+
+    @pytest.mark.parametrize("reader_flags", [[], ["--stream"], ["--mmap"]])
+    def test_empty_program(self, tmp_path, reader_flags):
+        program_path = tmp_path / "empty.ktna"
+        program_path.write_text("")
+        katana_path = os.path.join(os.path.dirname(__file__), "..", "katana", "katana.py")
+        result = subprocess.run([sys.executable, katana_path, "--program", str(program_path), "--lex"] + reader_flags,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        assert result.returncode == 1
+        assert result.stdout == f"{program_path} is empty.\n"
+        assert result.stderr == ""
@@ -652,6 +652,170 @@ class TestParserParenthesis:
         parser.parse()
         assert [ast] == parser.get_nodes()
 
+    def test_nested_paren(self):
+        """
+        Given a program like:
+        main() {
+            2 * ((1 + 2) * 3);
+        }
+        Expected to return an AST like:
+        (2*((1+2)*3))
+        """
+        token_list = [
+            Token(KEYWORD_TOKEN_TYPE, 0, 0, "main", 4),
+            Token(LEFT_PAREN_TOKEN_TYPE, 4, 0, "(", 3),
+            Token(RIGHT_PAREN_TOKEN_TYPE, 5, 0, ")", 3),
+            Token(LEFT_CURL_BRACE_TOKEN_TYPE, 7, 0, "{", 3),
+            Token(NUM_TOKEN_TYPE, 0, 1, "2", LOW),
+            Token(MULTIPLY_TOKEN_TYPE, 2, 1, "*", HIGH),
+            Token(LEFT_PAREN_TOKEN_TYPE, 4, 1, "(", VERY_HIGH),
+            Token(LEFT_PAREN_TOKEN_TYPE, 5, 1, "(", VERY_HIGH),
+            Token(NUM_TOKEN_TYPE, 6, 1, "1", LOW),
+            Token(PLUS_TOKEN_TYPE, 8, 1, "+", MEDIUM),
+            Token(NUM_TOKEN_TYPE, 10, 1, "2", LOW),
+            Token(RIGHT_PAREN_TOKEN_TYPE, 11, 1, ")", VERY_HIGH),
+            Token(MULTIPLY_TOKEN_TYPE, 13, 1, "*", HIGH),
+            Token(NUM_TOKEN_TYPE, 15, 1, "3", LOW),
+            Token(RIGHT_PAREN_TOKEN_TYPE, 16, 1, ")", VERY_HIGH),
+            Token(EOL_TOKEN_TYPE, 17, 1, ";", LOW),
+            Token(RIGHT_CURL_BRACE_TOKEN_TYPE, 0, 2, "}", 3),
+            Token(EOF_TOKEN_TYPE, 0, 2, "EOF", LOW),
+        ]
+        two_node = NumberNode(token_list[4], "2")
+        one_node = NumberNode(token_list[8], "1")
+        other_two_node = NumberNode(token_list[10], "2")
+        three_node = NumberNode(token_list[13], "3")
+        plus_node = PlusMinusNode(token_list[9], "+", one_node, other_two_node)
+        # Promote priorities because of parenthesis
+        plus_node.priority += 2
+        inner_mult_node = MultiplyDivideNode(token_list[12], "*", plus_node, three_node)
+        inner_mult_node.priority += 1
+        outer_mult_node = MultiplyDivideNode(token_list[5], "*", two_node, inner_mult_node)
+        ast = StartNode(token_list[0], "main", [outer_mult_node])
+        parser = Parser(token_list)
+        parser.parse()
+        assert [ast] == parser.get_nodes()
+
+    def test_mult_in_paren_before_add(self):
+        """
+        Given a program like:
+        main() {
+            2 * (3 + 4);
+        }
+        Expected to return an AST like:
+        (2*(3+4))
+        """
+        token_list = [
+            Token(KEYWORD_TOKEN_TYPE, 0, 0, "main", 4),
+            Token(LEFT_PAREN_TOKEN_TYPE, 4, 0, "(", 3),
+            Token(RIGHT_PAREN_TOKEN_TYPE, 5, 0, ")", 3),
+            Token(LEFT_CURL_BRACE_TOKEN_TYPE, 7, 0, "{", 3),
+            Token(NUM_TOKEN_TYPE, 0, 1, "2", LOW),
+            Token(MULTIPLY_TOKEN_TYPE, 2, 1, "*", HIGH),
+            Token(LEFT_PAREN_TOKEN_TYPE, 4, 1, "(", VERY_HIGH),
+            Token(NUM_TOKEN_TYPE, 5, 1, "3", LOW),
+            Token(PLUS_TOKEN_TYPE, 7, 1, "+", MEDIUM),
+            Token(NUM_TOKEN_TYPE, 9, 1, "4", LOW),
+            Token(RIGHT_PAREN_TOKEN_TYPE, 10, 1, ")", VERY_HIGH),
+            Token(EOL_TOKEN_TYPE, 11, 1, ";", LOW),
+            Token(RIGHT_CURL_BRACE_TOKEN_TYPE, 0, 2, "}", 3),
+            Token(EOF_TOKEN_TYPE, 0, 2, "EOF", LOW),
+        ]
+        two_node = NumberNode(token_list[4], "2")
+        three_node = NumberNode(token_list[7], "3")
+        four_node = NumberNode(token_list[9], "4")
+        plus_node = PlusMinusNode(token_list[8], "+", three_node, four_node)
+        plus_node.priority += 1
+        mult_node = MultiplyDivideNode(token_list[5], "*", two_node, plus_node)
+        ast = StartNode(token_list[0], "main", [mult_node])
+        parser = Parser(token_list)
+        parser.parse()
+        assert [ast] == parser.get_nodes()
+
+    def test_group_closed_before_call(self):
+        """
+        Given a program like:
+        main() {
+            print((1 + 2) * 3);
+        }
+        Expected the first `)` to close the group and the second to close the
+        call, returning an AST like:
+        (main[(print((1+2)*3))])
+        """
+        token_list = [
+            Token(KEYWORD_TOKEN_TYPE, 0, 0, "main", 4),
+            Token(LEFT_PAREN_TOKEN_TYPE, 4, 0, "(", 3),
+            Token(RIGHT_PAREN_TOKEN_TYPE, 5, 0, ")", 3),
+            Token(LEFT_CURL_BRACE_TOKEN_TYPE, 7, 0, "{", 3),
+            Token(KEYWORD_TOKEN_TYPE, 4, 1, "print", 4),
+            Token(LEFT_PAREN_TOKEN_TYPE, 9, 1, "(", 3),
+            Token(LEFT_PAREN_TOKEN_TYPE, 10, 1, "(", 3),
+            Token(NUM_TOKEN_TYPE, 11, 1, "1", LOW),
+            Token(PLUS_TOKEN_TYPE, 13, 1, "+", MEDIUM),
+            Token(NUM_TOKEN_TYPE, 15, 1, "2", LOW),
+            Token(RIGHT_PAREN_TOKEN_TYPE, 16, 1, ")", 3),
+            Token(MULTIPLY_TOKEN_TYPE, 18, 1, "*", HIGH),
+            Token(NUM_TOKEN_TYPE, 20, 1, "3", LOW),
+            Token(RIGHT_PAREN_TOKEN_TYPE, 21, 1, ")", 3),
+            Token(EOL_TOKEN_TYPE, 22, 1, ";", LOW),
+            Token(RIGHT_CURL_BRACE_TOKEN_TYPE, 0, 2, "}", 3),
+            Token(EOF_TOKEN_TYPE, 0, 3, "EOF", LOW),
+        ]
+        one_node = NumberNode(token_list[7], "1")
+        two_node = NumberNode(token_list[9], "2")
+        three_node = NumberNode(token_list[12], "3")
+        plus_node = PlusMinusNode(token_list[8], "+", one_node, two_node)
+        # Promote priority because of parenthesis
+        plus_node.priority += 1
+        multiply_node = MultiplyDivideNode(token_list[11], "*", plus_node, three_node)
+        print_node = FunctionKeywordNode(token_list[4], "print", [multiply_node])
+        ast = StartNode(token_list[0], "main", [print_node])
+        parser = Parser(token_list)
+        parser.parse()
+        assert [ast] == parser.get_nodes()
+
+    def test_group_and_call_closed_together(self):
+        """
+        Given a program like:
+        main() {
+            print(1 + (2 * 3));
+        }
+        Expected the first of the `))` to close the group and the second to
+        close the call, returning an AST like:
+        (main[(print(1+(2*3)))])
+        """
+        token_list = [
+            Token(KEYWORD_TOKEN_TYPE, 0, 0, "main", 4),
+            Token(LEFT_PAREN_TOKEN_TYPE, 4, 0, "(", 3),
+            Token(RIGHT_PAREN_TOKEN_TYPE, 5, 0, ")", 3),
+            Token(LEFT_CURL_BRACE_TOKEN_TYPE, 7, 0, "{", 3),
+            Token(KEYWORD_TOKEN_TYPE, 4, 1, "print", 4),
+            Token(LEFT_PAREN_TOKEN_TYPE, 9, 1, "(", 3),
+            Token(NUM_TOKEN_TYPE, 10, 1, "1", LOW),
+            Token(PLUS_TOKEN_TYPE, 12, 1, "+", MEDIUM),
+            Token(LEFT_PAREN_TOKEN_TYPE, 14, 1, "(", 3),
+            Token(NUM_TOKEN_TYPE, 15, 1, "2", LOW),
+            Token(MULTIPLY_TOKEN_TYPE, 17, 1, "*", HIGH),
+            Token(NUM_TOKEN_TYPE, 19, 1, "3", LOW),
+            Token(RIGHT_PAREN_TOKEN_TYPE, 20, 1, ")", 3),
+            Token(RIGHT_PAREN_TOKEN_TYPE, 21, 1, ")", 3),
+            Token(EOL_TOKEN_TYPE, 22, 1, ";", LOW),
+            Token(RIGHT_CURL_BRACE_TOKEN_TYPE, 0, 2, "}", 3),
+            Token(EOF_TOKEN_TYPE, 0, 3, "EOF", LOW),
+        ]
+        one_node = NumberNode(token_list[6], "1")
+        two_node = NumberNode(token_list[9], "2")
+        three_node = NumberNode(token_list[11], "3")
+        multiply_node = MultiplyDivideNode(token_list[10], "*", two_node, three_node)
+        # Promote priority because of parenthesis
+        multiply_node.priority += 1
+        plus_node = PlusMinusNode(token_list[7], "+", one_node, multiply_node)
+        print_node = FunctionKeywordNode(token_list[4], "print", [plus_node])
+        ast = StartNode(token_list[0], "main", [print_node])
+        parser = Parser(token_list)
+        parser.parse()
+        assert [ast] == parser.get_nodes()
+
 
 class TestParserPrint:
     """
@@ -2384,6 +2548,60 @@ class TestParserIfElse:
         parser.parse()
         assert [ast] == parser.get_nodes()
 
+    def test_if_keyword_nested_paren_condition(self):
+        """
+        Given a program like:
+        main() {
+            if ((1 + 2) > 2) {
+                print("yes");
+            }
+        }
+        Expected the grouping paren inside the condition to close before the
+        condition does, returning an AST like:
+        (main[(if((1+2)>2, print("yes"), None))])
+        """
+        token_list = [
+            Token(KEYWORD_TOKEN_TYPE, 0, 0, "main", 4),
+            Token(LEFT_PAREN_TOKEN_TYPE, 4, 0, "(", 3),
+            Token(RIGHT_PAREN_TOKEN_TYPE, 5, 0, ")", 3),
+            Token(LEFT_CURL_BRACE_TOKEN_TYPE, 7, 0, "{", 3),
+            Token(KEYWORD_TOKEN_TYPE, 4, 1, "if", 4),
+            Token(LEFT_PAREN_TOKEN_TYPE, 7, 1, "(", 3),
+            Token(LEFT_PAREN_TOKEN_TYPE, 8, 1, "(", 3),
+            Token(NUM_TOKEN_TYPE, 9, 1, "1", 0),
+            Token(PLUS_TOKEN_TYPE, 11, 1, "+", 1),
+            Token(NUM_TOKEN_TYPE, 13, 1, "2", 0),
+            Token(RIGHT_PAREN_TOKEN_TYPE, 14, 1, ")", 3),
+            Token(GREATER_THAN_TOKEN_TYPE, 16, 1, ">", 2),
+            Token(NUM_TOKEN_TYPE, 18, 1, "2", 0),
+            Token(RIGHT_PAREN_TOKEN_TYPE, 19, 1, ")", 3),
+            Token(LEFT_CURL_BRACE_TOKEN_TYPE, 21, 1, "{", 3),
+            Token(KEYWORD_TOKEN_TYPE, 8, 2, "print", 4),
+            Token(LEFT_PAREN_TOKEN_TYPE, 13, 2, "(", 3),
+            Token(STRING_TOKEN_TYPE, 14, 2, "yes", 0),
+            Token(RIGHT_PAREN_TOKEN_TYPE, 19, 2, ")", 3),
+            Token(EOL_TOKEN_TYPE, 20, 2, ";", 0),
+            Token(RIGHT_CURL_BRACE_TOKEN_TYPE, 4, 3, "}", 3),
+            Token(RIGHT_CURL_BRACE_TOKEN_TYPE, 0, 4, "}", 3),
+            Token(EOF_TOKEN_TYPE, 0, 5, "EOF", 0),
+        ]
+        one_node = NumberNode(token_list[7], "1")
+        two_node = NumberNode(token_list[9], "2")
+        plus_node = PlusMinusNode(token_list[8], "+", one_node, two_node)
+        # Promote priority because of parenthesis
+        plus_node.priority += 1
+        other_two_node = NumberNode(token_list[12], "2")
+        greater_than_node = CompareNode(token_list[11], ">", plus_node, other_two_node)
+        yes_string_node = StringNode(token_list[17], "yes")
+        print_node = FunctionKeywordNode(token_list[15], "print", [yes_string_node])
+        if_node = LogicKeywordNode(
+            token_list[4], "if", greater_than_node, None, [print_node], None
+        )
+        ast = StartNode(token_list[0], "main", [if_node])
+        parser = Parser(token_list)
+        parser.parse()
+        assert [ast] == parser.get_nodes()
+
 
 class TestParserLoopKeyword:
     """
@@ -4111,6 +4329,37 @@ class TestParserVariablesOutsideMain:
         parser.parse()
         assert [keyword_node, start_node] == parser.get_nodes()
 
+    def test_int_before_main_from_token_iterator(self):
+        """
+        Same as `test_int_before_main` but the parser pulls the tokens from an
+        iterator like the one given by `Lexer.iter_tokens`.
+        """
+        token_list = [
+            Token(KEYWORD_TOKEN_TYPE, 0, 0, "const", 4),
+            Token(KEYWORD_TOKEN_TYPE, 6, 0, "int64", 4),
+            Token(VARIABLE_NAME_TOKEN_TYPE, 12, 0, "x", 0),
+            Token(ASSIGNMENT_TOKEN_TYPE, 14, 0, "=", 2),
+            Token(NUM_TOKEN_TYPE, 16, 0, "3", 0),
+            Token(EOL_TOKEN_TYPE, 17, 0, ";", 0),
+            Token(KEYWORD_TOKEN_TYPE, 0, 2, "main", 4),
+            Token(LEFT_PAREN_TOKEN_TYPE, 4, 2, "(", 3),
+            Token(RIGHT_PAREN_TOKEN_TYPE, 5, 2, ")", 3),
+            Token(LEFT_CURL_BRACE_TOKEN_TYPE, 7, 2, "{", 3),
+            Token(KEYWORD_TOKEN_TYPE, 4, 3, "print", 4),
+            Token(LEFT_PAREN_TOKEN_TYPE, 9, 3, "(", 3),
+            Token(VARIABLE_REFERENCE_TOKEN_TYPE, 10, 3, "x", 0),
+            Token(RIGHT_PAREN_TOKEN_TYPE, 11, 3, ")", 3),
+            Token(EOL_TOKEN_TYPE, 12, 3, ";", 0),
+            Token(RIGHT_CURL_BRACE_TOKEN_TYPE, 0, 4, "}", 3),
+            Token(EOF_TOKEN_TYPE, 0, 5, "EOF", 0),
+        ]
+        list_parser = Parser(token_list)
+        list_parser.parse()
+        iter_parser = Parser(iter(token_list))
+        iter_parser.parse()
+        assert list_parser.get_nodes() == iter_parser.get_nodes()
+        assert iter_parser.get_nodes()[0].child_node.child_node.left_side.is_const
+
 
 class TestParserMacro:
     """
@@ -4206,6 +4455,86 @@ class TestParserMacro:
         ast = StartNode(token_list[11], "main", [print_node])
         assert [macro_node, ast] == parser.get_nodes()
 
+    def test_macro_referenced_twice_gets_separate_nodes(self):
+        """
+        Given a program like:
+        MACRO printSeven {
+            print(3 + 4);
+        }
+        main() {
+            printSeven;
+            printSeven;
+        }
+        Expected each reference to get its own copy of the macro body.
+        """
+        token_list = [
+            Token(MACRO_KEYWORD_TOKEN_TYPE, 0, 0, "MACRO", 4),
+            Token(MACRO_NAME_TOKEN_TYPE, 6, 0, "printSeven", 0),
+            Token(LEFT_CURL_BRACE_TOKEN_TYPE, 17, 0, "{", 3),
+            Token(KEYWORD_TOKEN_TYPE, 4, 1, "print", 4),
+            Token(LEFT_PAREN_TOKEN_TYPE, 9, 1, "(", 3),
+            Token(NUM_TOKEN_TYPE, 10, 1, "3", 0),
+            Token(PLUS_TOKEN_TYPE, 12, 1, "+", 1),
+            Token(NUM_TOKEN_TYPE, 14, 1, "4", 0),
+            Token(RIGHT_PAREN_TOKEN_TYPE, 15, 1, ")", 3),
+            Token(EOL_TOKEN_TYPE, 16, 1, ";", 0),
+            Token(RIGHT_CURL_BRACE_TOKEN_TYPE, 0, 2, "}", 3),
+            Token(KEYWORD_TOKEN_TYPE, 0, 4, "main", 4),
+            Token(LEFT_PAREN_TOKEN_TYPE, 4, 4, "(", 3),
+            Token(RIGHT_PAREN_TOKEN_TYPE, 5, 4, ")", 3),
+            Token(LEFT_CURL_BRACE_TOKEN_TYPE, 7, 4, "{", 3),
+            Token(MACRO_REFERENCE_TOKEN_TYPE, 4, 5, "printSeven", 0),
+            Token(EOL_TOKEN_TYPE, 14, 5, ";", 0),
+            Token(MACRO_REFERENCE_TOKEN_TYPE, 4, 6, "printSeven", 0),
+            Token(EOL_TOKEN_TYPE, 14, 6, ";", 0),
+            Token(RIGHT_CURL_BRACE_TOKEN_TYPE, 0, 7, "}", 3),
+            Token(EOF_TOKEN_TYPE, 0, 8, "EOF", 0),
+        ]
+        parser = Parser(token_list)
+        parser.parse()
+        macro_node, ast = parser.get_nodes()
+        first_print_node, second_print_node = ast.children_nodes
+        assert first_print_node == macro_node.children_nodes[0]
+        assert second_print_node == macro_node.children_nodes[0]
+        assert first_print_node is not second_print_node
+        assert first_print_node.arg_nodes[0] is not second_print_node.arg_nodes[0]
+        assert first_print_node.arg_nodes[0].parent_node is first_print_node
+        assert first_print_node.parent_node is ast
+
+    def test_macro_expansions_share_macro_node(self):
+        """
+        Given a program like:
+        MACRO printSeven {
+            print(3 + 4);
+        }
+        Expected every expansion of the macro body to be linked to the one
+        macro node instead of a copy of it.
+        """
+        token_list = [
+            Token(MACRO_KEYWORD_TOKEN_TYPE, 0, 0, "MACRO", 4),
+            Token(MACRO_NAME_TOKEN_TYPE, 6, 0, "printSeven", 0),
+            Token(LEFT_CURL_BRACE_TOKEN_TYPE, 17, 0, "{", 3),
+            Token(KEYWORD_TOKEN_TYPE, 4, 1, "print", 4),
+            Token(LEFT_PAREN_TOKEN_TYPE, 9, 1, "(", 3),
+            Token(NUM_TOKEN_TYPE, 10, 1, "3", 0),
+            Token(PLUS_TOKEN_TYPE, 12, 1, "+", 1),
+            Token(NUM_TOKEN_TYPE, 14, 1, "4", 0),
+            Token(RIGHT_PAREN_TOKEN_TYPE, 15, 1, ")", 3),
+            Token(EOL_TOKEN_TYPE, 16, 1, ";", 0),
+            Token(RIGHT_CURL_BRACE_TOKEN_TYPE, 0, 2, "}", 3),
+            Token(EOF_TOKEN_TYPE, 0, 3, "EOF", 0),
+        ]
+        parser = Parser(token_list)
+        parser.parse()
+        macro_node = parser.get_nodes()[0]
+        (first_print_node,) = parser.macros["printSeven"].expand()
+        (second_print_node,) = parser.macros["printSeven"].expand()
+        assert first_print_node is not second_print_node
+        assert first_print_node.parent_node is macro_node
+        assert second_print_node.parent_node is macro_node
+        assert macro_node.name_node.parent_node is macro_node
+        assert first_print_node.arg_nodes[0].parent_node is first_print_node
+
     @patch("katana.katana.print_exception_message")
     def test_macro_fails_declared_in_main(self, mock_print):
         """
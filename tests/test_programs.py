@@ -1,17 +1,45 @@
 import argparse
 import os
 import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 from itertools import zip_longest
 
 
 display_compare = False
+# Extra flags passed to katana when building the programs to compare.
+katana_flags = ""
 
 
-def compare_expected_output_to_program_output(expected_results_dir, input_file_dir):
+def build_and_run_program(program_path, output_file_name, flags):
+    # Every program is built in its own directory so they can all be built
+    # and run at the same time without writing over each other's files. The
+    # build cache is skipped so every output compared comes from a new build.
+    with tempfile.TemporaryDirectory() as build_dir:
+        os.system(
+            f'python katana/katana.py --program "{program_path}" --run --no-cache --output "{build_dir}/out"{flags} >> {output_file_name}')
+
+
+def build_and_run_programs(output_file_names, jobs):
+    """
+    Build and run each program path in `output_file_names` with its output
+    added to the file it maps to, running up to `jobs` programs at a time.
+    """
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        # The flags are passed along since the worker processes don't
+        # always get the globals set up when running as a script.
+        runs = [executor.submit(build_and_run_program, program_path, output_file_name, katana_flags)
+                for program_path, output_file_name in output_file_names.items()]
+    for run in runs:
+        run.result()
+
+
+def compare_expected_output_to_program_output(expected_results_dir, input_file_dir, jobs):
     results = {}
     to_be_compare_results = set()
     compared_results = set()
     os.mkdir("results")
+    output_file_names = {}
     for program in os.listdir(input_file_dir):
         output_file_name = os.getcwd() + "/results/" + \
             program.split('.')[0] + "_res.txt"
@@ -23,9 +51,11 @@ def compare_expected_output_to_program_output(expected_results_dir, input_file_d
             should_display = False
         if display_compare and should_display:
             print(f"Compiling {program}")
-        os.system(
-            f'python katana/katana.py --program "{input_file_dir}/{program}" --run >> {output_file_name}')
+        output_file_names[program] = output_file_name
+    build_and_run_programs({f"{input_file_dir}/{program}": output_file_name
+                            for program, output_file_name in output_file_names.items()}, jobs)
 
+    for program, output_file_name in output_file_names.items():
         with open(output_file_name, "r") as program_results:
             results[program.split(".")[0]] = program_results.readlines()
             to_be_compare_results.add(program.split(".")[0])
@@ -106,15 +136,16 @@ def clean_previous_outputs(sample_program_dir):
         os.remove(output_file_name)
 
 
-def build_expected_outputs(sample_program_dir):
+def build_expected_outputs(sample_program_dir, jobs):
+    output_file_names = {}
     for program in os.listdir(sample_program_dir):
         output_file_name = os.getcwd() + "/expected_outputs/" + \
             program.split('.')[0] + "_expected_output.txt"
-        os.system(
-            f'python katana/katana.py --program "{sample_program_dir}/{program}" --run >> {output_file_name}')
+        output_file_names[f"{sample_program_dir}/{program}"] = output_file_name
+    build_and_run_programs(output_file_names, jobs)
 
 
-def build_new_only(expected_results_dir, sample_program_dir):
+def build_new_only(expected_results_dir, sample_program_dir, jobs):
     # Build list of results that already exist
     expected_results_file_list = set()
     for program in os.listdir(expected_results_dir):
@@ -127,11 +158,12 @@ def build_new_only(expected_results_dir, sample_program_dir):
         sample_file_list.add(program.split(".")[0])
 
     if results_to_make := sample_file_list - expected_results_file_list:
+        output_file_names = {}
         for program in results_to_make:
             output_file_name = os.getcwd() + "/expected_outputs/" + \
                 program + "_expected_output.txt"
-            os.system(
-                f'python katana/katana.py --program "{sample_program_dir}/{program}.ktna" --run >> {output_file_name}')
+            output_file_names[f"{sample_program_dir}/{program}.ktna"] = output_file_name
+        build_and_run_programs(output_file_names, jobs)
 
 
 def clean_up_test():
@@ -151,6 +183,14 @@ if __name__ == "__main__":
                             help="List of tests to ignore.")
     arg_parser.add_argument("--display-list", nargs="+",
                             help="List of tests to display.")
+    arg_parser.add_argument("--optimize", action="store_true",
+                            help="Switch to compare the programs built with the peephole optimizer against the same expected outputs.")
+    arg_parser.add_argument("--register-loops", action="store_true",
+                            help="Switch to compare the programs built with loop indices kept in registers against the same expected outputs.")
+    arg_parser.add_argument("--backend", choices=["nasm", "elf"], default="nasm",
+                            help="Which backend katana builds the programs with before comparing them against the same expected outputs.")
+    arg_parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(),
+                            help="Number of programs to build and run at the same time. Defaults to the number of CPUs.")
 
     args = arg_parser.parse_args()
 
@@ -159,15 +199,21 @@ if __name__ == "__main__":
     display_compare = args.display_compare
     ignore_list = args.ignore or []
     display_list = args.display_list or []
+    katana_flags = ""
+    if args.optimize:
+        katana_flags += " --optimize"
+    if args.register_loops:
+        katana_flags += " --register-loops"
+    katana_flags += f" --backend={args.backend}"
 
     try:
         if recreate_expected_outputs:
             clean_previous_outputs("./expected_outputs")
-            build_expected_outputs("./sample_programs")
+            build_expected_outputs("./sample_programs", args.jobs)
         if new_only:
-            build_new_only("./expected_outputs", "./sample_programs")
+            build_new_only("./expected_outputs", "./sample_programs", args.jobs)
         compare_expected_output_to_program_output(
-            "./expected_outputs", "./sample_programs")
+            "./expected_outputs", "./sample_programs", args.jobs)
         print("Passed")
     except Exception as ex:
         print(ex)